@@ -0,0 +1,88 @@
+"""Background loading of meshes and textures.
+
+File I/O, mesh cache reads and image decoding run on a thread pool. Parsing wavefront files and
+optimising meshes is CPU bound and partly pure Python, so it goes to a process pool (started on the
+first cache miss) to not hold the GIL.
+Workers only produce NumPy buffers; uploads happen on the GL thread in `AssetLoader.process`,
+within a per-frame time budget.
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class AssetLoader:
+    def __init__(self, workers: int = 4, upload_budget: float = 0.004):
+        """Prepares assets on worker threads and uploads them on the GL thread.
+
+        :param workers: Number of worker threads (and parsing processes).
+        :param upload_budget: Seconds per frame spent uploading finished assets. At least one asset is
+            uploaded every frame, so large ones cannot stall loading.
+        """
+        self.upload_budget: float = upload_budget
+        self._workers = workers
+        self._threads = ThreadPoolExecutor(workers, thread_name_prefix="asset-loader")
+        self._processes = None
+        self._processes_lock = threading.Lock()
+        self._jobs = []  # (future, on_ready) in submission order
+
+    @property
+    def pending(self) -> int:
+        """Number of assets not uploaded yet."""
+        return len(self._jobs)
+
+    def submit(self, work, on_ready, *args) -> None:
+        """
+        Runs `work(*args)` on a worker thread, then `on_ready(result)` on the GL thread.
+
+        :param work: Function preparing CPU side data, must not call OpenGL.
+        :param on_ready: Called from `process` with the result, uploads it.
+        """
+        self._jobs.append((self._threads.submit(work, *args), on_ready))
+
+    def run_in_process(self, work, *args):
+        """Runs `work(*args)` in a parsing process and waits for the result. Called from worker threads."""
+        with self._processes_lock:
+            if self._processes is None:
+                # Forking a process with a GL context and running threads is unsafe
+                self._processes = ProcessPoolExecutor(self._workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._processes.submit(work, *args).result()
+
+    def process(self, budget: float = None) -> int:
+        """
+        Uploads finished assets until the time budget runs out.
+
+        :param budget: Seconds to spend, `upload_budget` by default.
+        :return: Number of uploaded assets.
+        """
+        budget = self.upload_budget if budget is None else budget
+        start = time.perf_counter()
+        uploaded = 0
+        for job in list(self._jobs):
+            future, on_ready = job
+            if not future.done():
+                continue
+            self._jobs.remove(job)
+            on_ready(future.result())  # Re-raises errors of the worker
+            uploaded += 1
+            if time.perf_counter() - start > budget:
+                break
+        return uploaded
+
+    def wait(self) -> int:
+        """Blocks until every asset (including ones submitted while waiting) is uploaded."""
+        uploaded = 0
+        while self._jobs:
+            self._jobs[0][0].result()
+            uploaded += self.process(budget=float("inf"))
+        return uploaded
+
+    def shutdown(self) -> None:
+        """Stops workers. Assets not uploaded yet are dropped."""
+        for future, _ in self._jobs:
+            future.cancel()
+        self._jobs = []
+        self._threads.shutdown(wait=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=True)
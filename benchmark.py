@@ -0,0 +1,162 @@
+"""Headless frame-time benchmark.
+
+Renders a fixed number of frames of each configured scene into an offscreen framebuffer, with a
+fixed-step clock so every run draws exactly the same frames, and prints results as JSON.
+Works without a GPU or display, e.g. with Mesa llvmpipe (LIBGL_ALWAYS_SOFTWARE=1).
+
+    python benchmark.py --frames 300 --scene default --scene many_lights -o results.json
+"""
+import os
+
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")  # Must happen before anything imports OpenGL
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+from OpenGL.GL import *
+
+from clock import FixedStepClock
+from main import Window
+from mesh import Mesh
+from profiler import counters
+from texture import Texture
+
+# Scene name -> Window options
+SCENES = {
+    "default": {"boxes": 6, "point_light_count": 4, "shader": "phong"},
+    "gouraud": {"boxes": 6, "point_light_count": 4, "shader": "gouraud"},
+    "deferred": {"boxes": 6, "point_light_count": 4, "shader": "deferred"},
+    "many_boxes": {"boxes": 24, "point_light_count": 4, "shader": "phong"},
+    "many_lights": {"boxes": 6, "point_light_count": 256, "shader": "phong"},
+    "many_lights_deferred": {"boxes": 6, "point_light_count": 256, "shader": "deferred"},
+    "monkey_camera": {"boxes": 24, "point_light_count": 4, "shader": "phong", "camera": "moving"},
+    "split_screen": {"boxes": 6, "point_light_count": 4, "shader": "phong", "split_screen": True},
+    "monitor": {"boxes": 6, "point_light_count": 4, "shader": "phong", "monitor": True},
+    "fog": {"boxes": 6, "point_light_count": 4, "shader": "phong", "fog": True},
+    "half_resolution": {"boxes": 6, "point_light_count": 4, "shader": "phong", "resolution_scale": 0.5},
+}
+
+
+def run_scene(name: str, config: dict, frames: int, warmup: int, width: int, height: int, instanced: bool,
+              image: str = None, trace: str = None) -> dict:
+    """
+    Renders one scene and measures it.
+
+    :param name: Scene name, copied to the result.
+    :param config: Scene options, see `SCENES`.
+    :param frames: Number of measured frames.
+    :param warmup: Number of frames rendered before measuring (shader compilation, driver caches).
+    :param width: Framebuffer width.
+    :param height: Framebuffer height.
+    :param instanced: Draw objects sharing a mesh with instanced draw calls.
+    :param image: If given, the last frame is saved to this path.
+    :param trace: If given, per-frame profiler trace is saved to this path (.csv or .json).
+    :return: Result dictionary, times in milliseconds (startup, first frame and load time in seconds).
+    """
+    start = time.perf_counter()
+    window = Window(width, height, name, clock=FixedStepClock(), headless=True, boxes=config["boxes"],
+                    point_light_count=config["point_light_count"],
+                    resolution_scale=config.get("resolution_scale", 1.0))
+    window.sel_shader_key = config["shader"]
+    window.sel_camera = config.get("camera", "static")
+    window.instanced = instanced
+    if config.get("split_screen"):
+        window.toggle_split_screen()
+    if config.get("monitor"):
+        window.toggle_monitor()
+    window.post_process.enabled["fog"] = config.get("fog", False)
+    glFinish()
+    startup = time.perf_counter() - start
+    # Assets load in the background, the first frame shows whatever is ready
+    window.render_frame()
+    glFinish()
+    first_frame = time.perf_counter() - start
+    window.wait_for_assets()  # Measured frames draw the full scene
+    glFinish()
+    loaded = time.perf_counter() - start
+
+    frame_times = np.zeros(frames)
+    for i in range(warmup + frames):
+        frame_start = time.perf_counter()
+        window.render_frame()
+        glFinish()  # Count GPU work too, it is what swap_buffers waits for
+        if i >= warmup:
+            frame_times[i - warmup] = time.perf_counter() - frame_start
+
+    window.profiler.flush()
+    window.profiler.history = frames
+    if trace is not None:
+        window.profiler.dump(trace)
+    if image is not None:
+        from PIL import Image
+        Image.fromarray(window.read_pixels()).save(image)
+
+    frame_times *= 1000
+    result = {
+        "scene": name,
+        "renderer": glGetString(GL_RENDERER).decode(),
+        **config,
+        "instanced": instanced,
+        "objects": len(window.scene),
+        "frames": frames,
+        "startup_s": startup,
+        "first_frame_s": first_frame,
+        "loaded_s": loaded,
+        "frame_ms": {
+            "mean": float(frame_times.mean()),
+            "min": float(frame_times.min()),
+            "p50": float(np.percentile(frame_times, 50)),
+            "p90": float(np.percentile(frame_times, 90)),
+            "p99": float(np.percentile(frame_times, 99)),
+            "max": float(frame_times.max()),
+        },
+        **counters.as_dict(),  # Last frame, the same for every frame of a scene
+        "stages": window.profiler.stats(),  # Averages over measured frames
+    }
+    window.release()
+    Mesh.release_all()
+    Texture.release_all()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scene", action="append", choices=sorted(SCENES),
+                        help="Scene to run, may be repeated (default: all)")
+    parser.add_argument("--frames", type=int, default=200, help="Measured frames per scene")
+    parser.add_argument("--warmup", type=int, default=10, help="Frames rendered before measuring")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--no-instancing", action="store_true", help="Draw every object separately")
+    parser.add_argument("--image-dir", help="Save the last frame of every scene as PNG into this directory")
+    parser.add_argument("--trace-dir", help="Save per-frame profiler trace of every scene as CSV into this directory")
+    parser.add_argument("-o", "--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    for directory in (args.image_dir, args.trace_dir):
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+    results = []
+    for name in args.scene or SCENES:
+        image = os.path.join(args.image_dir, f"{name}.png") if args.image_dir is not None else None
+        trace = os.path.join(args.trace_dir, f"{name}.csv") if args.trace_dir is not None else None
+        results.append(run_scene(name, SCENES[name], args.frames, args.warmup, args.width, args.height,
+                                 not args.no_instancing, image, trace))
+
+    report = {
+        "python": sys.version.split()[0],
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import math
+
+import glfw
+
+
+class Clock:
+    """Time source for animations, advanced once per frame."""
+
+    def time(self) -> float:
+        """Current time in seconds."""
+        raise NotImplementedError
+
+    def tick(self) -> None:
+        """Called at the start of every frame."""
+        pass
+
+
+class GlfwClock(Clock):
+    def __init__(self):
+        """Wall clock time since GLFW initialisation, sampled once per frame so all of it sees the same time."""
+        self._time: float = glfw.get_time()
+
+    def time(self) -> float:
+        return self._time
+
+    def tick(self) -> None:
+        self._time = glfw.get_time()
+
+
+class FixedStepClock(Clock):
+    def __init__(self, step: float = 1 / 60, start: float = 0.0):
+        """Deterministic clock advancing by a fixed step every frame, regardless of real time.
+
+        :param step: Frame duration in seconds.
+        :param start: Time of the first frame.
+        """
+        self.step: float = step
+        self._time: float = start - step
+
+    def time(self) -> float:
+        return self._time
+
+    def tick(self) -> None:
+        self._time += self.step
+
+
+class FixedTimestep:
+    def __init__(self, step: float = 1 / 60, max_steps: int = 8):
+        """Splits time into fixed simulation steps, so the simulation runs at the same rate whatever the frame rate.
+
+        The simulation is kept ahead of drawing: every frame simulates steps up to the first one at or after
+        the frame's time, then the frame is drawn between the last two steps, `alpha` of the way.
+
+        :param step: Simulation step in seconds.
+        :param max_steps: Most steps simulated in one frame. Steps missed during a longer stall are skipped
+            instead of simulated in a burst that would make the next frame late too.
+        """
+        self.step: float = step
+        self.max_steps: int = max_steps
+        self.alpha: float = 1.0
+        self._last: int = None  # Index of the last simulated step, step i is at i * step
+
+    def advance(self, time: float) -> list:
+        """
+        Finds steps to simulate before drawing a frame, and the frame's position between the last two.
+
+        :param time: Time of the frame.
+        :return: Times of the steps to simulate, in order.
+        """
+        target = math.ceil(time / self.step - 1e-6)  # First step at or after the frame, tolerating float error
+        first = target - 1 if self._last is None else self._last + 1  # The first frame interpolates from a step too
+        first = max(first, target - self.max_steps + 1)
+        self._last = target if self._last is None else max(self._last, target)
+        self.alpha = min(max(time / self.step - (self._last - 1), 0.0), 1.0)
+        return [i * self.step for i in range(first, target + 1)]
+
+    def time(self) -> float:
+        """Time the drawn frame shows, between the last two steps."""
+        return (self._last - 1 + self.alpha) * self.step
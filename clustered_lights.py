@@ -0,0 +1,152 @@
+import numpy as np
+from OpenGL.GL import *
+
+from shader import Shader
+
+
+class _TextureBuffer:
+    def __init__(self, internal_format: int):
+        """Buffer texture (samplerBuffer in GLSL), re-specified every time it is updated."""
+        self._buffer = glGenBuffers(1)
+        self.texture = glGenTextures(1)
+        self.update(np.zeros(4, dtype=np.float32))
+        glBindTexture(GL_TEXTURE_BUFFER, self.texture)
+        glTexBuffer(GL_TEXTURE_BUFFER, internal_format, self._buffer)
+        glBindTexture(GL_TEXTURE_BUFFER, 0)
+
+    def update(self, data: np.ndarray) -> None:
+        glBindBuffer(GL_TEXTURE_BUFFER, self._buffer)
+        glBufferData(GL_TEXTURE_BUFFER, data.nbytes, data, GL_STREAM_DRAW)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+
+    def bind(self, unit: int) -> None:
+        glActiveTexture(GL_TEXTURE0 + unit)
+        glBindTexture(GL_TEXTURE_BUFFER, self.texture)
+        glActiveTexture(GL_TEXTURE0)
+
+    def release(self) -> None:
+        glDeleteTextures([self.texture])
+        glDeleteBuffers(1, [self._buffer])
+
+
+class LightClusters:
+    def __init__(self, grid: tuple = (16, 9, 24)):
+        """Assigns point lights to view space clusters, so fragments only evaluate nearby lights.
+
+        The view frustum is split into `grid` = (x tiles, y tiles, depth slices) clusters, with
+        exponentially distributed depth slices. Every frame lights are binned on the CPU (vectorized)
+        by their attenuation radius. Shaders read three buffer textures:
+            pointLightData - 4 texels (vec4) per light, layout of PointLight.pack()
+            clusterGrid    - (offset, count) into clusterLights for each cluster
+            clusterLights  - light indices, grouped by cluster
+
+        :param grid: Number of clusters along x, y and depth.
+        """
+        self.grid = grid
+        self.light_count = 0
+        self._slice_scale, self._slice_bias = 0.0, 0.0
+        self._light_data = _TextureBuffer(GL_RGBA32F)
+        self._cluster_grid = _TextureBuffer(GL_RG32UI)
+        self._cluster_lights = _TextureBuffer(GL_R32UI)
+
+    def update(self, lights: list, view: np.ndarray, projection: np.ndarray, near: float, far: float) -> None:
+        """
+        Bins lights into clusters and uploads light data, cluster grid and light index lists.
+
+        :param lights: PointLights.
+        :param view: View matrix.
+        :param projection: Projection matrix.
+        :param near: Near plane distance.
+        :param far: Far plane distance.
+        """
+        nx, ny, nz = self.grid
+        self._slice_scale = nz / np.log(far / near)
+        self._slice_bias = -nz * np.log(near) / np.log(far / near)
+        self.light_count = len(lights)
+
+        data = np.stack([light.pack() for light in lights]) if lights else np.zeros((1, 16), dtype=np.float32)
+        self._light_data.update(data)
+
+        pairs_light, pairs_cluster = self._bin(data[:self.light_count], view, projection, near, far)
+        counts = np.bincount(pairs_cluster, minlength=nx * ny * nz).astype(np.uint32)
+        offsets = np.cumsum(counts, dtype=np.uint32) - counts
+        self._cluster_grid.update(np.stack([offsets, counts], axis=1))
+        indices = pairs_light.astype(np.uint32) if len(pairs_light) else np.zeros(1, dtype=np.uint32)
+        self._cluster_lights.update(indices)
+
+    def _bin(self, data: np.ndarray, view: np.ndarray, projection: np.ndarray, near: float, far: float):
+        """
+        Finds clusters touched by light spheres.
+
+        :return: (light indices, cluster indices) pairs, sorted by cluster.
+        """
+        nx, ny, nz = self.grid
+        count = len(data)
+        if count == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        # Light spheres in view space (camera looks down -z)
+        world = np.concatenate([data[:, 0:3], np.ones((count, 1), dtype=np.float32)], axis=1)
+        center = (world @ np.asarray(view, dtype=np.float32))[:, :3]
+        radius = data[:, 15]
+        depth = -center[:, 2]
+        d_min, d_max = depth - radius, depth + radius
+
+        # Depth slices
+        def slice_of(d):
+            d = np.clip(d, near, far)
+            return np.clip(np.floor(np.log(d) * self._slice_scale + self._slice_bias), 0, nz - 1).astype(np.int64)
+
+        visible = (d_max > near) & (d_min < far)
+        z_lo, z_hi = slice_of(d_min), slice_of(d_max)
+
+        # Screen tiles from the projection of the sphere's view space bounding box. Spheres crossing
+        # the near plane cannot be projected safely, they span the whole screen.
+        def tile_range(c, p, n):
+            lo, hi = c - radius, c + radius
+            near_d, far_d = np.maximum(d_min, near), np.maximum(d_max, near)
+            candidates = np.stack([lo / near_d, lo / far_d, hi / near_d, hi / far_d]) * p
+            ndc_lo, ndc_hi = candidates.min(axis=0), candidates.max(axis=0)
+            crosses_near = d_min <= near
+            ndc_lo[crosses_near], ndc_hi[crosses_near] = -1.0, 1.0
+            on_screen = (ndc_hi >= -1.0) & (ndc_lo <= 1.0)
+            t_lo = np.clip(np.floor((ndc_lo + 1) / 2 * n), 0, n - 1).astype(np.int64)
+            t_hi = np.clip(np.floor((ndc_hi + 1) / 2 * n), 0, n - 1).astype(np.int64)
+            return t_lo, t_hi, on_screen
+
+        x_lo, x_hi, x_vis = tile_range(center[:, 0], projection[0][0], nx)
+        y_lo, y_hi, y_vis = tile_range(center[:, 1], projection[1][1], ny)
+        visible &= x_vis & y_vis
+
+        # Per-axis membership, combined into (light, z, y, x) mask
+        def axis_mask(lo, hi, n):
+            r = np.arange(n)
+            return (r >= lo[:, None]) & (r <= hi[:, None]) & visible[:, None]
+
+        mask = (axis_mask(z_lo, z_hi, nz)[:, :, None, None]
+                & axis_mask(y_lo, y_hi, ny)[:, None, :, None]
+                & axis_mask(x_lo, x_hi, nx)[:, None, None, :])
+        cluster, light = np.nonzero(mask.reshape(count, -1).T)
+        return light, cluster
+
+    def pack_params(self, viewport: tuple) -> np.ndarray:
+        """
+        std140 `Clusters` uniform block: uvec4 gridSize (w = light count); vec4 depthParams; vec4 viewport.
+
+        :param viewport: (x, y, width, height) of the viewport the clusters are computed for.
+        """
+        params = np.zeros(12, dtype=np.float32)
+        params[0:4].view(np.uint32)[:] = [*self.grid, self.light_count]
+        params[4:6] = self._slice_scale, self._slice_bias
+        params[8:12] = viewport
+        return params
+
+    def bind(self) -> None:
+        """Binds buffer textures to their texture units."""
+        self._light_data.bind(Shader.sampler_units["pointLightData"])
+        self._cluster_grid.bind(Shader.sampler_units["clusterGrid"])
+        self._cluster_lights.bind(Shader.sampler_units["clusterLights"])
+
+    def release(self) -> None:
+        for buffer in (self._light_data, self._cluster_grid, self._cluster_lights):
+            buffer.release()
@@ -0,0 +1,204 @@
+import numpy as np
+
+from scene_graph import graph_nodes
+
+
+def frustum_planes(view: np.ndarray, projection: np.ndarray) -> np.ndarray:
+    """
+    View frustum planes (Gribb-Hartmann), normalized and facing inside.
+
+    :param view: View matrix (pyrr layout, row vectors).
+    :param projection: Projection matrix (pyrr layout, row vectors).
+    :return: (6, 4) array of planes (nx, ny, nz, d): left, right, bottom, top, near, far.
+    """
+    m = (np.asarray(view, dtype=np.float64) @ np.asarray(projection, dtype=np.float64)).T
+    planes = np.stack([m[3] + m[0], m[3] - m[0], m[3] + m[1], m[3] - m[1], m[3] + m[2], m[3] - m[2]])
+    return planes / np.linalg.norm(planes[:, :3], axis=1)[:, None]
+
+
+def classify_boxes(planes: np.ndarray, lo: np.ndarray, hi: np.ndarray):
+    """
+    Tests AABBs against frustum planes.
+
+    :return: (outside, inside) boolean arrays, boxes in neither intersect the frustum boundary.
+    """
+    center, extent = (lo + hi) / 2, (hi - lo) / 2
+    distance = center @ planes[:, :3].T + planes[:, 3]
+    radius = extent @ np.abs(planes[:, :3]).T
+    return (distance < -radius).any(axis=1), (distance > radius).all(axis=1)
+
+
+def _range_indices(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(start, end) for every range, without a Python loop."""
+    lengths = ends - starts
+    total = lengths.sum()
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return np.arange(total) + offsets
+
+
+class BVH:
+    # Maximum number of objects in a leaf
+    leaf_size: int = 4
+
+    def __init__(self, objects):
+        """Bounding volume hierarchy of world space AABBs over LoadedObjects, for frustum culling.
+
+        Built once with median splits. Objects that move mark themselves dirty, and only their leaves
+        and those leaves' ancestors are refit before the next query. Nodes are stored in flat arrays in
+        depth first order (children after their parent) and queried breadth first, one NumPy pass per level.
+
+        :param objects: Iterable of LoadedObjects.
+        """
+        self.objects = list(objects)
+        count = len(self.objects)
+        self._graph, self._nodes = graph_nodes(self.objects)  # World matrices are gathered from the graph if set
+        self._local_bounds = self._gather_local_bounds()
+        self._lo, self._hi = np.zeros((count, 3)), np.zeros((count, 3))  # Object AABBs
+        self._dirty = np.ones(count, dtype=bool)
+        self._refit_objects(np.arange(count))
+
+        self._order = np.arange(count)  # Objects sorted so that every node covers a contiguous range
+        self._start, self._end, self._left, self._right, self._parent = [], [], [], [], []
+        if count:
+            self._build(0, count, -1)
+        self._start, self._end = np.array(self._start), np.array(self._end)
+        self._left, self._right = np.array(self._left), np.array(self._right)
+        self._parent = np.array(self._parent)
+        self._leaf_of = np.zeros(count, dtype=np.int64)  # Leaf node of every object
+        for node in np.flatnonzero(self._left == -1):
+            self._leaf_of[self._order[self._start[node]:self._end[node]]] = node
+
+        nodes = len(self._start)
+        self._node_lo, self._node_hi = np.zeros((nodes, 3)), np.zeros((nodes, 3))
+        self._refit_nodes(np.arange(nodes))
+
+        for ind, o in enumerate(self.objects):
+            o.set_bvh(self, ind)
+
+    def mark_dirty(self, ind) -> None:
+        """Schedules AABB of object with given index (or array of indices) to be recomputed."""
+        self._dirty[ind] = True
+
+    def mark_all_dirty(self) -> None:
+        """Schedules every AABB to be recomputed, e.g. after meshes finished loading and their bounds changed."""
+        self._local_bounds = self._gather_local_bounds()
+        self._dirty[:] = True
+
+    def _gather_local_bounds(self) -> np.ndarray:
+        """(n, 2, 3) mesh space AABBs of all objects."""
+        if not self.objects:
+            return np.zeros((0, 2, 3))
+        return np.stack([o.bounds for o in self.objects]).astype(np.float64)
+
+    def _build(self, start: int, end: int, parent: int) -> int:
+        """Builds node over `_order[start:end]`, splitting at the median centroid of the longest axis."""
+        node = len(self._start)
+        self._start.append(start)
+        self._end.append(end)
+        self._left.append(-1)
+        self._right.append(-1)
+        self._parent.append(parent)
+        if end - start <= self.leaf_size:
+            return node
+
+        objects = self._order[start:end]
+        centers = (self._lo[objects] + self._hi[objects]) / 2
+        axis = np.argmax(centers.max(axis=0) - centers.min(axis=0))
+        self._order[start:end] = objects[np.argsort(centers[:, axis], kind="stable")]
+        mid = (start + end) // 2
+        self._left[node] = self._build(start, mid, node)
+        self._right[node] = self._build(mid, end, node)
+        return node
+
+    def _refit_objects(self, indices: np.ndarray) -> None:
+        """Recomputes world AABBs of given objects by transforming their local AABBs."""
+        if len(indices) == 0:
+            return
+        local = self._local_bounds[indices]
+        if self._graph is not None:
+            world = self._graph.object_matrices(self._nodes[indices])
+        else:
+            world = np.stack([self.objects[i].world_matrix() for i in indices]).astype(np.float64)
+        center, extent = (local[:, 0] + local[:, 1]) / 2, (local[:, 1] - local[:, 0]) / 2
+        # Row vectors: p' = p @ M, extent of the transformed box uses absolute values of the rotation part
+        new_center = np.einsum("ni,nij->nj", center, world[:, :3, :3]) + world[:, 3, :3]
+        new_extent = np.einsum("ni,nij->nj", extent, np.abs(world[:, :3, :3]))
+        self._lo[indices], self._hi[indices] = new_center - new_extent, new_center + new_extent
+        self._dirty[indices] = False
+
+    def _refit_nodes(self, nodes: np.ndarray) -> None:
+        """Recomputes bounds of given nodes, children first (they always have higher indices)."""
+        for node in np.sort(nodes)[::-1]:
+            left = self._left[node]
+            if left == -1:
+                objects = self._order[self._start[node]:self._end[node]]
+                self._node_lo[node] = self._lo[objects].min(axis=0)
+                self._node_hi[node] = self._hi[objects].max(axis=0)
+            else:
+                right = self._right[node]
+                self._node_lo[node] = np.minimum(self._node_lo[left], self._node_lo[right])
+                self._node_hi[node] = np.maximum(self._node_hi[left], self._node_hi[right])
+
+    def refit(self) -> None:
+        """Updates AABBs of moved objects and nodes containing them."""
+        moved = np.flatnonzero(self._dirty)
+        if len(moved) == 0:
+            return
+        self._refit_objects(moved)
+        nodes = set()
+        for node in np.unique(self._leaf_of[moved]):
+            while node != -1 and node not in nodes:
+                nodes.add(node)
+                node = self._parent[node]
+        self._refit_nodes(np.fromiter(nodes, dtype=np.int64))
+
+    def bounding_spheres(self) -> tuple:
+        """World (centers, radii) of spheres around object AABBs."""
+        self.refit()
+        return (self._lo + self._hi) / 2, np.linalg.norm(self._hi - self._lo, axis=1) / 2
+
+    def boxes(self) -> tuple:
+        """World (min corners, max corners) of object AABBs."""
+        self.refit()
+        return self._lo, self._hi
+
+    def bounds(self) -> np.ndarray:
+        """World AABB of all objects as [min corner, max corner]."""
+        self.refit()
+        if len(self.objects) == 0:
+            return np.zeros((2, 3))
+        return np.stack([self._node_lo[0], self._node_hi[0]])
+
+    def cull(self, view: np.ndarray, projection: np.ndarray) -> np.ndarray:
+        """
+        Finds objects intersecting the view frustum.
+
+        :param view: View matrix.
+        :param projection: Projection matrix.
+        :return: Boolean mask of visible objects, in the order they were given.
+        """
+        self.refit()
+        visible = np.zeros(len(self.objects), dtype=bool)
+        if len(self.objects) == 0:
+            return visible
+        planes = frustum_planes(view, projection)
+
+        frontier = np.array([0])
+        while len(frontier):
+            outside, inside = classify_boxes(planes, self._node_lo[frontier], self._node_hi[frontier])
+            # Nodes fully inside: all their objects are visible
+            accepted = frontier[inside]
+            visible[self._order[_range_indices(self._start[accepted], self._end[accepted])]] = True
+
+            # Leaves crossing the boundary: test their objects one by one
+            crossing = frontier[~outside & ~inside]
+            leaves = crossing[self._left[crossing] == -1]
+            objects = self._order[_range_indices(self._start[leaves], self._end[leaves])]
+            objects_outside, _ = classify_boxes(planes, self._lo[objects], self._hi[objects])
+            visible[objects[~objects_outside]] = True
+
+            inner = crossing[self._left[crossing] != -1]
+            frontier = np.concatenate([self._left[inner], self._right[inner]])
+        return visible
@@ -0,0 +1,96 @@
+"""Frame pacing of the interactive window: vsync mode, optional frame rate cap and adaptive quality.
+
+Simulation runs in fixed steps independent of all of this (see `FixedTimestep` in clock.py).
+"""
+import math
+import time
+
+import glfw
+
+# Vsync modes, in the order the V key cycles through them
+VSYNC_MODES = ("adaptive", "on", "off")
+
+
+def swap_interval(mode: str) -> int:
+    """
+    Swap interval of a vsync mode, for `glfw.swap_interval`. Needs a current context.
+
+    Adaptive vsync (interval -1) waits for the vertical blank like "on", but swaps frames that missed it
+    immediately instead of waiting for the next one. Drivers without the tear control extension get "on".
+    """
+    if mode == "off":
+        return 0
+    if mode == "adaptive" and (glfw.extension_supported("GLX_EXT_swap_control_tear") or
+                               glfw.extension_supported("WGL_EXT_swap_control_tear")):
+        return -1
+    return 1
+
+
+class FramePacer:
+    def __init__(self, fps_cap: float = None, wait=time.sleep):
+        """Limits the frame rate by waiting before frames that would start too early.
+
+        :param fps_cap: Most frames per second, None for no limit (vsync then paces frames, if enabled).
+        :param wait: Called with the number of seconds to wait, e.g. `glfw.wait_events_timeout` to handle
+            input while waiting.
+        """
+        self.fps_cap: float = fps_cap
+        self._wait = wait
+        self._deadline: float = None  # Start time of the next frame
+
+    def wait(self) -> None:
+        """Waits until the next frame is due."""
+        if not self.fps_cap:
+            self._deadline = None
+            return
+        period = 1 / self.fps_cap
+        now = time.perf_counter()
+        if self._deadline is None or now - self._deadline > period:
+            self._deadline = now  # More than a frame late, start over instead of rushing frames to catch up
+        elif self._deadline > now:
+            self._wait(self._deadline - now)
+        self._deadline += period
+
+
+class AdaptiveQuality:
+    def __init__(self, budget_ms: float, minimum: float = 0.5, step: float = 0.1, cooldown: int = 30):
+        """Lowers a quality scale while frames take longer than their budget, and raises it back once they are fast.
+
+        The scale multiplies quality settings, e.g. projected sizes levels of detail are picked by (see lod.py).
+        Frame times are smoothed and the scale changes at most every `cooldown` frames, so single slow frames
+        are ignored and the scale does not oscillate. It goes up in half steps, only with clear headroom.
+
+        :param budget_ms: Frame time budget in milliseconds, e.g. the display refresh period.
+        :param minimum: Lowest scale.
+        :param step: Scale decrease per adjustment.
+        :param cooldown: Frames between adjustments.
+        """
+        self.budget_ms: float = budget_ms
+        self.minimum: float = minimum
+        self.step: float = step
+        self.cooldown: int = cooldown
+        self.headroom: float = 0.7  # Fraction of the budget frames must fit in before the scale goes up
+        self.scale: float = 1.0
+        self._smoothed_ms: float = None
+        self._wait: int = cooldown
+
+    def update(self, frame_ms: float) -> float:
+        """
+        Adjusts the scale after a frame.
+
+        :param frame_ms: Time the frame took, ignored if NaN (no measurement yet).
+        :return: Quality scale.
+        """
+        if math.isnan(frame_ms):
+            return self.scale
+        self._smoothed_ms = frame_ms if self._smoothed_ms is None else 0.9 * self._smoothed_ms + 0.1 * frame_ms
+        self._wait -= 1
+        if self._wait > 0:
+            return self.scale
+        if self._smoothed_ms > self.budget_ms and self.scale > self.minimum:
+            self.scale = max(self.scale - self.step, self.minimum)
+            self._wait = self.cooldown
+        elif self._smoothed_ms < self.budget_ms * self.headroom and self.scale < 1.0:
+            self.scale = min(self.scale + self.step / 2, 1.0)
+            self._wait = self.cooldown
+        return self.scale
@@ -0,0 +1,65 @@
+from OpenGL.GL import *
+
+
+class GBuffer:
+    # Color attachments: sampler name -> internal format
+    attachments = {
+        "gPosition": GL_RGBA16F,  # World position, w = view depth
+        "gNormal": GL_RGBA16F,  # World normal
+        "gAmbient": GL_RGBA8,  # Material ambient * texel
+        "gDiffuse": GL_RGBA8,  # Material diffuse * texel, a = texel alpha
+        "gSpecular": GL_RGBA16F,  # Material specular * texel, a = shininess
+    }
+
+    def __init__(self, width: int, height: int):
+        """Framebuffer with geometry attributes for deferred shading.
+
+        :param width: Width in pixels.
+        :param height: Height in pixels.
+        """
+        self.width, self.height = width, height
+        self.fbo = glGenFramebuffers(1)
+        self.textures = {name: glGenTextures(1) for name in [*self.attachments, "gDepth"]}
+        self._allocate()
+
+    def _allocate(self) -> None:
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        for ind, (name, internal_format) in enumerate(self.attachments.items()):
+            self._texture(self.textures[name], internal_format, GL_RGBA, GL_FLOAT)
+            glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0 + ind, GL_TEXTURE_2D, self.textures[name], 0)
+        # Depth is sampled by the lighting pass, which writes it back to the target framebuffer
+        self._texture(self.textures["gDepth"], GL_DEPTH_COMPONENT24, GL_DEPTH_COMPONENT, GL_FLOAT)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_TEXTURE_2D,
+                               self.textures["gDepth"], 0)
+        glDrawBuffers(len(self.attachments), [GL_COLOR_ATTACHMENT0 + i for i in range(len(self.attachments))])
+
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise Exception("G-buffer is incomplete!")
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def _texture(self, texture: int, internal_format: int, data_format: int, data_type: int) -> None:
+        glBindTexture(GL_TEXTURE_2D, texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, internal_format, self.width, self.height, 0, data_format, data_type, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def resize(self, width: int, height: int) -> None:
+        self.width, self.height = width, height
+        self._allocate()
+
+    def bind_textures(self, units: dict) -> None:
+        """Binds attribute textures for the lighting pass.
+
+        :param units: Sampler name -> texture unit.
+        """
+        for name, texture in self.textures.items():
+            glActiveTexture(GL_TEXTURE0 + units[name])
+            glBindTexture(GL_TEXTURE_2D, texture)
+        glActiveTexture(GL_TEXTURE0)
+
+    def release(self) -> None:
+        glDeleteFramebuffers(1, [self.fbo])
+        glDeleteTextures(list(self.textures.values()))
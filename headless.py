@@ -0,0 +1,73 @@
+"""Offscreen OpenGL context for rendering without a display, e.g. on CI with Mesa llvmpipe.
+
+PyOpenGL chooses its platform on first import, so PYOPENGL_PLATFORM=egl has to be set before
+anything imports OpenGL (see benchmark.py).
+"""
+import ctypes
+import os
+
+import numpy as np
+from OpenGL import EGL
+from OpenGL.GL import *
+
+# Mesa: don't look for X11 / Wayland displays
+os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+
+class HeadlessContext:
+    def __init__(self, width: int, height: int):
+        """EGL context without any surface, rendering into an offscreen framebuffer.
+
+        :param width: Framebuffer width.
+        :param height: Framebuffer height.
+        """
+        self.width, self.height = width, height
+        self._display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        if self._display == EGL.EGL_NO_DISPLAY or not EGL.eglInitialize(self._display, None, None):
+            raise Exception("EGL display cannot be initialized!")
+
+        attributes = [EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT, EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                      EGL.EGL_NONE]
+        config, count = EGL.EGLConfig(), EGL.EGLint()
+        EGL.eglChooseConfig(self._display, (EGL.EGLint * len(attributes))(*attributes), ctypes.pointer(config), 1,
+                            ctypes.pointer(count))
+        if count.value == 0:
+            raise Exception("No suitable EGL config!")
+
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        context_attributes = [EGL.EGL_CONTEXT_MAJOR_VERSION, 3, EGL.EGL_CONTEXT_MINOR_VERSION, 3,
+                              EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+                              EGL.EGL_NONE]
+        self._context = EGL.eglCreateContext(self._display, config, EGL.EGL_NO_CONTEXT,
+                                             (EGL.EGLint * len(context_attributes))(*context_attributes))
+        if self._context == EGL.EGL_NO_CONTEXT:
+            raise Exception("EGL context cannot be created!")
+        EGL.eglMakeCurrent(self._display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, self._context)
+
+        # There is no default framebuffer, everything is rendered here
+        self.fbo = glGenFramebuffers(1)
+        self._renderbuffers = glGenRenderbuffers(2)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glBindRenderbuffer(GL_RENDERBUFFER, self._renderbuffers[0])
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, width, height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self._renderbuffers[0])
+        glBindRenderbuffer(GL_RENDERBUFFER, self._renderbuffers[1])
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH24_STENCIL8, width, height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_STENCIL_ATTACHMENT, GL_RENDERBUFFER,
+                                  self._renderbuffers[1])
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise Exception("Offscreen framebuffer is incomplete!")
+        glViewport(0, 0, width, height)
+
+    def read_pixels(self) -> np.ndarray:
+        """Rendered image as (height, width, 3) uint8 array, top row first."""
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.fbo)
+        data = glReadPixels(0, 0, self.width, self.height, GL_RGB, GL_UNSIGNED_BYTE)
+        return np.frombuffer(data, dtype=np.uint8).reshape(self.height, self.width, 3)[::-1]
+
+    def release(self) -> None:
+        glDeleteFramebuffers(1, [self.fbo])
+        glDeleteRenderbuffers(2, self._renderbuffers)
+        EGL.eglMakeCurrent(self._display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+        EGL.eglDestroyContext(self._display, self._context)
+        EGL.eglTerminate(self._display)
@@ -0,0 +1,194 @@
+from functools import partial
+
+import numpy as np
+from OpenGL.GL import *
+
+from profiler import counters
+from render_queue import RenderQueue
+from scene_graph import graph_nodes
+from shader import Shader
+
+
+class InstanceGroup:
+    # Texels (vec4) per instance in the matrix buffer texture: model matrix, then normal matrix padded to vec4s
+    texels_per_instance = 7
+    # Matrix buffer texture bound to the "instanceMatrices" unit, shared by all groups
+    _bound_matrices = None
+
+    def __init__(self, objects: list, indices: list = None):
+        """Objects sharing one mesh, drawn with one instanced draw call per material and level of detail.
+
+        Model and normal matrices of all objects are kept in a buffer texture in a fixed order, and only the
+        range of objects that moved is re-uploaded. Every pass (a view, a shadow map layer, the occluder pre-pass)
+        draws through its own buffer of instance indices, re-uploaded only when the instances it draws change,
+        so passes of a frame never overwrite data that earlier draws still read.
+
+        :param objects: LoadedObjects with the same mesh.
+        :param indices: Positions of the objects in the scene, used to pick them from scene wide arrays
+            (visibility, levels of detail).
+        """
+        self.mesh = objects[0].mesh
+        self.objects = list(objects)
+        self.indices = np.array(indices if indices is not None else range(len(self.objects)), dtype=np.int64)
+        self._matrices = np.zeros((len(self.objects), self.texels_per_instance, 4), dtype=np.float32)
+        self._dirty = np.ones(len(self.objects), dtype=bool)
+        self._all = np.arange(len(self.objects))
+        self._graph, self._nodes = graph_nodes(self.objects)  # Matrices are gathered from the graph if set
+        self._passes = {}  # Pass key -> [index buffer, instances in it]
+
+        self._matrix_buffer = glGenBuffers(1)
+        glBindBuffer(GL_TEXTURE_BUFFER, self._matrix_buffer)
+        glBufferData(GL_TEXTURE_BUFFER, self._matrices.nbytes, None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+        self._matrix_texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_BUFFER, self._matrix_texture)
+        glTexBuffer(GL_TEXTURE_BUFFER, GL_RGBA32F, self._matrix_buffer)
+        glBindTexture(GL_TEXTURE_BUFFER, 0)
+        self.vaos = None  # Created once the mesh is loaded
+        self._attribute_sources = None  # (index buffer, first instance) set in every VAO
+
+        for ind, o in enumerate(self.objects):
+            o.set_instance_group(self, ind)
+
+    def mark_dirty(self, ind: int) -> None:
+        """Schedules model matrix of instance with given index to be re-uploaded."""
+        self._dirty[ind] = True
+
+    def mark_moved(self, moved: np.ndarray) -> None:
+        """Schedules matrices of instances set in a scene wide boolean mask (see `indices`) to be re-uploaded."""
+        self._dirty |= moved[self.indices]
+
+    def _update(self) -> None:
+        """Gathers model and normal matrices of moved objects and uploads the range of instances they span."""
+        dirty = np.flatnonzero(self._dirty)
+        if len(dirty) == 0:
+            return
+        if self._graph is not None:
+            self._matrices[dirty, :4] = self._graph.object_matrices(self._nodes[dirty])
+            self._matrices[dirty, 4:, :3] = self._graph.normal_matrices(self._nodes[dirty])
+        else:
+            for ind in dirty:
+                o = self.objects[ind]
+                self._matrices[ind, :4] = o.world_matrix()
+                self._matrices[ind, 4:, :3] = o.normal_matrix()
+        self._dirty[:] = False
+
+        first, last = dirty[0], dirty[-1] + 1
+        stride = self._matrices[0].nbytes
+        glBindBuffer(GL_TEXTURE_BUFFER, self._matrix_buffer)
+        glBufferSubData(GL_TEXTURE_BUFFER, first * stride, (last - first) * stride, self._matrices[first:last])
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+
+    def _pass_buffer(self, pass_key, order: np.ndarray) -> int:
+        """Index buffer of a pass holding given instances, re-specified only if they changed since its last use."""
+        entry = self._passes.get(pass_key)
+        if entry is None:
+            entry = self._passes[pass_key] = [glGenBuffers(1), None]
+        if entry[1] is None or not np.array_equal(order, entry[1]):
+            entry[1] = order
+            # Re-specifying orphans the old storage, draws of earlier frames keep reading it
+            glBindBuffer(GL_ARRAY_BUFFER, entry[0])
+            glBufferData(GL_ARRAY_BUFFER, order.astype(np.uint32), GL_DYNAMIC_DRAW)
+        return entry[0]
+
+    def enqueue(self, render_queue: RenderQueue, shader: Shader, visible: np.ndarray = None,
+                lods: np.ndarray = None, pass_key="main") -> None:
+        """
+        Uploads moved instances and queues their draws, one per material and level of detail.
+
+        :param render_queue: Queue to add the draws to.
+        :param shader: Shader to draw with (instancing enabled).
+        :param visible: Scene wide visibility mask (see `indices`), all instances are drawn if None.
+        :param lods: Scene wide levels of detail, full detail if None.
+        :param pass_key: Hashable naming the pass (e.g. a view or a shadow map layer), every pass keeps its own
+            instance indices, so alternating passes do not re-upload them.
+        """
+        if not self.mesh.ready:
+            return
+        order = np.flatnonzero(visible[self.indices]) if visible is not None else self._all
+        if len(order) == 0:
+            return
+        lods = lods[self.indices[order]] if lods is not None else np.zeros(len(order), dtype=np.int64)
+        if lods.any():
+            by_lod = np.argsort(lods, kind="stable")
+            order, lods = order[by_lod], lods[by_lod]
+        self._update()
+        index_buffer = self._pass_buffer(pass_key, order)
+        if self.vaos is None:
+            self.vaos = self.mesh.create_instanced_vaos(index_buffer)
+            self._attribute_sources = [(index_buffer, 0)] * len(self.vaos)
+        counts = np.bincount(lods)
+        firsts = np.cumsum(counts) - counts
+
+        for ind, vao in enumerate(self.vaos):
+            material_shader = self.mesh.material_shader(shader, ind)
+            setup = partial(self.mesh.use_material, material_shader, ind)
+            for lod in np.flatnonzero(counts):
+                render_queue.add(material_shader, self.mesh.texture_key(ind), int(vao), (id(self.mesh), ind), setup,
+                                 partial(self._draw_batch, ind, int(lod), index_buffer, int(firsts[lod]),
+                                         int(counts[lod])))
+        counters.instances += len(order)
+
+    def _draw_batch(self, ind: int, lod: int, index_buffer: int, first: int, count: int) -> None:
+        """Draws `count` instances from `first` in a pass's index buffer with given material and level of detail."""
+        if (index_buffer, first) != self._attribute_sources[ind]:
+            self.mesh.set_instance_attributes(index_buffer, first)
+            self._attribute_sources[ind] = (index_buffer, first)
+            counters.state_changes += 1
+        if InstanceGroup._bound_matrices != self._matrix_texture:
+            glActiveTexture(GL_TEXTURE0 + Shader.sampler_units["instanceMatrices"])
+            glBindTexture(GL_TEXTURE_BUFFER, self._matrix_texture)
+            glActiveTexture(GL_TEXTURE0)
+            InstanceGroup._bound_matrices = self._matrix_texture
+            counters.state_changes += 1
+        offset, length = self.mesh.lods[ind][lod]
+        glDrawElementsInstanced(GL_TRIANGLES, length, self.mesh.index_types[ind], ctypes.c_void_p(offset), count)
+        counters.draw_calls += 1
+
+    def draw(self, shader: Shader, visible: np.ndarray = None, lods: np.ndarray = None, pass_key="main") -> None:
+        """
+        Draws instances of the group with selected (instancing enabled) shader.
+
+        :param shader: Shader to draw with.
+        :param visible: Scene wide visibility mask (see `indices`), all instances are drawn if None.
+        :param lods: Scene wide levels of detail, full detail if None.
+        :param pass_key: Hashable naming the pass, see `enqueue`.
+        """
+        render_queue = RenderQueue()
+        self.enqueue(render_queue, shader, visible, lods, pass_key)
+        render_queue.submit()
+
+    def release_pass(self, pass_key) -> None:
+        """Deletes the index buffer of a pass that will not be drawn again, e.g. of a removed view."""
+        entry = self._passes.pop(pass_key, None)
+        if entry is not None:
+            if self._attribute_sources is not None:
+                # Buffer names are reused, a VAO still pointing at this one must be re-pointed on its next draw
+                self._attribute_sources = [None if source is not None and source[0] == entry[0] else source
+                                           for source in self._attribute_sources]
+            glDeleteBuffers(1, [entry[0]])
+
+    def release(self) -> None:
+        for o in self.objects:
+            o.set_instance_group(None, -1)
+        if self.vaos is not None:
+            glDeleteVertexArrays(len(self.vaos), self.vaos)
+        for pass_key in list(self._passes):
+            self.release_pass(pass_key)
+        if InstanceGroup._bound_matrices == self._matrix_texture:
+            InstanceGroup._bound_matrices = None
+        glDeleteTextures([self._matrix_texture])
+        glDeleteBuffers(1, [self._matrix_buffer])
+        self.vaos, self._matrix_buffer, self._matrix_texture = None, None, None
+
+
+def build_instance_groups(objects) -> list:
+    """Groups objects by shared mesh.
+
+    :param objects: Iterable of LoadedObjects, group indices refer to its order.
+    :return: List of InstanceGroups, one for each distinct mesh.
+    """
+    by_mesh = {}
+    for ind, o in enumerate(objects):
+        by_mesh.setdefault(id(o.mesh), []).append((ind, o))
+    return [InstanceGroup([o for _, o in group], [ind for ind, _ in group]) for group in by_mesh.values()]
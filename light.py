@@ -1,43 +1,57 @@
+import math
+from functools import partial
+
+import numpy as np
 from pyrr import matrix44 as m44, Vector3 as v3
 
 from shader import Shader
 from loaded_object import LoadedObject
+from shadows import up_vector
+
+
+def _vec4(xyz, w: float = 0.0) -> list:
+    """std140 vec3 followed by a float packed into its padding."""
+    return [xyz[0], xyz[1], xyz[2], w]
 
 
 class AbstractLight:
     """Abstract base class."""
 
-    def __init__(self, amb: v3, dif: v3, spe: v3, uni_name: str):
+    def __init__(self, amb: v3, dif: v3, spe: v3):
         self._ambient: v3 = amb
         self._diffuse: v3 = dif
         self._specular: v3 = spe
-        self._uniform_name: str = uni_name
 
-    def use_light(self, shader: Shader) -> None:
-        shader.set_v3(f"{self._uniform_name}.ambient", self._ambient)
-        shader.set_v3(f"{self._uniform_name}.diffuse", self._diffuse)
-        shader.set_v3(f"{self._uniform_name}.specular", self._specular)
+    def pack(self) -> np.ndarray:
+        """Light parameters laid out as the GLSL struct in std140 `Lights` uniform block."""
+        raise NotImplementedError
 
 
 class DirLight(AbstractLight):
     """Directional light."""
 
-    def __init__(self, amb: v3, dif: v3, spe: v3, direction: v3, uni_name: str):
-        super().__init__(amb, dif, spe, uni_name)
+    def __init__(self, amb: v3, dif: v3, spe: v3, direction: v3):
+        super().__init__(amb, dif, spe)
 
         self._direction: v3 = direction
 
-    def use_light(self, shader: Shader) -> None:
-        super().use_light(shader)
+    @property
+    def direction(self) -> v3:
+        return self._direction
 
-        shader.set_v3(f"{self._uniform_name}.direction", self._direction)
+    def pack(self) -> np.ndarray:
+        """struct DirLight { vec3 direction; vec3 ambient; vec3 diffuse; vec3 specular; } (64 bytes)"""
+        return np.array([*_vec4(self._direction), *_vec4(self._ambient), *_vec4(self._diffuse),
+                         *_vec4(self._specular)], dtype=np.float32)
 
 
 class PointLight(AbstractLight):
     """Point light with attenuation."""
 
-    def __init__(self, amb: v3, dif: v3, spe: v3, k: v3, pos: v3, uni_name: str,
-                 lss: Shader, obj: LoadedObject):
+    # Contribution below this fraction of the light's color is treated as zero when culling lights
+    cutoff: float = 1 / 256
+
+    def __init__(self, amb: v3, dif: v3, spe: v3, k: v3, pos: v3, lss: Shader, obj: LoadedObject):
         """Point light with attenuation.
 
         :param amb: Ambient color.
@@ -45,11 +59,10 @@ class PointLight(AbstractLight):
         :param spe: Specular color.
         :param k: Attenuation terms: [constant, linear, quadratic].
         :param pos: Position.
-        :param uni_name: Uniform name.
         :param lss: Light source shader
         :param obj: LoadedObject containing a representation of the light source.
         """
-        super().__init__(amb, dif, spe, uni_name)
+        super().__init__(amb, dif, spe)
 
         self._constant: float = k[0]
         self._linear: float = k[1]
@@ -72,25 +85,54 @@ class PointLight(AbstractLight):
 
         return pos, model
 
-    def use_light(self, shader: Shader) -> None:
-        super().use_light(shader)
+    @property
+    def radius(self) -> float:
+        """Distance at which attenuation brings the brightest color component below `cutoff`."""
+        brightest = max(max(self._ambient), max(self._diffuse), max(self._specular))
+        # Solve brightest / (constant + linear * d + quadratic * d^2) = cutoff for d
+        c = self._constant - brightest / self.cutoff
+        if self._quadratic > 0:
+            return (-self._linear + math.sqrt(self._linear ** 2 - 4 * self._quadratic * c)) / (2 * self._quadratic)
+        if self._linear > 0:
+            return max(-c / self._linear, 0.0)
+        return math.inf
+
+    def marker_sphere(self) -> tuple:
+        """World (center, radius) of a sphere around the drawn light source representation."""
+        center, radius = self._obj.mesh.bounding_sphere
+        return self._pos + center * self._scale, radius * self._scale
+
+    def pack(self) -> np.ndarray:
+        """vec4 position + constant, vec4 ambient + linear, vec4 diffuse + quadratic, vec4 specular + radius.
+
+        Same layout as PointLight struct in std140, with the radius filling the remaining padding.
+        """
+        return np.array([*_vec4(self._pos, self._constant), *_vec4(self._ambient, self._linear),
+                         *_vec4(self._diffuse, self._quadratic), *_vec4(self._specular, self.radius)],
+                        dtype=np.float32)
+
+    def enqueue(self, render_queue, lod: int = 0, shader: Shader = None) -> None:
+        """
+        Queues drawing of the light source representation into a RenderQueue (see render_queue.py).
 
-        shader.set_v3(f"{self._uniform_name}.position", self._pos)
-        shader.set_float(f"{self._uniform_name}.constant", self._constant)
-        shader.set_float(f"{self._uniform_name}.linear", self._linear)
-        shader.set_float(f"{self._uniform_name}.quadratic", self._quadratic)
+        :param shader: Variant of the light source shader to draw with, the light source shader itself by default.
+        """
+        shader = shader if shader is not None else self._light_source_shader
+        if self._obj is not None:
+            self._obj.mesh.enqueue(render_queue, shader, self._model, lod,
+                                   partial(shader.set_v3, "color", self._diffuse))
 
-    def draw(self) -> None:
+    def draw(self, lod: int = 0) -> None:
         if self._obj is not None:
             self._light_source_shader.set_v3("color", self._diffuse)
-            self._obj.draw(self._light_source_shader, model=self._model)
+            self._obj.draw(self._light_source_shader, model=self._model, lod=lod)
 
 
 class SpotLight(PointLight):
     """Spotlight."""
 
     def __init__(self, amb: v3, dif: v3, spe: v3, k: v3, pos: v3, direction: v3,
-                 co: float, oco: float, uni_name: str, lss: Shader, obj: LoadedObject):
+                 co: float, oco: float, lss: Shader, obj: LoadedObject):
         """Spotlight.
 
         :param amb: Ambient color.
@@ -101,22 +143,33 @@ class SpotLight(PointLight):
         :param direction: Direction.
         :param co: Cut off (cosine).
         :param oco: Outer cut off.
-        :param uni_name: Uniform name.
         :param lss: Light source shader
         :param obj: LoadedObject containing a representation of the light source.
         """
-        super().__init__(amb, dif, spe, k, pos, uni_name, lss, obj)
+        super().__init__(amb, dif, spe, k, pos, lss, obj)
 
         self._direction: v3 = direction
         self._cut_off: float = co
         self._outer_cut_off: float = oco
 
-    def use_light(self, shader: Shader) -> None:
-        super().use_light(shader)
-
-        shader.set_v3(f"{self._uniform_name}.direction", self._direction)
-        shader.set_float(f"{self._uniform_name}.cutOff", self._cut_off)
-        shader.set_float(f"{self._uniform_name}.outerCutOff", self._outer_cut_off)
+    def pack(self) -> np.ndarray:
+        """struct SpotLight { vec3 position; float constant; vec3 direction; float linear; vec3 ambient;
+        float quadratic; vec3 diffuse; float cutOff; vec3 specular; float outerCutOff; } (80 bytes)"""
+        return np.array([*_vec4(self._pos, self._constant), *_vec4(self._direction, self._linear),
+                         *_vec4(self._ambient, self._quadratic), *_vec4(self._diffuse, self._cut_off),
+                         *_vec4(self._specular, self._outer_cut_off)], dtype=np.float32)
 
     def set_dir(self, direction: v3):
         self._direction = direction
+
+    def frustum(self, near: float = 0.05, far: float = None) -> tuple:
+        """
+        Perspective frustum enclosing the light cone, for rendering its shadow map.
+
+        :param near: Near plane distance.
+        :param far: Far plane distance, the light's radius by default.
+        :return: (view, projection) matrices.
+        """
+        view = m44.create_look_at(self._pos, self._pos + self._direction, up_vector(self._direction))
+        fov = 2 * math.degrees(math.acos(self._outer_cut_off))
+        return view, m44.create_perspective_projection(fov, 1.0, near, far if far is not None else self.radius)
@@ -1,128 +1,126 @@
 import numpy as np
-import pywavefront
-from PIL import Image
 from pyrr import matrix44 as m44, Vector3 as v3
-from OpenGL.GL import *
 
 from shader import Shader
+from mesh import Mesh
+
+
+def normal_matrix(model: m44) -> np.ndarray:
+    """
+    Inverse transpose of the upper 3x3 part of a model matrix, so normals stay perpendicular under non-uniform scale.
+
+    :param model: Model matrix (pyrr layout, row vectors).
+    :return: 3x3 float32 matrix, uploaded like the model matrix (shaders see its transpose).
+    """
+    return np.linalg.inv(np.asarray(model, dtype=np.float64)[:3, :3]).T.astype(np.float32)
 
 
 class LoadedObject:
-    def __init__(self, path: str, x: float = 0.0, y: float = 0.0, z: float = 0.0, scale: float = 1.0):
-        """Object loaded from .obj and .mtl files, ready to be drawn."""
+    def __init__(self, path: str, x: float = 0.0, y: float = 0.0, z: float = 0.0, scale: float = 1.0,
+                 loader=None):
+        """Object loaded from .obj and .mtl files, ready to be drawn.
+
+        GPU resources are shared between all objects loaded from the same path.
+        With an AssetLoader, the mesh is loaded in the background and the object is not drawn until then.
+        """
         self._path = path
-        self._wavefront = None
-        self.vaos = None
-        self._vbos = None
-        self.materials = []
-        self.textures = None
-        self.use_texture = False
-        self.lengths = []
+        # Instance group drawing this object (see instancing.py)
+        self._instance_group = None
+        self._instance_ind: int = -1
+        # Bounding volume hierarchy containing this object (see culling.py)
+        self._bvh = None
+        self._bvh_ind: int = -1
         # Set position and model
         self.pos = m44.create_from_translation(v3([x, y, z]))
-        self.model = self.pos
+        self._model = self.pos
         self._scale = scale
         self._scale_matrix: m44 = m44.create_from_scale(v3([self._scale] * 3))
-        # Load wavefront
-        self._load_obj()
+        # World and normal matrix, recomputed only after the model changes
+        self._world: m44 = None
+        self._normal: np.ndarray = None
+        # Scene graph node holding the model matrix (see scene_graph.py), None for a standalone object
+        self.graph = None
+        self.node: int = -1
+        self._world_version: int = -1  # Graph node version the cached matrices were computed for
+        # Load wavefront (or reuse already loaded one)
+        self.mesh: Mesh = Mesh.acquire(path, loader)
+
+    @property
+    def model(self) -> m44:
+        """Model matrix without the object's scale. Relative to the parent node if the object is in a scene graph."""
+        return self.graph.local(self.node) if self.graph is not None else self._model
+
+    @model.setter
+    def model(self, model: m44) -> None:
+        if self.graph is not None:
+            # Takes effect on the graph's next update, which reports moved nodes to whoever draws them
+            self.graph.set_local(self.node, model)
+            return
+        self._model = model
+        self._world, self._normal = None, None
+        if self._instance_group is not None:
+            self._instance_group.mark_dirty(self._instance_ind)
+        if self._bvh is not None:
+            self._bvh.mark_dirty(self._bvh_ind)
 
     def set_pos(self, pos: v3):
         self.pos = m44.create_from_translation(pos)
         self.model = self.pos
 
-    def _load_obj(self) -> None:
-        """Loads wavefront obj and materials. Stores vertex data into VAOs and VBOs."""
-        self._wavefront = pywavefront.Wavefront(self._path, collect_faces=True, create_materials=True)
-
-        # Generate buffers
-        materials_count = len(self._wavefront.materials)
-        self.vaos = glGenVertexArrays(materials_count)
-        self._vbos = glGenBuffers(materials_count)
-        self.textures = glGenTextures(materials_count)
-
-        if materials_count == 1:
-            # glGen* will return an int instead of an np.array if argument is 1.
-            self.vaos = np.array([self.vaos], dtype=np.uint32)
-            self._vbos = np.array([self._vbos], dtype=np.uint32)
-            self.textures = np.array([self.textures], dtype=np.uint32)
-
-        # For each material fill buffers and load a texture
-        ind = 0
-        for material in self._wavefront.materials.values():
-            vertex_size = material.vertex_size
-            scene_vertices = np.array(material.vertices, dtype=np.float32)
-            # Store length and materials for drawing
-            self.lengths.append(len(scene_vertices))
-            self.materials.append(material)
-            # Load texture by path (may break in some weird cases, I guess)
-            if material.texture is not None:
-                self._load_texture(material.texture.path, self.textures[ind])
-                self.use_texture = True
-
-            # Bind VAO
-            glBindVertexArray(self.vaos[ind])
-            # Fill VBO
-            glBindBuffer(GL_ARRAY_BUFFER, self._vbos[ind])
-            glBufferData(GL_ARRAY_BUFFER, scene_vertices.nbytes, scene_vertices, GL_STATIC_DRAW)
-
-            # Set attribute buffers
-            attr_format = {
-                "T2F": (1, 2),  # Tex coords (2 floats): ind=1
-                "C3F": (2, 3),  # Color (3 floats): ind=2
-                "N3F": (3, 3),  # Normal (3 floats): ind=3
-                "V3F": (0, 3),  # Position (3 floats): ind=0
-            }
-
-            cur_off = 0  # current start offset
-            for attr in material.vertex_format.split("_"):
-                if attr not in attr_format:
-                    raise Exception("Unknown format")
-
-                # Apply
-                attr_ind, attr_size = attr_format[attr]
-                glEnableVertexAttribArray(attr_ind)
-                glVertexAttribPointer(attr_ind, attr_size, GL_FLOAT, GL_FALSE, scene_vertices.itemsize * vertex_size,
-                                      ctypes.c_void_p(cur_off))
-                cur_off += attr_size * 4
-
-            # Unbind (Technically not necessary but used as a precaution)
-            glBindVertexArray(0)
-            ind += 1
-
-    @staticmethod
-    def _load_texture(path: str, texture: int) -> None:
+    def attach(self, graph, parent: int = -1) -> int:
         """
-        Loads texture into buffer by given path and tex buffer ID.
+        Moves the model matrix into a new scene graph node.
 
-        :param path: Texture path.
-        :param texture: Texture buffer ID.
+        :param graph: SceneGraph.
+        :param parent: Parent node, -1 for a root.
+        :return: Node of the object.
         """
-        # For use with GLFW
-        glBindTexture(GL_TEXTURE_2D, texture)
-        # Set the texture wrapping parameters
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-        # Set texture filtering parameters
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-        # Load image
-        image = Image.open(path)
-        image = image.transpose(Image.FLIP_TOP_BOTTOM)
-        img_data = image.convert("RGBA").tobytes()
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, image.width, image.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, img_data)
-
-    def draw(self, shader: Shader, model=None) -> None:
-        """Draws loaded object onto GL buffer with selected shader."""
-        # shader.use_program()  # Not really sure if that's how you should do it
-        for vao, tex, length, mat in zip(self.vaos, self.textures, self.lengths, self.materials):
-            glBindVertexArray(vao)
-            glBindTexture(GL_TEXTURE_2D, tex)
-            if model is not None:
-                shader.set_model(model)
-            else:
-                shader.set_model(m44.multiply(self._scale_matrix, self.model))
-            shader.set_v3("material.ambient", mat.ambient)
-            shader.set_v3("material.diffuse", mat.diffuse)
-            shader.set_v3("material.specular", mat.specular)
-            shader.set_float("material.shininess", mat.shininess)
-            glDrawArrays(GL_TRIANGLES, 0, length)
+        self.node = graph.add(self._model, parent, self._scale)
+        self.graph = graph
+        return self.node
+
+    def set_instance_group(self, group, ind: int) -> None:
+        self._instance_group, self._instance_ind = group, ind
+
+    def set_bvh(self, bvh, ind: int) -> None:
+        self._bvh, self._bvh_ind = bvh, ind
+
+    @property
+    def bounds(self) -> np.ndarray:
+        """Local (mesh space) AABB as [min corner, max corner]."""
+        return self.mesh.bounds
+
+    def world_matrix(self) -> m44:
+        """Model matrix including object's scale."""
+        if self.graph is not None:
+            version = self.graph.version(self.node)
+            if version != self._world_version:
+                self._world, self._normal = self.graph.object_matrices(self.node), None
+                self._world_version = version
+        if self._world is None:
+            self._world = m44.multiply(self._scale_matrix, self._model)
+        return self._world
+
+    def normal_matrix(self) -> np.ndarray:
+        """3x3 float32 matrix transforming normals to world space, in the same layout as `world_matrix`."""
+        world = self.world_matrix()  # Also drops a stale normal matrix
+        if self._normal is None:
+            self._normal = normal_matrix(world)
+        return self._normal
+
+    def release(self) -> None:
+        """Releases shared GPU resources. The object cannot be drawn afterwards."""
+        if self.mesh is not None:
+            self.mesh.release()
+            self.mesh = None
+
+    def enqueue(self, render_queue, shader: Shader, lod: int = 0) -> None:
+        """Queues draws of the object into a RenderQueue (see render_queue.py)."""
+        self.mesh.enqueue(render_queue, shader, self.world_matrix(), lod, normal_matrix=self.normal_matrix())
+
+    def draw(self, shader: Shader, model=None, lod: int = 0) -> None:
+        """Draws loaded object onto GL buffer with selected shader and level of detail."""
+        if model is None:
+            self.mesh.draw(shader, self.world_matrix(), lod, self.normal_matrix())
+        else:
+            self.mesh.draw(shader, model, lod, normal_matrix(model))
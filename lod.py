@@ -0,0 +1,39 @@
+import numpy as np
+
+
+class LodSelector:
+    # Level i + 1 is used below screen_sizes[i], size being the bounding sphere diameter relative to screen height
+    screen_sizes = np.array([0.5, 0.2, 0.08])
+    # Relative margin around every threshold, so objects near one don't switch levels every frame
+    hysteresis: float = 0.15
+
+    def __init__(self, count: int):
+        """Picks a level of detail for each of `count` objects from its projected size.
+
+        :param count: Number of objects.
+        """
+        self.lods = np.zeros(count, dtype=np.int64)
+
+    def update(self, centers: np.ndarray, radii: np.ndarray, level_counts: np.ndarray, view: np.ndarray,
+               projection: np.ndarray, quality: float = 1.0) -> np.ndarray:
+        """
+        Updates levels of detail, keeping the current one while the size stays within the hysteresis margin.
+
+        :param centers: (n, 3) world bounding sphere centers.
+        :param radii: (n,) world bounding sphere radii.
+        :param level_counts: (n,) number of levels every object has.
+        :param view: View matrix.
+        :param projection: Projection matrix.
+        :param quality: Scale of projected sizes, below 1 picks coarser levels (see `AdaptiveQuality`).
+        :return: Level of detail of every object, 0 is full detail.
+        """
+        eye = np.linalg.inv(np.asarray(view, dtype=np.float64))[3, :3]
+        distance = np.maximum(np.linalg.norm(centers - eye, axis=1) - radii, 1e-6)
+        # Projected diameter 2 * r * p11 / d in NDC units, over the NDC height of 2
+        size = radii * projection[1][1] / distance * quality
+
+        # Level the object is clearly small enough for, and the coarsest one it is not clearly too large for
+        lowest = (size[:, None] < self.screen_sizes * (1 - self.hysteresis)).sum(axis=1)
+        highest = (size[:, None] < self.screen_sizes * (1 + self.hysteresis)).sum(axis=1)
+        self.lods = np.minimum(np.clip(self.lods, lowest, highest), level_counts - 1)
+        return self.lods
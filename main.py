@@ -1,32 +1,74 @@
 import glfw
+import numpy as np
 from OpenGL.GL import *
 from pyrr import matrix44 as m44, Vector3 as v3
 import math
 
-from shader import Shader
+from shader import Shader, ShaderWatcher
 from loaded_object import LoadedObject
 from light import DirLight, PointLight, SpotLight
+from instancing import build_instance_groups
+from render_queue import RenderQueue
+from uniform_buffer import UniformBuffer
+from clustered_lights import LightClusters
+from gbuffer import GBuffer
+from culling import BVH
+from lod import LodSelector
+from occlusion import OcclusionCuller
+from post_process import PostProcess
+from view import RenderTarget, View
+from scene_graph import SceneGraph, interpolate_transform
+from shadows import Shadows
+from clock import Clock, GlfwClock, FixedTimestep
+from frame_pacing import VSYNC_MODES, AdaptiveQuality, FramePacer, swap_interval
+from profiler import counters, Profiler
+from overlay import TextOverlay
+from asset_loader import AssetLoader
 
 
 class Window:
-    def __init__(self, width: int, height: int, title: str):
-        # Initialize window
-        if not glfw.init():
-            raise Exception("GLFW cannot be initialized!")
-
+    def __init__(self, width: int, height: int, title: str, clock: Clock = None, headless: bool = False,
+                 boxes: int = 6, point_light_count: int = 4, async_loading: bool = True, watch_shaders: bool = False,
+                 vsync: str = "adaptive", fps_cap: float = None, adaptive_quality: bool = False,
+                 resolution_scale: float = 1.0):
+        """Scene window with its OpenGL context.
+
+        :param width: Framebuffer width.
+        :param height: Framebuffer height.
+        :param title: Window title.
+        :param clock: Time source for animations, wall clock by default.
+        :param headless: Render into an offscreen EGL framebuffer instead of a window (see headless.py).
+        :param boxes: Number of boxes along each side of the scene.
+        :param point_light_count: Number of point lights, lights above the default four are generated.
+        :param async_loading: Load meshes and textures in the background (see asset_loader.py), objects
+            appear as they finish loading. Otherwise everything is loaded before the first frame.
+        :param watch_shaders: Reload shaders when their source files change (see `ShaderWatcher`).
+        :param vsync: Vsync mode of the window, one of `VSYNC_MODES` (see `swap_interval`).
+        :param fps_cap: Most frames per second `main_loop` draws, None for no limit.
+        :param adaptive_quality: Lower quality in `main_loop` while frames miss their budget (the refresh period,
+            or the frame rate cap), see `AdaptiveQuality`: levels of detail by frame time, and resolution (starting
+            at `resolution_scale`) by GPU frame time.
+        :param resolution_scale: Scene resolution relative to the window, the scene is upscaled by post processing.
+        """
         self._width, self._height = width, height
-        self._window = glfw.create_window(width, height, title, None, None)
-
-        if not self._window:
-            glfw.terminate()
-            raise Exception("Window cannot be created!")
-
-        # Set resize handler
-        glfw.set_window_size_callback(self._window, self._on_resize)
-        # Set keyboard input handler
-        glfw.set_key_callback(self._window, self._on_key_input)
-        # Set window as current context
-        glfw.make_context_current(self._window)
+        self._window, self._context = None, None
+        self._target_fbo = 0  # Framebuffer the scene ends up in
+        self.vsync: str = vsync
+        if headless:
+            from headless import HeadlessContext  # Needs PYOPENGL_PLATFORM=egl
+            self._context = HeadlessContext(width, height)
+            self._target_fbo = self._context.fbo
+        else:
+            self._create_window(title)
+        self.clock: Clock = clock if clock is not None else GlfwClock()
+        # Animations are simulated in fixed steps and frames drawn between the last two (see `_simulate`)
+        self._timestep = FixedTimestep()
+        self._time: float = 0.0  # Time the current frame shows, read by everything animated
+        self._poses = {}  # Scene object name -> local matrices of the last two simulation steps
+        self._pacer = FramePacer(fps_cap, glfw.wait_events_timeout)
+        budget_ms = 1000 / (fps_cap or self._refresh_rate())
+        self._quality = AdaptiveQuality(budget_ms) if adaptive_quality else None
+        self._resolution = AdaptiveQuality(budget_ms) if adaptive_quality else None  # Resolution scale
 
         # Set options
         glEnable(GL_DEPTH_TEST)
@@ -37,121 +79,267 @@ class Window:
         self._background_color_day = v3([0.6, 0.7, 0.75])
 
         # Camera
-        self.sel_camera: str = "static"  # Selected camera name
-        self.update_camera: bool = True
         self._static_target: v3 = v3([0, 2.0, 0])
         self._default_eye: v3 = v3([math.sin(0) * 10, 8, math.cos(0) * 10])
 
-        # Matrices
-        self._fov, self._near, self._far = None, None, None
-        self._eye, self._target, self._up = None, None, None
-        self.projection_matrix, self.view_matrix = None, None
-        self._prepare_matrices()
+        # Views drawn every frame, the first one is the main view (see `add_view`)
+        self.views = [View("static")]
+        self.view: View = self.views[0]  # View being drawn
+        self._split_view, self._monitor_view = None, None
 
-        # Shaders
+        # Shaders, drawn with variants for current settings (see `_variant`)
+        shadow_defines = {"SHADOW_CASCADES": Shadows.cascade_count}
         self.shaders = {
-            "phong": Shader("shaders/phong_vs.glsl", "shaders/phong_fs.glsl"),
+            "phong": Shader("shaders/phong_vs.glsl", "shaders/phong_fs.glsl", shadow_defines),
             "gouraud": Shader("shaders/gouraud_vs.glsl", "shaders/gouraud_fs.glsl"),
             "light_source": Shader("shaders/light_source_vs.glsl", "shaders/light_source_fs.glsl"),
+            # Deferred shading: geometry pass into G-buffer, then lighting pass over screen pixels
+            "deferred": Shader("shaders/phong_vs.glsl", "shaders/gbuffer_fs.glsl"),
+            "deferred_lighting": Shader("shaders/deferred_vs.glsl", "shaders/deferred_fs.glsl", shadow_defines),
+            "overlay": Shader("shaders/overlay_vs.glsl", "shaders/overlay_fs.glsl"),
+            "shadow": Shader("shaders/shadow_vs.glsl", "shaders/shadow_fs.glsl"),
+            "occlusion_box": Shader("shaders/occlusion_box_vs.glsl", "shaders/shadow_fs.glsl"),
+            # Post processing passes, see `PostProcess`
+            **{f"post_{name}": Shader("shaders/post_vs.glsl", f"shaders/post_{name}_fs.glsl")
+               for name in (*PostProcess.pass_order, "copy")},
         }
+        self._shader_watcher = ShaderWatcher(self.shaders.values()) if watch_shaders else None
         self.current_shader: Shader = None
         self.sel_shader_key: str = "phong"  # Shaders dict key for selected shader
         self._use_shader(self.shaders[self.sel_shader_key])
-        self._fog_on = False
         self._fog_color = v3([0, 0, 0])
 
+        # Uniform blocks shared by all shaders, uploaded once per frame (see GLSL for layouts)
+        self._ubos = {
+            "Matrices": UniformBuffer("Matrices", 144),  # projection, view, viewPos
+            "Lights": UniformBuffer("Lights", 144),  # dirLight, spotLight
+            "Fog": UniformBuffer("Fog", 32),  # fogParams
+            "Clusters": UniformBuffer("Clusters", 48),  # Point light cluster grid parameters
+            "Shadows": UniformBuffer("Shadows", 304),  # Shadow map matrices and cascade splits
+        }
+        self._gbuffer = GBuffer(self._width, self._height)
+        # Scene is drawn into an HDR target at a scaled resolution, then fogged, tonemapped, anti-aliased and upscaled
+        post_shaders = {name: self.shaders[f"post_{name}"] for name in (*PostProcess.pass_order, "copy")}
+        self.post_process = PostProcess(self._width, self._height, post_shaders)
+        self.resolution_scale = resolution_scale
+        self._fullscreen_vao = glGenVertexArrays(1)  # Empty, full screen triangle is generated in shader
+        self.profiler = Profiler(["load_assets", "set_daytime", "move_objects", "process_camera", "upload_uniforms",
+                                  "cull_objects", "occlusion_culling", "select_lods", "render_shadows",
+                                  "draw_light_sources", "draw_objects", "draw_views", "post_process"])
+        self._overlay = TextOverlay(self.shaders["overlay"])
+        self.show_overlay: bool = False
+
         # Scene
+        self.spot_light_offset = v3([0.0, -0.8, 0.75])  # Relative offset from monkey
+        self._loader = AssetLoader() if async_loading else None
+        loader = self._loader
         self.scene = {
-            "floor_1": LoadedObject("data/floor.obj", -5, 0, -5),
-            "floor_2": LoadedObject("data/floor.obj", -5, 0, 5),
-            "floor_3": LoadedObject("data/floor.obj", 5, 0, -5),
-            "floor_4": LoadedObject("data/floor.obj", 5, 0, 5),
-            "earth": LoadedObject("data/uv_sphere.obj", 0, 1.4 * 1.5, 0, scale=1.4),
-            "race_monkey": LoadedObject("data/monkey.obj", -3, 1.2, 0, ),
+            "floor_1": LoadedObject("data/floor.obj", -5, 0, -5, loader=loader),
+            "floor_2": LoadedObject("data/floor.obj", -5, 0, 5, loader=loader),
+            "floor_3": LoadedObject("data/floor.obj", 5, 0, -5, loader=loader),
+            "floor_4": LoadedObject("data/floor.obj", 5, 0, 5, loader=loader),
+            "earth": LoadedObject("data/uv_sphere.obj", 0, 1.4 * 1.5, 0, scale=1.4, loader=loader),
+            "race_monkey": LoadedObject("data/monkey.obj", -3, 1.2, 0, loader=loader),
         }
-        self.scene = {**dict(self._box_gen(6, 7.0)), **self.scene}  # Generate boxes
+        self.scene = {**dict(self._box_gen(boxes, 7.0, loader)), **self.scene}  # Generate boxes
+        # Transform hierarchy of scene objects, and the spotlight and moving camera attached to the monkey
+        self.graph = SceneGraph(len(self.scene) + 2)
+        self._object_nodes = np.array([o.attach(self.graph) for o in self.scene.values()], dtype=np.int64)
+        monkey = self.scene["race_monkey"].node
+        self._spot_light_node = self.graph.add(m44.create_from_translation(self.spot_light_offset), monkey)
+        self._camera_node = self.graph.add(m44.create_from_translation(v3([0, 1.0, 0])), monkey)
+        self._object_of_node = np.full(len(self.graph), -1, dtype=np.int64)  # Scene index of every node
+        self._object_of_node[self._object_nodes] = np.arange(len(self.scene))
+        self.graph.update()
+        self.instanced: bool = True  # Draw objects sharing a mesh with one instanced draw call
+        self._render_queue = RenderQueue()  # Scene draws sorted by render state
+        self._instance_groups = build_instance_groups(self.scene.values())
+        self.culling: bool = True  # Draw only objects intersecting the view frustum
+        self._bvh = BVH(self.scene.values())
+        self.occlusion_culling: bool = True  # Also skip objects hidden behind large objects (needs culling)
+        self._occlusion = OcclusionCuller(len(self.scene), self._width, self._height, self.shaders["occlusion_box"])
+        self.use_lods: bool = True  # Draw distant objects with simplified meshes
+        self._lod_counts = np.array([o.mesh.lod_count for o in self.scene.values()])
+        self._shadows = Shadows()
+        # Objects that moved since the first frame, the rest are static shadow casters whose depth is cached
+        self._dynamic = np.zeros(len(self.scene), dtype=bool)
 
         # Lighting
-        self._point_light_obj = LoadedObject("data/uv_sphere.obj")  # sphere to represent point light sources
-        self._light_obj = LoadedObject("data/box/box-V3F.obj")  # Box to represent light sources
+        self._point_light_obj = LoadedObject("data/uv_sphere.obj", loader=loader)  # sphere to represent point lights
+        self._light_obj = LoadedObject("data/box/box-V3F.obj", loader=loader)  # Box to represent light sources
 
         self.sun_moon = DirLight(amb=v3([0.05, 0.05, 0.05]), dif=v3([0.4, 0.4, 0.8]), spe=v3([0.4, 0.4, 0.8]),
-                                 direction=v3([-0.2, -1.0, -0.3]), uni_name="dirLight")
+                                 direction=v3([-0.2, -1.0, -0.3]))
         point_lights = [
             (v3([5.5, 0.2, -5.5]), v3([1.0, 1.0, 1.0])),  # red
             (v3([-5.5, 0.2, 0.0]), v3([1.0, 1.0, 0.3])),  # yellow
             (v3([7.5, 2.2, 1.0]), v3([0.3, 0.3, 1.0])),  # blue
             (v3([3.0, 0.2, 3.0]), v3([1.0, 0.3, 0.3]))  # white
         ]
-        self.point_lights = list(self._pl_gen(point_lights))
+        point_lights += self._random_lights(point_light_count - len(point_lights))
+        self.point_lights = list(self._pl_gen(point_lights[:point_light_count]))
 
-        self.spot_light_offset = v3([0.0, -0.8, 0.75])  # Relative offset from monkey
         self.spot_light_def_dir = v3([0.0, -0.2, 0.0])  # Default direction (same as monkey)
         self.spot_light_angle_offset = 0  # TODO: Add changing with keyboard
         self.spot_light = SpotLight(amb=v3([0.0, 0.0, 0.0]), dif=v3([0.0, 1.0, 0.5]), spe=v3([0.0, 1.0, 0.5]),
                                     k=v3([1.0, 0.07, 0.017]), pos=v3([0.0] * 3), direction=self.spot_light_def_dir,
                                     co=math.cos(math.radians(22.5)), oco=math.cos(math.radians(25.0)),
-                                    uni_name="spotLight", lss=self.shaders["light_source"], obj=None)
+                                    lss=self.shaders["light_source"], obj=None)
+        self._prepare_view(self.views[0])
 
     def _pl_gen(self, positions):
         """Point lights generator."""
-        for i, (p, c) in enumerate(positions):
+        for p, c in positions:
             light = PointLight(amb=0.05 * c, dif=1.0 * c, spe=1.0 * c,
-                               k=v3([1.0, 0.07, 0.017]), pos=p,
-                               uni_name=f"pointLights[{i}]", lss=self.shaders["light_source"],
+                               k=v3([1.0, 0.07, 0.017]), pos=p, lss=self.shaders["light_source"],
                                obj=self._point_light_obj)
             yield light
 
+    def _create_window(self, title: str) -> None:
+        # Initialize window
+        if not glfw.init():
+            raise Exception("GLFW cannot be initialized!")
+
+        self._window = glfw.create_window(self._width, self._height, title, None, None)
+
+        if not self._window:
+            glfw.terminate()
+            raise Exception("Window cannot be created!")
+
+        # Set resize handler
+        glfw.set_window_size_callback(self._window, self._on_resize)
+        # Set keyboard input handler
+        glfw.set_key_callback(self._window, self._on_key_input)
+        # Set window as current context
+        glfw.make_context_current(self._window)
+        glfw.swap_interval(swap_interval(self.vsync))
+
+    def _refresh_rate(self) -> float:
+        """Refresh rate of the primary monitor, 60 Hz if unknown (e.g. headless)."""
+        monitor = glfw.get_primary_monitor() if self._window is not None else None
+        mode = glfw.get_video_mode(monitor) if monitor else None
+        return mode.refresh_rate if mode and mode.refresh_rate > 0 else 60.0
+
     @staticmethod
-    def _box_gen(num, mx):
+    def _random_lights(num: int) -> list:
+        """Extra point lights scattered over the floor. Seeded, so every run gets the same scene."""
+        rng = np.random.default_rng(0)
+        return [(v3(rng.uniform([-9.0, 0.2, -9.0], [9.0, 3.0, 9.0])), v3(rng.uniform(0.2, 1.0, 3)))
+                for _ in range(max(num, 0))]
+
+    @staticmethod
+    def _box_gen(num, mx, loader=None):
         box_path = "data/box/box-T2F_N3F_V3F.obj"
         p = lambda n: (mx * 2) / num * (n % num) - mx + 1
 
         for i in range(num * 4):
             if i < num:
-                yield f"box_{i}", LoadedObject(box_path, p(i), 1.0, -mx - 1)
-                yield f"box_{i}_", LoadedObject(box_path, p(i), 3.0, -mx - 1)
+                yield f"box_{i}", LoadedObject(box_path, p(i), 1.0, -mx - 1, loader=loader)
+                yield f"box_{i}_", LoadedObject(box_path, p(i), 3.0, -mx - 1, loader=loader)
             elif i < num * 2:
-                yield f"box_{i}", LoadedObject(box_path, p(i), 1.0, mx + 1)
-                yield f"box_{i}_", LoadedObject(box_path, p(i), 3.0, mx + 1)
+                yield f"box_{i}", LoadedObject(box_path, p(i), 1.0, mx + 1, loader=loader)
+                yield f"box_{i}_", LoadedObject(box_path, p(i), 3.0, mx + 1, loader=loader)
             elif i < num * 3:
-                yield f"box_{i + 12}", LoadedObject(box_path, mx + 1, 1.0, p(i))
-                yield f"box_{i + 12}_", LoadedObject(box_path, mx + 1, 3.0, p(i))
+                yield f"box_{i + 12}", LoadedObject(box_path, mx + 1, 1.0, p(i), loader=loader)
+                yield f"box_{i + 12}_", LoadedObject(box_path, mx + 1, 3.0, p(i), loader=loader)
             else:
-                yield f"box_{i + 18}", LoadedObject(box_path, -mx - 1, 1.0, p(i))
+                yield f"box_{i + 18}", LoadedObject(box_path, -mx - 1, 1.0, p(i), loader=loader)
+
+    def _variant(self, key: str) -> Shader:
+        """Variant of a shader for current settings, features that are off are compiled out."""
+        return self.shaders[key].variant(INSTANCED=self.instanced, SHADOWS=self._shadows.enabled)
 
     def _use_shader(self, shader: Shader) -> None:
         self.current_shader = shader
         self.current_shader.use()
-        # Update matrices after changing shader
-        self._update_projection()
-        self._update_view()
-
-    def _prepare_matrices(self) -> None:
-        # Projection matrix
-        self._fov = 45
-        self._near = 0.1
-        self._far = 100
-        # View matrix
-        self._eye: v3 = self._default_eye
-        self._target: v3 = self._static_target
-        self._up: v3 = v3([0, 1, 0])
-
-    def _update_view(self) -> None:
-        """Recalculate view matrix and upload it to shader."""
-        self.view_matrix = m44.create_look_at(self._eye, self._target, self._up)
-        self.current_shader.set_view(self.view_matrix)
-
-    def _update_projection(self) -> None:
-        """Recalculate projection matrix and upload it to shader."""
-        a = self._width / self._height
-        self.projection_matrix = m44.create_perspective_projection(self._fov, a, self._near, self._far)
-        self.current_shader.set_projection(self.projection_matrix)
+
+    @property
+    def resolution_scale(self) -> float:
+        """Scene resolution relative to the window, along each axis (see `PostProcess`)."""
+        return self.post_process.scale
+
+    @resolution_scale.setter
+    def resolution_scale(self, scale: float) -> None:
+        self.post_process.scale = scale
+        if self._resolution is not None:
+            self._resolution.scale = self.post_process.scale
+
+    @property
+    def sel_camera(self) -> str:
+        """Camera of the main view."""
+        return self.views[0].camera
+
+    @sel_camera.setter
+    def sel_camera(self, camera: str) -> None:
+        self.views[0].camera = camera
+        self.views[0].update_camera = True
+
+    def _prepare_view(self, view: View) -> None:
+        """Gives a view its own light clusters and level of detail state, and places its camera."""
+        view.light_clusters = LightClusters()
+        view.object_lods = LodSelector(len(self.scene))
+        view.light_lods = LodSelector(len(self.point_lights))
+        view.look_at(self._default_eye, self._static_target)
+        view.update_projection(self._width, self._height)
+
+    def add_view(self, view: View) -> View:
+        """
+        Adds a view drawn every frame after the main view, e.g. a split screen half or a monitor.
+
+        :param view: View to add, released by `remove_view` or `release`.
+        :return: The view.
+        """
+        self._prepare_view(view)
+        self.views.append(view)
+        return view
+
+    def remove_view(self, view: View) -> None:
+        self.views.remove(view)
+        for group in self._instance_groups:
+            group.release_pass(view)
+        view.release()
+
+    def toggle_split_screen(self) -> None:
+        """Splits the window between the main view (left half) and the moving camera (right half), or back."""
+        main_view = self.views[0]
+        if self._split_view is None:
+            main_view.viewport = (0.0, 0.0, 0.5, 1.0)
+            self._split_view = self.add_view(View("moving", (0.5, 0.0, 0.5, 1.0)))
+        else:
+            self.remove_view(self._split_view)
+            self._split_view = None
+            main_view.viewport = (0.0, 0.0, 1.0, 1.0)
+        main_view.update_projection(self._width, self._height)
+
+    def toggle_monitor(self) -> None:
+        """Shows the following camera in the top right corner, rendered into a quarter size texture every other
+        frame, or hides it."""
+        if self._monitor_view is None:
+            target = RenderTarget(max(self._width // 4, 1), max(self._height // 4, 1))
+            self._monitor_view = self.add_view(View("following", (0.74, 0.74, 0.25, 0.25), target, interval=2))
+        else:
+            self.remove_view(self._monitor_view)
+            self._monitor_view = None
+
+    def _view_rect(self, view: View) -> tuple:
+        """Part of the framebuffer a view is drawn into, views of the window are drawn at the scaled resolution."""
+        return view.rect(*self.post_process.render_size)
+
+    def _bind_view(self, view: View) -> None:
+        """Binds the framebuffer a view is drawn into and sets the viewport to its part of it."""
+        glBindFramebuffer(GL_FRAMEBUFFER, view.target.fbo if view.target is not None else self.post_process.fbo)
+        glViewport(*self._view_rect(view))
 
     def _on_resize(self, _window, width, height) -> None:
+        if width == 0 or height == 0:
+            return  # Minimized on some platforms, keep the old size, `main_loop` does not draw until restored
         self._width, self._height = width, height
         glViewport(0, 0, self._width, self._height)
-        self._update_projection()
+        for view in self.views:
+            view.update_projection(self._width, self._height)
+        self._gbuffer.resize(self._width, self._height)
+        self._occlusion.resize(self._width, self._height)
+        self.post_process.resize(self._width, self._height)
 
     def _on_key_input(self, _window, key, _scancode, action, _mode) -> None:
         left_right = {glfw.KEY_LEFT: 0.1, glfw.KEY_RIGHT: -0.1}
@@ -164,16 +352,44 @@ class Window:
         cam = {glfw.KEY_1: "static", glfw.KEY_2: "following", glfw.KEY_3: "moving"}
         if key in cam:
             self.sel_camera = cam[key]
-            self.update_camera = True
         elif key == glfw.KEY_O:
             self.sel_shader_key = "gouraud"
         elif key == glfw.KEY_P:
             self.sel_shader_key = "phong"
+        elif key == glfw.KEY_D:
+            self.sel_shader_key = "deferred"
         elif key == glfw.KEY_F:
-            self._fog_on = not self._fog_on
+            self.post_process.enabled["fog"] = not self.post_process.enabled["fog"]
+        elif key == glfw.KEY_X:
+            self.post_process.enabled["fxaa"] = not self.post_process.enabled["fxaa"]
+        elif key == glfw.KEY_R:
+            scales = [1.0, 0.75, 0.5]
+            self.resolution_scale = next((s for s in scales if s < self.resolution_scale - 1e-3), scales[0])
+        elif key == glfw.KEY_I:
+            self.instanced = not self.instanced
+        elif key == glfw.KEY_C:
+            self.culling = not self.culling
+        elif key == glfw.KEY_L:
+            self.use_lods = not self.use_lods
+        elif key == glfw.KEY_H:
+            self._shadows.enabled = not self._shadows.enabled
+        elif key == glfw.KEY_T:
+            self.show_overlay = not self.show_overlay
+        elif key == glfw.KEY_Y:
+            self.profiler.dump("trace.csv")
+        elif key == glfw.KEY_Z:
+            self.occlusion_culling = not self.occlusion_culling
+            self._occlusion.reset()
+        elif key == glfw.KEY_S:
+            self.toggle_split_screen()
+        elif key == glfw.KEY_M:
+            self.toggle_monitor()
+        elif key == glfw.KEY_V:
+            self.vsync = VSYNC_MODES[(VSYNC_MODES.index(self.vsync) + 1) % len(VSYNC_MODES)]
+            glfw.swap_interval(swap_interval(self.vsync))
 
     def _set_daytime(self):
-        blend_factor = (math.sin(glfw.get_time() * 0.1) + 1) / 2
+        blend_factor = (math.sin(self._time * 0.1) + 1) / 2
         c = self._background_color_day * (1 - blend_factor) + self._background_color_night * blend_factor
 
         self.sun_moon._diffuse = 0.9 * c
@@ -181,102 +397,362 @@ class Window:
         self._fog_color = c
         glClearColor(c.x, c.y, c.z, 1)
 
-    def _move_objects(self) -> None:
-        time = glfw.get_time()
+    def _simulate(self, time: float) -> None:
+        """Advances animated objects by one fixed step, to given time, keeping poses of the previous step."""
         # Move and rotate earth
         rot_y = m44.create_from_y_rotation(-0.5 * time)
         translation = m44.create_from_translation(v3([0, math.sin(time), 0]))
 
         model = m44.create_from_x_rotation(math.pi)  # upside down
         model = m44.multiply(translation, m44.multiply(model, self.scene["earth"].pos))  # up-down movement
-        self.scene["earth"].model = m44.multiply(rot_y, model)  # rotation
+        earth = m44.multiply(rot_y, model)  # rotation
 
-        # Move and orientate race_monkey
-        translation = v3([math.sin(time) * 5, 1.2, math.cos(time) * 5])
-        o = self.scene["race_monkey"]
-        o.set_pos(translation)
-        o.model = m44.multiply(m44.create_from_y_rotation(-time - math.pi / 2), o.model)
+        # Move and orientate race_monkey, the spotlight and moving camera follow as its children
+        translation = m44.create_from_translation(v3([math.sin(time) * 5, 1.2, math.cos(time) * 5]))
+        monkey = m44.multiply(m44.create_from_y_rotation(-time - math.pi / 2), translation)
 
-        # Move and orientate spotlight relatively to race_monkey
-        pos = m44.multiply(m44.create_from_translation(self.spot_light_offset), o.model)
-        self.spot_light.set_pos(v3.from_matrix44_translation(pos))
+        for name, pose in (("earth", earth), ("race_monkey", monkey)):
+            previous = self._poses[name][1] if name in self._poses else pose
+            self._poses[name] = (previous, pose)
+
+    def _move_objects(self) -> None:
+        """Places animated objects between their poses of the last two simulation steps."""
+        for name, (previous, current) in self._poses.items():
+            self.scene[name].model = interpolate_transform(previous, current, self._timestep.alpha)
+
+        self._update_graph()
+        self.spot_light.set_pos(v3(self.graph.world(self._spot_light_node)[3, :3]))
         light_dir = self._get_monkey_look_dir() + self.spot_light_def_dir
         self.spot_light.set_dir(light_dir)
 
+    def _update_graph(self) -> None:
+        """Propagates world transforms and schedules moved objects for BVH refit and instance upload."""
+        nodes = self.graph.update()
+        objects = self._object_of_node[nodes]
+        moved = np.zeros(len(self.scene), dtype=bool)
+        moved[objects[objects != -1]] = True
+        self._bvh.mark_dirty(moved)
+        for group in self._instance_groups:
+            group.mark_moved(moved)
+        if (moved & ~self._dynamic).any():
+            self._dynamic |= moved
+            self._shadows.invalidate_static()
+
     def _get_monkey_look_dir(self):
-        angle = glfw.get_time() + math.pi / 2 + self.spot_light_angle_offset
+        angle = self._time + math.pi / 2 + self.spot_light_angle_offset
         return v3([math.sin(angle), 0.0, math.cos(angle)])
 
-    def _process_camera(self) -> None:
-        if not self.update_camera:
+    def _process_camera(self, view: View) -> None:
+        if not view.update_camera:
             return
 
-        if self.sel_camera == "static":
-            self._eye = self._default_eye
-            self._target = self._static_target
-            self.update_camera = False  # Static camera needs to be calculated only once.
-        elif self.sel_camera == "following":
-            self._eye = self._default_eye
-            self._target = v3.from_matrix44_translation(self.scene["race_monkey"].model)
-        elif self.sel_camera == "moving":
-            m = m44.multiply(m44.create_from_translation(v3([0, 1.0, 0])), self.scene["race_monkey"].model)
-            self._eye = v3.from_matrix44_translation(m)
-            self._target = self._eye + + self._get_monkey_look_dir()  # Front facing camera
-        self._update_view()
-
-    def _fog_params(self):
-        self.current_shader.set_bool("fogParams.on", self._fog_on)
-        if self._fog_on:
-            fog_start = math.sin(glfw.get_time() * 0.5) * 4 + 8
-            self.current_shader.set_v3("fogParams.color", self._fog_color)
-            self.current_shader.set_float("fogParams.start", fog_start)
-            self.current_shader.set_float("fogParams.end", fog_start + 10)
+        if view.camera == "static":
+            view.look_at(self._default_eye, self._static_target)
+            view.update_camera = False  # Static camera needs to be calculated only once.
+        elif view.camera == "following":
+            view.look_at(self._default_eye, v3.from_matrix44_translation(self.scene["race_monkey"].model))
+        elif view.camera == "moving":
+            eye = v3(self.graph.world(self._camera_node)[3, :3])
+            view.look_at(eye, eye + self._get_monkey_look_dir())  # Front facing camera
+
+    def _fog_params(self) -> np.ndarray:
+        """Fog parameters packed as std140 `struct FogParams { vec3 color; float start; float end; }`."""
+        fog_start = math.sin(self._time * 0.5) * 4 + 8
+        return np.array([*self._fog_color, fog_start, fog_start + 10, 0, 0, 0], dtype=np.float32)
+
+    def _upload_uniform_buffers(self) -> None:
+        """Packs per-frame uniforms shared by all shaders and uploads each block with a single call. Lights and fog
+        are shared by all views, camera matrices and light clusters are uploaded for the main view."""
+        self._ubos["Lights"].update(np.concatenate([self.sun_moon.pack(), self.spot_light.pack()]))
+        self._ubos["Fog"].update(self._fog_params())
+        self._upload_view_uniforms(self.view)
+
+    def _upload_view_uniforms(self, view: View) -> None:
+        """Uploads camera matrices of a view and bins point lights into its clusters."""
+        matrices = np.zeros(36, dtype=np.float32)
+        matrices[0:16] = np.ravel(view.projection_matrix)
+        matrices[16:32] = np.ravel(view.view_matrix)
+        matrices[32:35] = view.eye
+        self._ubos["Matrices"].update(matrices)
+
+        # Point lights are binned into view clusters, fragments only evaluate lights of their cluster
+        view.light_clusters.update(self.point_lights, view.view_matrix, view.projection_matrix, view.near, view.far)
+        self._ubos["Clusters"].update(view.light_clusters.pack_params(self._view_rect(view)))
+
+    def _load_assets(self) -> None:
+        """Reloads edited shaders and uploads assets finished in the background, within the loader's time budget."""
+        if self._shader_watcher is not None:
+            self._shader_watcher.process()
+        if self._loader is None or not self._loader.pending:
+            return
+        if self._loader.process():
+            self._on_assets_loaded()
+
+    def _on_assets_loaded(self) -> None:
+        """Refreshes data derived from meshes: bounds in the BVH and level of detail counts."""
+        self._bvh.mark_all_dirty()
+        self._lod_counts = np.array([o.mesh.lod_count for o in self.scene.values()])
+        self._shadows.invalidate_static()
+
+    def wait_for_assets(self) -> None:
+        """Blocks until every asset loading in the background is uploaded."""
+        if self._loader is not None and self._loader.wait():
+            self._on_assets_loaded()
+
+    def _cull_objects(self, view: View) -> None:
+        """Finds scene objects intersecting the view frustum."""
+        view.visible = self._bvh.cull(view.view_matrix, view.projection_matrix) if self.culling else None
+
+    def _cull_occluded(self) -> None:
+        """Removes objects hidden behind large objects from those visible in the main view (see `OcclusionCuller`)."""
+        if self.view.visible is None or not self.occlusion_culling:
+            return
+        lo, hi = self._bvh.boxes()
+        self.view.visible = self._occlusion.cull(self.view.visible, lo, hi, self.view.eye, self._draw_occluders)
+        self._bind_view(self.view)
+
+    def _draw_occluders(self, occluders: np.ndarray) -> None:
+        """Draws depth of given scene objects with the current camera into the bound framebuffer."""
+        self._draw_depth(occluders, m44.multiply(self.view.view_matrix, self.view.projection_matrix), "occluders")
+
+    def _select_lods(self, view: View) -> None:
+        """Picks levels of detail of scene objects and point light markers from their projected size in a view."""
+        if not self.use_lods:
+            view.lods = None
+            return
+        centers, radii = self._bvh.bounding_spheres()
+        quality = self._quality.scale if self._quality is not None else 1.0
+        view.lods = view.object_lods.update(centers, radii, self._lod_counts, view.view_matrix,
+                                            view.projection_matrix, quality)
+        if self.point_lights:
+            centers, radii = zip(*(light.marker_sphere() for light in self.point_lights))
+            view.light_lods.update(np.array(centers), np.array(radii), self._point_light_obj.mesh.lod_count,
+                                   view.view_matrix, view.projection_matrix, quality)
+
+    def _render_shadows(self) -> None:
+        """Renders shadow maps of the directional light and the spotlight, uploads their matrices and binds them.
+        Cascades are fitted to the main view, other views sample the same maps."""
+        view = self.views[0]
+        glEnable(GL_POLYGON_OFFSET_FILL)
+        glPolygonOffset(2.0, 4.0)
+        self._shadows.update(view.view_matrix, view.projection_matrix, view.near, view.far,
+                             self.sun_moon.direction, self.spot_light.frustum(far=self._shadows.distance),
+                             self._bvh.bounds(), self._draw_shadow_casters)
+        glDisable(GL_POLYGON_OFFSET_FILL)
+        self._bind_view(self.view)
+        self._ubos["Shadows"].update(self._shadows.pack())
+        self._shadows.bind(Shader.sampler_units)
+
+    def _draw_shadow_casters(self, view: m44, projection: m44, static: bool, layer: tuple) -> None:
+        """Draws static, dynamic or (None) all scene objects intersecting a light frustum into the bound shadow map
+        layer, named by `layer`."""
+        casters = self._bvh.cull(view, projection)
+        if static is not None:
+            casters &= self._dynamic != static
+        if projection[3, 3] == 0:
+            # A perspective light inside an object (the spotlight in the monkey) would be entirely shadowed by it
+            centers, radii = self._bvh.bounding_spheres()
+            casters &= np.linalg.norm(centers - np.linalg.inv(view)[3, :3], axis=1) > radii
+        if casters.any():
+            self._draw_depth(casters, m44.multiply(view, projection), (*layer, static))
+
+    def _draw_depth(self, mask: np.ndarray, view_projection: m44, pass_key) -> None:
+        """Draws depth of scene objects in a mask, seen through given matrix, into the bound framebuffer. The pass
+        key names the pass for instance groups (see `InstanceGroup.enqueue`)."""
+        shader = self._variant("shadow")
+        self._use_shader(shader)
+        shader.set_m4("lightMatrix", view_projection)
+        if self.instanced:
+            for group in self._instance_groups:
+                group.enqueue(self._render_queue, shader, mask, pass_key=pass_key)
+        else:
+            objects = list(self.scene.values())
+            for ind in np.flatnonzero(mask):
+                objects[ind].enqueue(self._render_queue, shader)
+        self._render_queue.submit()
 
     def _draw_light_sources(self) -> None:
         """Draws light sources with appropriate shaders."""
-        self._use_shader(self.shaders["light_source"])
-        self._fog_params()
-        for light in self.point_lights:
-            light.draw()
-        self.spot_light.draw()
+        shader = self._variant("light_source")
+        self._use_shader(shader)
+        for light, lod in zip(self.point_lights, self.view.light_lods.lods):
+            light.enqueue(self._render_queue, lod if self.use_lods else 0, shader)
+        self.spot_light.enqueue(self._render_queue, shader=shader)
+        self._render_queue.submit()
 
     def _draw_objects(self) -> None:
         """Sets currently selected shader, then draws shaded objects."""
-        self._use_shader(self.shaders[self.sel_shader_key])
-        self.current_shader.set_v3("viewPos", self._eye)
-        self._fog_params()
-
-        # Use lights
-        self.sun_moon.use_light(self.current_shader)
-        for light in self.point_lights:
-            light.use_light(self.current_shader)
-        self.spot_light.use_light(self.current_shader)
+        if self.sel_shader_key == "deferred":
+            self._draw_deferred()
+            return
 
-        # Draw objects
-        for o in self.scene.values():
-            o.draw(self.current_shader)
+        self._use_shader(self._variant(self.sel_shader_key))
+        self.view.light_clusters.bind()
+        self._draw_scene()
+
+    def _draw_deferred(self) -> None:
+        """Draws objects into G-buffer, then shades every pixel once in a full screen pass."""
+        glBindFramebuffer(GL_FRAMEBUFFER, self._gbuffer.fbo)
+        glDisable(GL_BLEND)  # Alpha channels hold G-buffer data
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        self._use_shader(self._variant("deferred"))
+        self._draw_scene()
+        self._bind_view(self.view)
+        glEnable(GL_BLEND)
 
-    def main_loop(self) -> None:
-        while not glfw.window_should_close(self._window):
-            glfw.poll_events()
+        # Lighting pass writes G-buffer depth, so light sources drawn earlier stay in front
+        self._use_shader(self._variant("deferred_lighting"))
+        self.view.light_clusters.bind()
+        self._gbuffer.bind_textures(Shader.sampler_units)
+        glBindVertexArray(self._fullscreen_vao)
+        glDrawArrays(GL_TRIANGLES, 0, 3)
+        counters.draw_calls += 1
+        counters.state_changes += 2  # G-buffer and target framebuffer binds
+
+    def _draw_scene(self) -> None:
+        """Draws scene objects visible in the current view with current shader."""
+        visible, lods = self.view.visible, self.view.lods
+        if self.instanced:
+            for group in self._instance_groups:
+                group.enqueue(self._render_queue, self.current_shader, visible, lods, pass_key=self.view)
+        else:
+            for ind, o in enumerate(self.scene.values()):
+                if visible is None or visible[ind]:
+                    o.enqueue(self._render_queue, self.current_shader, lods[ind] if lods is not None else 0)
+        self._render_queue.submit()
+
+    def _draw_views(self) -> None:
+        """Draws views after the main one, reusing this frame's animation, light uniforms and shadow maps, then
+        copies render target views into the scene target, depth included, so post processing treats them alike."""
+        for view in self.views[1:]:
+            if not view.due():
+                continue
+            self.view = view
+            self._bind_view(view)
+            glEnable(GL_SCISSOR_TEST)  # Clear only the view's part of the window
+            glScissor(*self._view_rect(view))
             glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-
-            # Update scene
+            glDisable(GL_SCISSOR_TEST)
+            self._upload_view_uniforms(view)
+            self._cull_objects(view)
+            self._select_lods(view)
+            self._draw_light_sources()
+            self._draw_objects()
+        self.view = self.views[0]
+
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, self.post_process.fbo)
+        for view in self.views[1:]:
+            if view.target is not None and view.viewport is not None:
+                x, y, w, h = view.window_rect(*self.post_process.render_size)
+                source = (0, 0, view.target.width, view.target.height)
+                glBindFramebuffer(GL_READ_FRAMEBUFFER, view.target.fbo)
+                glBlitFramebuffer(*source, x, y, x + w, y + h, GL_COLOR_BUFFER_BIT, GL_LINEAR)
+                glBlitFramebuffer(*source, x, y, x + w, y + h, GL_DEPTH_BUFFER_BIT, GL_NEAREST)
+                counters.state_changes += 1
+        glBindFramebuffer(GL_FRAMEBUFFER, self.post_process.fbo)
+
+    def _post_process(self) -> None:
+        """Fogs, tonemaps, anti-aliases and upscales the scene into the target framebuffer."""
+        self.post_process.depth_range = (self.view.near, self.view.far)
+        self.post_process.run(self._target_fbo)
+
+    def release(self) -> None:
+        """Releases GPU resources of scene objects."""
+        if self._loader is not None:
+            self._loader.shutdown()
+        if self._shader_watcher is not None:
+            self._shader_watcher.stop()
+        for group in self._instance_groups:
+            group.release()
+        for o in self.scene.values():
+            o.release()
+        self._point_light_obj.release()
+        self._light_obj.release()
+        for ubo in self._ubos.values():
+            ubo.release()
+        for view in self.views:
+            view.release()
+        self._shadows.release()
+        self._occlusion.release()
+        self._gbuffer.release()
+        self.post_process.release()
+        glDeleteVertexArrays(1, [self._fullscreen_vao])
+        self.profiler.release()
+        self._overlay.release()
+        if self._context is not None:
+            self._context.release()
+
+    def render_frame(self) -> None:
+        """Advances the clock, simulates steps up to the frame's time, updates and draws one frame into the target
+        framebuffer."""
+        self.clock.tick()
+        for time in self._timestep.advance(self.clock.time()):
+            self._simulate(time)
+        self._time = self._timestep.time()
+        self.profiler.begin_frame()
+        self.view = self.views[0]
+        self._bind_view(self.view)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+
+        # Update scene
+        with self.profiler.stage("load_assets"):
+            self._load_assets()
+        with self.profiler.stage("set_daytime"):
             self._set_daytime()
+        with self.profiler.stage("move_objects"):
             self._move_objects()
-            self._process_camera()
-
-            # Draw scene
+        with self.profiler.stage("process_camera"):
+            for view in self.views:
+                self._process_camera(view)
+        with self.profiler.stage("upload_uniforms"):
+            self._upload_uniform_buffers()
+        with self.profiler.stage("cull_objects"):
+            self._cull_objects(self.view)
+        with self.profiler.stage("occlusion_culling"):
+            self._cull_occluded()
+        with self.profiler.stage("select_lods"):
+            self._select_lods(self.view)
+        with self.profiler.stage("render_shadows"):
+            self._render_shadows()
+
+        # Draw scene
+        with self.profiler.stage("draw_light_sources"):
             self._draw_light_sources()
+        with self.profiler.stage("draw_objects"):
             self._draw_objects()
+        with self.profiler.stage("draw_views"):
+            self._draw_views()
+        with self.profiler.stage("post_process"):
+            self._post_process()
+
+        self.profiler.end_frame()
+        if self.show_overlay:
+            self._overlay.draw(self.profiler.summary_lines, (self._width, self._height))
+
+    def read_pixels(self) -> np.ndarray:
+        """Last headless frame as (height, width, 3) uint8 array."""
+        return self._context.read_pixels()
+
+    def main_loop(self) -> None:
+        while not glfw.window_should_close(self._window):
+            if glfw.get_window_attrib(self._window, glfw.ICONIFIED):
+                glfw.wait_events()  # Nothing to draw, sleep until the window is restored (or other events)
+                continue
+            self._pacer.wait()
+            glfw.poll_events()
+            self.render_frame()
 
             # Swap buffers
             glfw.swap_buffers(self._window)
+            if self._quality is not None:
+                self._quality.update(self.profiler.last_frame_ms())
+                self.post_process.scale = self._resolution.update(self.profiler.last_frame_ms(gpu_only=True))
 
 
 def main():
-    window = Window(1280, 720, "GK Final")
+    window = Window(1280, 720, "GK Final", watch_shaders=True, adaptive_quality=True)
     window.main_loop()
+    window.release()
     glfw.terminate()
 
 
@@ -0,0 +1,55 @@
+class Material:
+    def __init__(self, name: str, vertex_format: str, ambient, diffuse, specular, shininess: float,
+                 texture: str = None):
+        """Material of a mesh part, independent of the loader it came from.
+
+        :param name: Material name from the .mtl file.
+        :param vertex_format: Interleaved vertex format, e.g. "T2F_N3F_V3F".
+        :param ambient: Ambient color (3 floats).
+        :param diffuse: Diffuse color (3 floats).
+        :param specular: Specular color (3 floats).
+        :param shininess: Specular exponent.
+        :param texture: Diffuse texture path or None.
+        """
+        self.name: str = name
+        self.vertex_format: str = vertex_format
+        self.ambient: list = [float(c) for c in ambient[:3]]
+        self.diffuse: list = [float(c) for c in diffuse[:3]]
+        self.specular: list = [float(c) for c in specular[:3]]
+        self.shininess: float = float(shininess)
+        self.texture: str = texture
+
+    # Attribute layout: format name -> (attribute index, number of floats)
+    attr_format = {
+        "T2F": (1, 2),  # Tex coords (2 floats): ind=1
+        "C3F": (2, 3),  # Color (3 floats): ind=2
+        "N3F": (3, 3),  # Normal (3 floats): ind=3
+        "V3F": (0, 3),  # Position (3 floats): ind=0
+    }
+
+    @property
+    def vertex_size(self) -> int:
+        """Number of floats per vertex."""
+        return sum(self.attr_format[attr][1] for attr in self.vertex_format.split("_"))
+
+    @property
+    def position_offset(self) -> int:
+        """Offset of the position (V3F) inside a vertex, in floats."""
+        attrs = self.vertex_format.split("_")
+        return sum(self.attr_format[attr][1] for attr in attrs[:attrs.index("V3F")])
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "vertex_format": self.vertex_format,
+            "ambient": self.ambient,
+            "diffuse": self.diffuse,
+            "specular": self.specular,
+            "shininess": self.shininess,
+            "texture": self.texture,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Material":
+        return cls(d["name"], d["vertex_format"], d["ambient"], d["diffuse"], d["specular"], d["shininess"],
+                   d["texture"])
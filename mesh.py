@@ -0,0 +1,250 @@
+from functools import partial
+
+import numpy as np
+from OpenGL.GL import *
+
+import mesh_cache
+from material import Material
+from mesh_optimizer import build_indexed, build_lods
+from profiler import counters
+from render_queue import RenderQueue
+from resources import SharedResource
+from texture import Texture
+from wavefront import parse_obj
+
+
+class Mesh(SharedResource):
+    # Attribute layout: format name -> (attribute index, number of floats), defined with the vertex format
+    attr_format = Material.attr_format
+    instance_attr = 4  # Per-instance index into the instance matrix buffer texture (see InstanceGroup)
+
+    def __init__(self, key: str, loader=None):
+        """GPU resources of a wavefront file: one VAO, VBO, index buffer and texture per material.
+
+        Use `Mesh.acquire(path)` so every object loaded from the same file shares them.
+
+        :param key: Registry key (normalised path).
+        :param loader: AssetLoader to load the mesh (and its textures) in the background. Until it is
+            uploaded, the mesh is an empty placeholder: `ready` is False and drawing it does nothing.
+        """
+        super().__init__(key)
+        self.ready: bool = False
+        self._released: bool = False
+        self._loader = loader
+        self.vaos = None
+        self._vbos = None
+        self._ebos = None
+        self.index_types = []  # GL_UNSIGNED_SHORT or GL_UNSIGNED_INT for each material
+        self.formats = []
+        self.materials = []
+        self.textures: list = []  # Texture or None for each material
+        self.use_texture = False
+        self.lods = []  # (byte offset, index count) of every level of detail, for each material
+        self.bounds = np.zeros((2, 3), dtype=np.float32)  # Local AABB: min corner, max corner
+        if loader is None:
+            self._upload(self.load_parts(key))
+        else:
+            loader.submit(self.load_parts, self._upload, key, loader)
+
+    @staticmethod
+    def _parse_obj(path: str) -> list:
+        """
+        Parses wavefront obj and materials (see wavefront.py), and converts them into indexed geometry (see
+        mesh_optimizer.py).
+
+        :param path: Path of .obj file.
+        :return: List of (Material, float32 interleaved vertices, indices, levels of detail), one for each material.
+        """
+        materials, libraries = parse_obj(path)
+        parts = []
+        for material, soup in materials:
+            vertices, indices = build_indexed(soup, material.vertex_size)
+            indices, lods = build_lods(vertices, indices, material.vertex_size, material.position_offset)
+            parts.append((material, vertices, indices, lods))
+
+        # Remember .mtl files too, so changing a material invalidates the cache
+        mesh_cache.store(path, libraries, parts)
+        return parts
+
+    @staticmethod
+    def load_parts(path: str, loader=None) -> list:
+        """
+        Loads mesh data from binary cache if possible, parsing wavefront files otherwise. Does not use OpenGL.
+
+        :param path: Path of .obj file.
+        :param loader: AssetLoader, if given parsing runs in one of its processes.
+        :return: Parts as returned by `_parse_obj`.
+        """
+        parts = mesh_cache.load(path)
+        if parts is None:
+            parts = loader.run_in_process(Mesh._parse_obj, path) if loader is not None else Mesh._parse_obj(path)
+        return parts
+
+    def _upload(self, parts: list) -> None:
+        """Uploads loaded mesh data into VAOs and VBOs."""
+        if self._released:
+            return  # Released before loading finished
+
+        # Generate buffers
+        materials_count = len(parts)
+        self.vaos = np.array(glGenVertexArrays(materials_count), dtype=np.uint32).reshape(-1)
+        self._vbos = np.array(glGenBuffers(materials_count), dtype=np.uint32).reshape(-1)
+        self._ebos = np.array(glGenBuffers(materials_count), dtype=np.uint32).reshape(-1)
+
+        # For each material fill buffers and load a texture
+        self.bounds[0], self.bounds[1] = np.inf, -np.inf
+        for vao, vbo, ebo, (material, scene_vertices, indices, lods) in zip(self.vaos, self._vbos, self._ebos,
+                                                                              parts):
+            # Store levels of detail and materials for drawing
+            self.lods.append([(first * indices.itemsize, count) for first, count in lods])
+            self.index_types.append(GL_UNSIGNED_SHORT if indices.dtype == np.uint16 else GL_UNSIGNED_INT)
+            self.formats.append(material.vertex_format)
+            self._extend_bounds(scene_vertices, material)
+            self.materials.append(material)
+            # Textures are shared between meshes too (e.g. crate.jpg between box variants)
+            if material.texture is not None:
+                self.textures.append(Texture.acquire(material.texture, self._loader))
+                self.use_texture = True
+            else:
+                self.textures.append(None)
+
+            # Bind VAO
+            glBindVertexArray(vao)
+            # Fill VBO (cached vertices are memory-mapped, so they are read straight from the file)
+            glBindBuffer(GL_ARRAY_BUFFER, vbo)
+            glBufferData(GL_ARRAY_BUFFER, scene_vertices.nbytes, scene_vertices, GL_STATIC_DRAW)
+            self._set_attributes(material.vertex_format)
+            # Index buffer binding is part of VAO state
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, ebo)
+            glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+
+            # Unbind (Technically not necessary but used as a precaution)
+            glBindVertexArray(0)
+        self.ready = True
+
+    @property
+    def lod_count(self) -> int:
+        return min(len(lods) for lods in self.lods) if self.lods else 1
+
+    @property
+    def bounding_sphere(self) -> tuple:
+        """Local (center, radius) of a sphere enclosing the mesh."""
+        return (self.bounds[0] + self.bounds[1]) / 2, float(np.linalg.norm(self.bounds[1] - self.bounds[0]) / 2)
+
+    def _extend_bounds(self, vertices: np.ndarray, material: Material) -> None:
+        """Grows local AABB to contain positions of given interleaved vertices in a material's vertex format."""
+        offset = material.position_offset
+        positions = np.asarray(vertices).reshape(-1, material.vertex_size)[:, offset:offset + 3]
+        if len(positions):
+            self.bounds[0] = np.minimum(self.bounds[0], positions.min(axis=0))
+            self.bounds[1] = np.maximum(self.bounds[1], positions.max(axis=0))
+
+    def _set_attributes(self, vertex_format: str) -> None:
+        """Sets attribute pointers of currently bound VAO for the VBO bound to GL_ARRAY_BUFFER."""
+        attrs = vertex_format.split("_")
+        for attr in attrs:
+            if attr not in self.attr_format:
+                raise Exception("Unknown format")
+        stride = sum(self.attr_format[attr][1] for attr in attrs) * 4
+
+        cur_off = 0  # current start offset
+        for attr in attrs:
+            attr_ind, attr_size = self.attr_format[attr]
+            glEnableVertexAttribArray(attr_ind)
+            glVertexAttribPointer(attr_ind, attr_size, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(cur_off))
+            cur_off += attr_size * 4
+
+    def create_instanced_vaos(self, instance_vbo: int) -> np.ndarray:
+        """Creates VAOs sharing this mesh's vertex buffers, with a per-instance index attribute.
+
+        :param instance_vbo: Buffer with one uint32 instance index per drawn instance.
+        :return: One VAO per material.
+        """
+        vaos = np.array(glGenVertexArrays(len(self._vbos)), dtype=np.uint32).reshape(-1)
+        for vao, vbo, ebo, vertex_format in zip(vaos, self._vbos, self._ebos, self.formats):
+            glBindVertexArray(vao)
+            glBindBuffer(GL_ARRAY_BUFFER, vbo)
+            self._set_attributes(vertex_format)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, ebo)
+
+            self.set_instance_attributes(instance_vbo)
+            glBindVertexArray(0)
+        return vaos
+
+    def set_instance_attributes(self, instance_vbo: int, first: int = 0) -> None:
+        """
+        Points the instance index attribute of currently bound VAO into an instance buffer.
+
+        :param instance_vbo: Buffer with one uint32 instance index per drawn instance.
+        :param first: Index of the instance used by the first drawn one (GL 3.3 has no base instance in draw calls).
+        """
+        glBindBuffer(GL_ARRAY_BUFFER, instance_vbo)
+        glEnableVertexAttribArray(self.instance_attr)
+        glVertexAttribIPointer(self.instance_attr, 1, GL_UNSIGNED_INT, 4, ctypes.c_void_p(4 * first))
+        glVertexAttribDivisor(self.instance_attr, 1)
+
+    def use_material(self, shader, ind: int) -> None:
+        """Binds texture array (if not bound yet) and uploads material uniforms of material with given index."""
+        tex, mat = self.textures[ind], self.materials[ind]
+        if tex is not None and tex.array is not None:
+            tex.array.bind()
+            shader.set_int("textureLayer", tex.layer)
+        shader.set_v3("material.ambient", mat.ambient)
+        shader.set_v3("material.diffuse", mat.diffuse)
+        shader.set_v3("material.specular", mat.specular)
+        shader.set_float("material.shininess", mat.shininess)
+
+    def texture_key(self, ind: int) -> int:
+        """Id of the texture array sampled by material with given index, for sorting draws (0 if none)."""
+        tex = self.textures[ind]
+        return tex.array.id if tex is not None and tex.array is not None else 0
+
+    def material_shader(self, shader, ind: int):
+        """Variant of a shader for material with given index: sampling a texture only if it has a loaded one."""
+        return shader.variant(TEXTURED=bool(self.texture_key(ind)))
+
+    def enqueue(self, render_queue: RenderQueue, shader, model, lod: int = 0, prepare=None,
+                normal_matrix=None) -> None:
+        """
+        Queues draws of every material of the mesh with given model matrix and level of detail.
+
+        :param prepare: Called before each draw to set other per-draw uniforms.
+        :param normal_matrix: 3x3 normal matrix for shaders that light the mesh (see `LoadedObject.normal_matrix`).
+        """
+        if not self.ready:
+            return
+        for ind, vao in enumerate(self.vaos):
+            material_shader = self.material_shader(shader, ind)
+            render_queue.add(material_shader, self.texture_key(ind), int(vao), (id(self), ind),
+                             partial(self.use_material, material_shader, ind),
+                             partial(self._draw_part, material_shader, ind, model, lod, prepare, normal_matrix))
+        counters.instances += 1
+
+    def _draw_part(self, shader, ind: int, model, lod: int, prepare=None, normal_matrix=None) -> None:
+        """Draws material with given index, its VAO and material must be bound already."""
+        offset, count = self.lods[ind][lod]
+        if prepare is not None:
+            prepare()
+        shader.set_model(model)
+        if normal_matrix is not None:
+            shader.set_m3("normalMatrix", normal_matrix)
+        glDrawElements(GL_TRIANGLES, count, self.index_types[ind], ctypes.c_void_p(offset))
+        counters.draw_calls += 1
+
+    def draw(self, shader, model, lod: int = 0, normal_matrix=None) -> None:
+        """Draws every material of the mesh with given model matrix and level of detail."""
+        render_queue = RenderQueue()
+        self.enqueue(render_queue, shader, model, lod, normal_matrix=normal_matrix)
+        render_queue.submit()
+
+    def _delete(self) -> None:
+        self._released = True
+        for tex in self.textures:
+            if tex is not None:
+                tex.release()
+        if not self.ready:
+            return
+        glDeleteVertexArrays(len(self.vaos), self.vaos)
+        glDeleteBuffers(len(self._vbos), self._vbos)
+        glDeleteBuffers(len(self._ebos), self._ebos)
+        self.vaos, self._vbos, self._ebos, self.textures = None, None, None, []
@@ -0,0 +1,178 @@
+"""On-disk cache of parsed meshes.
+
+A cache file holds everything needed to upload a mesh without parsing text OBJ/MTL files:
+
+    magic (8 bytes) | header length (uint32 LE) | JSON header | padding | vertex blobs
+
+The header lists the source files (with mtime, size and SHA-1 used for invalidation) and,
+for every material, its parameters, texture path and the offsets and lengths of its
+interleaved float32 vertex blob and its index blob (uint16 or uint32, all levels of detail
+one after another, see "lods"). Blobs are aligned to
+`ALIGNMENT` bytes and loaded with `np.memmap`, so they go straight from the page cache into
+`glBufferData`.
+"""
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from material import Material
+
+CACHE_DIR = os.path.join(".cache", "meshes")
+MAGIC = b"GKMESH03"
+ALIGNMENT = 64
+
+
+def cache_path(path: str) -> str:
+    """Cache file path for given source file."""
+    abs_path = os.path.abspath(path)
+    digest = hashlib.sha1(abs_path.encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"{os.path.basename(path)}-{digest}.mesh")
+
+
+def _file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def source_info(path: str) -> dict:
+    st = os.stat(path)
+    return {"path": os.path.abspath(path), "mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha1": _file_hash(path)}
+
+
+def is_fresh(source: dict) -> bool:
+    """Checks if cached source file is unchanged. Falls back to hash when only mtime differs, and records the new
+    mtime if the hash matches, so the caller can write it back (see `rewrite_header`) and later checks skip hashing."""
+    try:
+        st = os.stat(source["path"])
+    except OSError:
+        return False
+    if st.st_size != source["size"]:
+        return False
+    if st.st_mtime_ns == source["mtime_ns"]:
+        return True
+    if _file_hash(source["path"]) != source["sha1"]:
+        return False
+    source["mtime_ns"] = st.st_mtime_ns
+    return True
+
+
+def rewrite_header(file: str, magic: bytes, header: dict, data_start: int) -> None:
+    """
+    Rewrites the header of a cache file in place, blobs stay where they are. Failures are ignored, the header is
+    then only refreshed again on the next load.
+
+    :param file: Cache file path.
+    :param magic: Magic bytes of the file format.
+    :param header: Header to write.
+    :param data_start: Offset of the first blob, the header must end before it.
+    """
+    header_bytes = json.dumps(header).encode()
+    if len(magic) + 4 + len(header_bytes) > data_start:
+        return
+    try:
+        with open(file, "r+b") as f:
+            f.write(magic)
+            f.write(struct.pack("<I", len(header_bytes)))
+            f.write(header_bytes)
+    except OSError:
+        pass
+
+
+def _read_header(f) -> dict:
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a mesh cache file")
+    (header_len,) = struct.unpack("<I", f.read(4))
+    return json.loads(f.read(header_len).decode())
+
+
+def load(path: str):
+    """
+    Loads cached mesh for given source file.
+
+    :param path: Source .obj path.
+    :return: List of (Material, memory-mapped float32 vertices, memory-mapped indices, levels of detail) or None
+        if there is no valid cache. Levels of detail are (first index, index count) pairs.
+    """
+    file = cache_path(path)
+    try:
+        with open(file, "rb") as f:
+            header = _read_header(f)
+        mtimes = [source["mtime_ns"] for source in header["sources"]]
+        if not all(is_fresh(source) for source in header["sources"]):
+            return None
+        if header["materials"] and mtimes != [source["mtime_ns"] for source in header["sources"]]:
+            rewrite_header(file, MAGIC, header, min(entry["offset"] for entry in header["materials"]))
+
+        base_dir = os.path.dirname(path)
+        parts = []
+        for entry in header["materials"]:
+            material = Material.from_dict(entry)
+            if material.texture is not None:
+                material.texture = os.path.join(base_dir, material.texture)
+            vertices = np.memmap(file, dtype=np.float32, mode="r", offset=entry["offset"], shape=(entry["count"],))
+            indices = np.memmap(file, dtype=np.dtype(entry["index_dtype"]), mode="r", offset=entry["index_offset"],
+                                shape=(entry["index_count"],))
+            parts.append((material, vertices, indices, [tuple(lod) for lod in entry["lods"]]))
+        return parts
+    except (OSError, ValueError, KeyError, TypeError, struct.error):
+        return None
+
+
+def store(path: str, dependencies: list, parts: list) -> None:
+    """
+    Writes mesh cache for given source file. Failures are ignored, the cache is only an optimisation.
+
+    :param path: Source .obj path.
+    :param dependencies: Other files the mesh was built from (e.g. .mtl libraries).
+    :param parts: List of (Material, float32 vertices, indices, levels of detail).
+    """
+    base_dir = os.path.dirname(path)
+    try:
+        header = {"sources": [source_info(p) for p in [path, *dependencies]], "materials": []}
+    except OSError:
+        return
+
+    # Header length affects blob offsets, so lay the blobs out relative to the data start first.
+    entries, offset = [], 0
+    for material, vertices, indices, lods in parts:
+        entry = material.to_dict()
+        if material.texture is not None:
+            entry["texture"] = os.path.relpath(material.texture, base_dir)
+        entry["offset"], entry["count"] = offset, len(vertices)
+        offset += -(-vertices.nbytes // ALIGNMENT) * ALIGNMENT
+        entry["index_offset"], entry["index_count"] = offset, len(indices)
+        entry["index_dtype"] = np.dtype(indices.dtype).str
+        entry["lods"] = [list(lod) for lod in lods]
+        offset += -(-indices.nbytes // ALIGNMENT) * ALIGNMENT
+        entries.append(entry)
+
+    # Reserve room for offsets growing by a few digits when they are shifted by the data start.
+    probe = dict(header, materials=entries)
+    data_start = -(-(len(MAGIC) + 4 + len(json.dumps(probe)) + 32 * len(entries)) // ALIGNMENT) * ALIGNMENT
+    for entry in entries:
+        entry["offset"] += data_start
+        entry["index_offset"] += data_start
+    header["materials"] = entries
+    header_bytes = json.dumps(header).encode()
+    assert len(MAGIC) + 4 + len(header_bytes) <= data_start
+
+    file = cache_path(path)
+    tmp = f"{file}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<I", len(header_bytes)))
+            f.write(header_bytes)
+            for entry, (_, vertices, indices, _) in zip(entries, parts):
+                f.write(b"\0" * (entry["offset"] - f.tell()))
+                f.write(np.ascontiguousarray(vertices, dtype=np.float32).tobytes())
+                f.write(b"\0" * (entry["index_offset"] - f.tell()))
+                f.write(np.ascontiguousarray(indices).tobytes())
+        os.replace(tmp, file)  # Atomic, readers never see a half written file
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
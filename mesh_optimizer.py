@@ -0,0 +1,281 @@
+"""Conversion of triangle soups into indexed geometry and simplified levels of detail.
+
+Runs once when a mesh is parsed, results are stored in the mesh cache.
+"""
+import heapq
+
+import numpy as np
+
+# Simulated post-transform vertex cache, see `optimize_vertex_cache`
+CACHE_SIZE = 32
+_CACHE_DECAY_POWER = 1.5
+_LAST_TRIANGLE_SCORE = 0.75
+_VALENCE_BOOST_SCALE = 2.0
+_VALENCE_BOOST_POWER = 0.5
+# Triangle count of every level of detail, relative to full detail
+LOD_RATIOS = (1.0, 0.5, 0.2, 0.06)
+
+
+def deduplicate(vertices: np.ndarray, vertex_size: int):
+    """
+    Merges identical interleaved vertices.
+
+    :param vertices: Float32 triangle soup, `vertex_size` floats per vertex.
+    :param vertex_size: Number of floats per vertex.
+    :return: (unique vertices, uint32 indices into them), three indices per triangle.
+    """
+    rows = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, vertex_size)
+    # Compare rows as raw bytes, one void scalar per vertex is much faster than np.unique(axis=0)
+    keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * vertex_size))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    return rows[first], inverse.astype(np.uint32).ravel()
+
+
+def _vertex_score(cache_pos: int, remaining: int) -> float:
+    if remaining == 0:
+        return -1.0
+    score = 0.0
+    if cache_pos >= 0:
+        if cache_pos < 3:
+            score = _LAST_TRIANGLE_SCORE  # Vertices of the last triangle, equal so no direction is preferred
+        else:
+            score = (1.0 - (cache_pos - 3) / (CACHE_SIZE - 3)) ** _CACHE_DECAY_POWER
+    return score + _VALENCE_BOOST_SCALE * remaining ** -_VALENCE_BOOST_POWER
+
+
+def optimize_vertex_cache(indices: np.ndarray, vertex_count: int) -> np.ndarray:
+    """
+    Reorders triangles for post-transform vertex cache hits (Tom Forsyth's linear-speed algorithm).
+
+    Greedily emits the triangle with the best score, where vertices score higher the more recently
+    they were used (simulated LRU cache) and the fewer unemitted triangles they have left.
+
+    :param indices: Triangle indices, three per triangle.
+    :param vertex_count: Number of vertices the indices refer to.
+    :return: Reordered indices.
+    """
+    triangles = np.asarray(indices).reshape(-1, 3)
+    tri_count = len(triangles)
+    if tri_count == 0:
+        return np.asarray(indices)
+
+    # Triangles using every vertex
+    vertex_tris = [[] for _ in range(vertex_count)]
+    for t, tri in enumerate(triangles.tolist()):
+        for v in tri:
+            vertex_tris[v].append(t)
+    remaining = [len(tris) for tris in vertex_tris]
+    cache_pos = [-1] * vertex_count
+    vertex_score = [_vertex_score(-1, r) for r in remaining]
+    tri_vertices = triangles.tolist()
+    tri_score = [sum(vertex_score[v] for v in tri) for tri in tri_vertices]
+    emitted = [False] * tri_count
+
+    order = []
+    cache = []
+    best = max(range(tri_count), key=tri_score.__getitem__)
+    next_unemitted = 0
+    while best != -1:
+        order.append(best)
+        emitted[best] = True
+        for v in tri_vertices[best]:
+            vertex_tris[v].remove(best)
+            remaining[v] -= 1
+
+        # Move triangle's vertices to the front of the cache, the overflow falls out
+        tri = tri_vertices[best]
+        cache = tri + [v for v in cache if v not in tri]
+        evicted = cache[CACHE_SIZE:]
+        cache = cache[:CACHE_SIZE]
+        for v in evicted:
+            cache_pos[v] = -1
+        for pos, v in enumerate(cache):
+            cache_pos[v] = pos
+
+        # Rescore vertices whose position or valence changed, and their triangles
+        touched = set()
+        for v in cache + evicted:
+            vertex_score[v] = _vertex_score(cache_pos[v], remaining[v])
+            touched.update(vertex_tris[v])
+        best, best_score = -1, -1.0
+        for t in touched:
+            tri_score[t] = sum(vertex_score[v] for v in tri_vertices[t])
+            if tri_score[t] > best_score:
+                best, best_score = t, tri_score[t]
+
+        if best == -1:
+            # Nothing in the cache has triangles left, continue with any unemitted triangle
+            while next_unemitted < tri_count and emitted[next_unemitted]:
+                next_unemitted += 1
+            if next_unemitted < tri_count:
+                best = next_unemitted
+
+    return triangles[order].ravel()
+
+
+def reorder_vertices(vertices: np.ndarray, indices: np.ndarray):
+    """
+    Renumbers vertices in order of first use, so vertex fetches follow the index buffer.
+
+    :return: (reordered vertices, remapped indices).
+    """
+    _, first_use = np.unique(indices, return_index=True)
+    used = indices[np.sort(first_use)]
+    remap = np.zeros(len(vertices), dtype=np.uint32)
+    remap[used] = np.arange(len(used), dtype=np.uint32)
+    return vertices[used], remap[indices]
+
+
+def build_indexed(vertices: np.ndarray, vertex_size: int):
+    """
+    Converts a triangle soup into deduplicated, cache optimised indexed geometry.
+
+    :param vertices: Float32 triangle soup, `vertex_size` floats per vertex.
+    :param vertex_size: Number of floats per vertex.
+    :return: (flat float32 vertices, uint16 or uint32 indices).
+    """
+    unique, indices = deduplicate(vertices, vertex_size)
+    indices = optimize_vertex_cache(indices, len(unique))
+    unique, indices = reorder_vertices(unique, indices)
+    index_type = np.uint16 if len(unique) <= np.iinfo(np.uint16).max + 1 else np.uint32
+    return unique.ravel(), indices.astype(index_type)
+
+
+def average_cache_miss_ratio(indices: np.ndarray, cache_size: int = CACHE_SIZE) -> float:
+    """Vertex shader invocations per triangle with a FIFO post-transform cache (ACMR, 3.0 is worst)."""
+    cache, misses = [], 0
+    for v in np.asarray(indices).tolist():
+        if v not in cache:
+            misses += 1
+            cache.append(v)
+            if len(cache) > cache_size:
+                cache.pop(0)
+    return misses / max(len(indices) // 3, 1)
+
+
+def _locked_vertices(positions: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    """Vertices simplification must keep: attribute seams (several vertices at one position) and open borders."""
+    _, position_ids, counts = np.unique(positions, axis=0, return_inverse=True, return_counts=True)
+    locked = counts[position_ids.ravel()] > 1
+
+    edges = np.sort(np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]]), axis=1)
+    unique_edges, edge_counts = np.unique(edges, axis=0, return_counts=True)
+    locked[unique_edges[edge_counts == 1].ravel()] = True
+    return locked
+
+
+def simplify(positions: np.ndarray, indices: np.ndarray, target_triangles: int) -> np.ndarray:
+    """
+    Reduces triangle count with quadric error metric edge collapses.
+
+    Collapses move a vertex onto one of its neighbours (half-edge collapse), so simplified levels
+    reuse the original vertex buffer and only need their own indices. Attribute seams and borders
+    are locked, collapses flipping a triangle are rejected.
+
+    :param positions: (n, 3) vertex positions.
+    :param indices: Triangle indices, three per triangle.
+    :param target_triangles: Stop once the mesh has this many triangles (or nothing can collapse).
+    :return: Indices of the simplified mesh.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    triangles = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    if len(triangles) <= target_triangles:
+        return np.asarray(indices)
+    locked = _locked_vertices(positions, triangles)
+
+    # Per-vertex error quadrics: sum of area weighted squared distances to adjacent triangle planes
+    p0, p1, p2 = positions[triangles[:, 0]], positions[triangles[:, 1]], positions[triangles[:, 2]]
+    normals = np.cross(p1 - p0, p2 - p0)
+    areas = np.linalg.norm(normals, axis=1)
+    normals = normals / np.maximum(areas, 1e-12)[:, None]
+    planes = np.concatenate([normals, -np.einsum("ij,ij->i", normals, p0)[:, None]], axis=1)
+    plane_quadrics = areas[:, None, None] * planes[:, :, None] * planes[:, None, :]
+    quadrics = np.zeros((len(positions), 4, 4))
+    for corner in range(3):
+        np.add.at(quadrics, triangles[:, corner], plane_quadrics)
+    homogeneous = np.concatenate([positions, np.ones((len(positions), 1))], axis=1)
+
+    tris = triangles.tolist()
+    vertex_tris = [set() for _ in range(len(positions))]
+    for t, tri in enumerate(tris):
+        for v in tri:
+            vertex_tris[v].add(t)
+    version = [0] * len(positions)
+    heap = []
+
+    def neighbours(v):
+        return {u for t in vertex_tris[v] for u in tris[t]} - {v}
+
+    def push_collapses(a):
+        version[a] += 1
+        if locked[a]:
+            return
+        for b in neighbours(a):
+            q = quadrics[a] + quadrics[b]
+            heapq.heappush(heap, (float(homogeneous[b] @ q @ homogeneous[b]), a, b, version[a]))
+
+    def flips(a, b) -> bool:
+        """Checks if moving a onto b flips or degenerates a triangle that stays."""
+        for t in vertex_tris[a]:
+            tri = tris[t]
+            if b in tri:
+                continue
+            corners = positions[tri]
+            old = np.cross(corners[1] - corners[0], corners[2] - corners[0])
+            corners[tri.index(a)] = positions[b]
+            new = np.cross(corners[1] - corners[0], corners[2] - corners[0])
+            if np.dot(old, new) <= 0.2 * np.linalg.norm(old) * np.linalg.norm(new):
+                return True
+        return False
+
+    for v in range(len(positions)):
+        push_collapses(v)
+
+    alive = len(tris)
+    while alive > target_triangles and heap:
+        _, a, b, ver = heapq.heappop(heap)
+        if ver != version[a] or not vertex_tris[a] or b not in neighbours(a) or flips(a, b):
+            continue
+        for t in list(vertex_tris[a]):
+            tri = tris[t]
+            if b in tri:  # Triangle on the collapsed edge disappears
+                for v in tri:
+                    vertex_tris[v].discard(t)
+                tris[t] = None
+                alive -= 1
+            else:
+                tri[tri.index(a)] = b
+                vertex_tris[b].add(t)
+        vertex_tris[a].clear()
+        quadrics[b] += quadrics[a]
+        for v in neighbours(b) | {b}:
+            push_collapses(v)
+
+    dtype = np.asarray(indices).dtype
+    return np.array([tri for tri in tris if tri is not None], dtype=dtype).ravel()
+
+
+def build_lods(vertices: np.ndarray, indices: np.ndarray, vertex_size: int, position_offset: int,
+               ratios: tuple = LOD_RATIOS):
+    """
+    Generates simplified levels of detail sharing one vertex buffer.
+
+    :param vertices: Flat float32 vertices.
+    :param indices: Full detail indices.
+    :param vertex_size: Number of floats per vertex.
+    :param position_offset: Offset of the position inside a vertex, in floats.
+    :param ratios: Target triangle count of every level, relative to full detail.
+    :return: (indices of all levels concatenated, [(first index, index count)] for each level).
+    """
+    positions = np.asarray(vertices).reshape(-1, vertex_size)[:, position_offset:position_offset + 3]
+    triangle_count = len(indices) // 3
+    levels, level = [], np.asarray(indices)
+    for ratio in ratios:
+        # Every level starts from the previous one, which is both faster and keeps levels consistent
+        level = simplify(positions, level, int(triangle_count * ratio))
+        if len(levels):
+            level = optimize_vertex_cache(level, len(positions))
+        levels.append(level)
+
+    firsts = np.cumsum([0] + [len(level) for level in levels[:-1]])
+    return np.concatenate(levels), [(int(first), len(level)) for first, level in zip(firsts, levels)]
@@ -0,0 +1,121 @@
+import numpy as np
+from OpenGL.GL import *
+
+from profiler import counters
+from shader import Shader
+
+
+class OcclusionCuller:
+    # Objects with a bounding sphere at least this large (world units) are drawn into the occluder depth pre-pass
+    occluder_radius: float = 1.0
+    # Boxes are tested slightly enlarged, so flat objects and faces lying on an occluder's surface are not hidden
+    margin: float = 0.05
+
+    def __init__(self, count: int, width: int, height: int, shader: Shader):
+        """Hides objects behind large occluders with hardware occlusion queries.
+
+        Every frame, large objects in the view frustum are drawn into a depth-only framebuffer, then the bounding
+        box of every object in the frustum is drawn against it inside a GL_ANY_SAMPLES_PASSED query. Results are
+        read a frame later (or whenever they arrive), so testing never stalls the pipeline. Objects stay
+        visible until a query says otherwise; one that appears from behind an occluder is drawn a frame late.
+
+        :param count: Number of objects.
+        :param width: Width of the target framebuffer in pixels.
+        :param height: Height of the target framebuffer in pixels.
+        :param shader: Bounding box shader (occlusion_box_vs.glsl).
+        """
+        self._shader = shader
+        self._queries = np.array(glGenQueries(count), dtype=np.uint32).reshape(count)
+        self._pending = np.zeros(count, dtype=bool)  # Query in flight, per object
+        self._occluded = np.zeros(count, dtype=bool)  # Last query result, per object
+        self._vao = glGenVertexArrays(1)  # Empty, box is generated in shader
+        self.width, self.height = width, height
+        self.fbo = glGenFramebuffers(1)
+        self._depth = glGenRenderbuffers(1)
+        self._allocate()
+
+    def _allocate(self) -> None:
+        glBindRenderbuffer(GL_RENDERBUFFER, self._depth)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, self.width, self.height)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, self._depth)
+        glDrawBuffer(GL_NONE)
+        glReadBuffer(GL_NONE)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise Exception("Occlusion framebuffer is incomplete!")
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def resize(self, width: int, height: int) -> None:
+        self.width, self.height = width, height
+        self._allocate()
+
+    @property
+    def occluded_count(self) -> int:
+        return int(self._occluded.sum())
+
+    def _collect(self) -> None:
+        """Reads results of queries that completed since the last frame."""
+        for ind in np.flatnonzero(self._pending):
+            if glGetQueryObjectuiv(self._queries[ind], GL_QUERY_RESULT_AVAILABLE):
+                self._occluded[ind] = not glGetQueryObjectuiv(self._queries[ind], GL_QUERY_RESULT)
+                self._pending[ind] = False
+
+    def cull(self, candidates: np.ndarray, lo: np.ndarray, hi: np.ndarray, eye, draw_occluders) -> np.ndarray:
+        """
+        Filters objects hidden behind occluders, as of the latest query results, and issues new queries.
+
+        Needs the Matrices uniform buffer of the current frame. Leaves the occlusion framebuffer bound.
+
+        :param candidates: Boolean mask of objects to test, e.g. those in the view frustum.
+        :param lo: (n, 3) world AABB min corners of all objects.
+        :param hi: (n, 3) world AABB max corners of all objects.
+        :param eye: Camera position, boxes containing it are always visible.
+        :param draw_occluders: Callable drawing depth of objects in a given mask with the current camera.
+        :return: Boolean mask of candidates that are not known to be occluded.
+        """
+        self._collect()
+        self._occluded[~candidates] = False  # Results of objects that left the view are stale
+        lo, hi = lo - self.margin, hi + self.margin
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glViewport(0, 0, self.width, self.height)
+        glClear(GL_DEPTH_BUFFER_BIT)
+        occluders = candidates & (np.linalg.norm(hi - lo, axis=1) / 2 >= self.occluder_radius)
+        if occluders.any():
+            draw_occluders(occluders)
+
+        eye = np.asarray(eye)
+        inside = ((lo <= eye) & (eye <= hi)).all(axis=1)
+        self._occluded[inside] = False
+        tested = np.flatnonzero(candidates & ~inside & ~self._pending)
+        if len(tested):
+            self._shader.use()
+            glBindVertexArray(self._vao)
+            glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
+            glDepthMask(GL_FALSE)
+            glDepthFunc(GL_LEQUAL)
+            for ind in tested:
+                self._shader.set_v3("boxMin", lo[ind])
+                self._shader.set_v3("boxMax", hi[ind])
+                glBeginQuery(GL_ANY_SAMPLES_PASSED, self._queries[ind])
+                glDrawArrays(GL_TRIANGLE_STRIP, 0, 14)
+                glEndQuery(GL_ANY_SAMPLES_PASSED)
+            glDepthFunc(GL_LESS)
+            glDepthMask(GL_TRUE)
+            glColorMask(GL_TRUE, GL_TRUE, GL_TRUE, GL_TRUE)
+            counters.draw_calls += len(tested)
+            counters.state_changes += 1  # VAO bind
+            self._pending[tested] = True
+        return candidates & ~self._occluded
+
+    def reset(self) -> None:
+        """Forgets query results, e.g. when culling is turned off. Queries in flight are read and dropped."""
+        self._collect()
+        self._occluded[:] = False
+
+    def release(self) -> None:
+        glDeleteQueries(len(self._queries), self._queries)
+        glDeleteVertexArrays(1, [self._vao])
+        glDeleteFramebuffers(1, [self.fbo])
+        glDeleteRenderbuffers(1, [self._depth])
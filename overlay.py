@@ -0,0 +1,72 @@
+import numpy as np
+from OpenGL.GL import *
+from PIL import Image, ImageDraw, ImageFont
+
+from profiler import counters
+from shader import Shader
+
+
+class TextOverlay:
+    # Text image is only re-rendered every this many frames, rasterizing it is slow
+    refresh_frames: int = 30
+
+    def __init__(self, shader: Shader):
+        """Lines of text drawn over the top left corner of the screen.
+
+        :param shader: Overlay shader (overlay_vs.glsl and overlay_fs.glsl).
+        """
+        self._shader = shader
+        try:
+            self._font = ImageFont.truetype("DejaVuSansMono.ttf", 11)  # Monospace keeps columns aligned
+        except OSError:
+            self._font = ImageFont.load_default()
+        self._texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self._texture)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        self._vao = glGenVertexArrays(1)  # Empty, quad is generated in shader
+        self._size = (0, 0)
+        self._frames = 0
+
+    def _render_text(self, lines: list) -> None:
+        """Rasterizes text, white on translucent black, and uploads it into the texture."""
+        line_height = 12
+        width = max(int(self._font.getlength(line)) for line in lines) + 8
+        height = line_height * len(lines) + 8
+        image = Image.new("RGBA", (width, height), (0, 0, 0, 160))
+        draw = ImageDraw.Draw(image)
+        for ind, line in enumerate(lines):
+            draw.text((4, 4 + ind * line_height), line, font=self._font, fill=(255, 255, 255, 255))
+
+        glBindTexture(GL_TEXTURE_2D, self._texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE,
+                     np.asarray(image).tobytes())
+        glBindTexture(GL_TEXTURE_2D, 0)
+        self._size = (width, height)
+
+    def draw(self, lines_source, viewport: tuple) -> None:
+        """
+        Draws the overlay, pixel for pixel.
+
+        :param lines_source: Callable returning lines of text, called only when the text is refreshed.
+        :param viewport: (width, height) of the target framebuffer.
+        """
+        if self._frames % self.refresh_frames == 0:
+            self._render_text(lines_source())
+        self._frames += 1
+
+        width, height = viewport
+        x1, y0 = -1 + 2 * self._size[0] / width, 1 - 2 * self._size[1] / height
+        self._shader.use()
+        self._shader.set_v4("rect", [-1.0, y0, x1, 1.0])
+        glDisable(GL_DEPTH_TEST)
+        glBindTexture(GL_TEXTURE_2D, self._texture)
+        glBindVertexArray(self._vao)
+        glDrawArrays(GL_TRIANGLE_STRIP, 0, 4)
+        glEnable(GL_DEPTH_TEST)
+        counters.draw_calls += 1
+
+    def release(self) -> None:
+        glDeleteTextures([self._texture])
+        glDeleteVertexArrays(1, [self._vao])
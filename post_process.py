@@ -0,0 +1,120 @@
+from OpenGL.GL import *
+
+from profiler import counters
+from shader import Shader
+
+
+class PostProcess:
+    # Passes in the order they run, each reads the previous one's output
+    pass_order = ("fog", "tonemap", "fxaa")
+    # Lowest and highest resolution scale
+    min_scale: float = 0.25
+    max_scale: float = 1.0
+
+    def __init__(self, width: int, height: int, shaders: dict):
+        """Offscreen HDR scene target at a scaled resolution, and a chain of full screen passes bringing it to the
+        output framebuffer at window size.
+
+        Textures are allocated at window size and the scene is drawn into their bottom left corner, so changing the
+        scale never reallocates them. Passes before the last one run at the scaled resolution, the last pass writes
+        the output and upscales with bilinear filtering as it samples, so no separate upscale pass is needed.
+
+        :param width: Output width in pixels.
+        :param height: Output height in pixels.
+        :param shaders: Pass name -> Shader for every name in `pass_order` (post_*_fs.glsl with post_vs.glsl),
+            and "copy", used when every pass is off.
+        """
+        self.shaders = shaders
+        self.enabled = {"fog": False, "tonemap": True, "fxaa": True}  # Pass name -> whether it runs
+        self.exposure: float = 1.0  # Scene color multiplier before tonemapping
+        self.depth_range: tuple = (0.1, 100.0)  # Near and far plane of the camera, for fog
+        self._scale: float = 1.0
+        self.width, self.height = width, height
+        self.fbo = glGenFramebuffers(1)  # Scene target
+        self.color, self.depth = glGenTextures(2)
+        self._pass_fbos = glGenFramebuffers(2)  # Ping-pong targets of intermediate passes
+        self._pass_textures = glGenTextures(2)
+        self._vao = glGenVertexArrays(1)  # Empty, full screen triangle is generated in shader
+        self._allocate()
+
+    def _allocate(self) -> None:
+        self._texture(self.depth, GL_DEPTH_COMPONENT24, GL_DEPTH_COMPONENT, GL_NEAREST)
+        for fbo, texture in zip([self.fbo, *self._pass_fbos], [self.color, *self._pass_textures]):
+            self._texture(texture, GL_RGBA16F, GL_RGBA, GL_LINEAR)
+            glBindFramebuffer(GL_FRAMEBUFFER, fbo)
+            glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, texture, 0)
+            if fbo == self.fbo:
+                glFramebufferTexture2D(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_TEXTURE_2D, self.depth, 0)
+            if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+                raise Exception("Post process framebuffer is incomplete!")
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def _texture(self, texture: int, internal_format: int, data_format: int, texture_filter: int) -> None:
+        glBindTexture(GL_TEXTURE_2D, texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, internal_format, self.width, self.height, 0, data_format, GL_FLOAT, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, texture_filter)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, texture_filter)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def resize(self, width: int, height: int) -> None:
+        self.width, self.height = width, height
+        self._allocate()
+
+    @property
+    def scale(self) -> float:
+        """Scene resolution relative to the output, along each axis."""
+        return self._scale
+
+    @scale.setter
+    def scale(self, scale: float) -> None:
+        self._scale = min(max(scale, self.min_scale), self.max_scale)
+
+    @property
+    def render_size(self) -> tuple:
+        """(width, height) in pixels the scene is drawn at."""
+        return max(round(self.width * self._scale), 1), max(round(self.height * self._scale), 1)
+
+    def run(self, output_fbo: int) -> None:
+        """Runs enabled passes over the scene target, the last one into given framebuffer. Leaves it bound with
+        a viewport covering it."""
+        passes = [name for name in self.pass_order if self.enabled[name]] or ["copy"]
+        width, height = self.render_size
+        uv_scale = (width / self.width, height / self.height)
+        uv_max = ((width - 0.5) / self.width, (height - 0.5) / self.height)
+
+        glDisable(GL_DEPTH_TEST)
+        glDisable(GL_BLEND)
+        glBindVertexArray(self._vao)
+        glActiveTexture(GL_TEXTURE0 + Shader.sampler_units["postDepth"])
+        glBindTexture(GL_TEXTURE_2D, self.depth)
+        source = self.color
+        for ind, name in enumerate(passes):
+            if ind == len(passes) - 1:
+                glBindFramebuffer(GL_FRAMEBUFFER, output_fbo)
+                glViewport(0, 0, self.width, self.height)
+            else:
+                glBindFramebuffer(GL_FRAMEBUFFER, self._pass_fbos[ind % 2])
+                glViewport(0, 0, width, height)
+            glActiveTexture(GL_TEXTURE0 + Shader.sampler_units["postImage"])
+            glBindTexture(GL_TEXTURE_2D, source)
+            shader = self.shaders[name]
+            shader.use()
+            shader.set_v2("uvScale", uv_scale)
+            shader.set_v2("uvMax", uv_max)
+            shader.set_v2("texelSize", (1 / self.width, 1 / self.height))
+            shader.set_v2("depthRange", self.depth_range)
+            shader.set_float("exposure", self.exposure)
+            glDrawArrays(GL_TRIANGLES, 0, 3)
+            source = self._pass_textures[ind % 2]
+        glActiveTexture(GL_TEXTURE0)
+        glEnable(GL_DEPTH_TEST)
+        glEnable(GL_BLEND)
+        counters.draw_calls += len(passes)
+        counters.state_changes += 2 * len(passes) + 1  # Framebuffer and texture binds, VAO bind
+
+    def release(self) -> None:
+        glDeleteFramebuffers(3, [self.fbo, *self._pass_fbos])
+        glDeleteTextures([self.color, self.depth, *self._pass_textures])
+        glDeleteVertexArrays(1, [self._vao])
@@ -0,0 +1,182 @@
+import csv
+import ctypes
+import json
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+from OpenGL.GL import *
+# The wrapped version cannot allocate its uint64 output array
+from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v as glGetQueryObjectui64v_raw
+
+
+class FrameCounters:
+    def __init__(self):
+        """Counts GL work issued during a frame. Reset by Profiler at the start of every frame."""
+        self.draw_calls: int = 0
+        self.instances: int = 0  # Objects drawn, counting every instance of instanced draws
+        self.state_changes: int = 0  # Program, VAO and texture binds
+        self.uniform_uploads: int = 0  # glUniform* calls issued through Shader
+
+    def reset(self) -> None:
+        self.draw_calls = 0
+        self.instances = 0
+        self.state_changes = 0
+        self.uniform_uploads = 0
+
+    def as_dict(self) -> dict:
+        return {"draw_calls": self.draw_calls, "instances": self.instances, "state_changes": self.state_changes,
+                "uniform_uploads": self.uniform_uploads}
+
+
+counters = FrameCounters()
+
+
+class Profiler:
+    # Frames a GL_TIME_ELAPSED result may take to arrive. Older queries are only read once available,
+    # so collecting them never stalls the pipeline.
+    latency: int = 3
+
+    def __init__(self, stages: list, history: int = 120, trace_length: int = 3600):
+        """Per-stage CPU (perf counter) and GPU (timer query) frame timing.
+
+        Every frame is recorded as {"frame", "cpu_ms": {stage: ms}, "gpu_ms": {stage: ms}, **counters}.
+        GPU times are filled in a few frames later, when their queries complete.
+
+        :param stages: Stage names, in the order they run.
+        :param history: Number of frames rolling stats are computed over.
+        :param trace_length: Number of most recent frames kept for `dump`.
+        """
+        self.stages = list(stages)
+        self.enabled: bool = True
+        self.frame: int = 0
+        self.trace = deque(maxlen=trace_length)
+        self.history: int = history
+        self._queries = np.array(glGenQueries(self.latency * len(self.stages)), dtype=np.uint32) \
+            .reshape(self.latency, len(self.stages))
+        self._pending = [None] * self.latency  # Frame record waiting for query results, per query set
+        self._issued = [set() for _ in range(self.latency)]  # Stages with a query in flight, per query set
+        self._record = None
+
+    def begin_frame(self) -> None:
+        counters.reset()
+        if not self.enabled:
+            return
+        slot = self.frame % self.latency
+        self._collect(slot)
+        self._record = {"frame": self.frame, "cpu_ms": {}, "gpu_ms": {}}
+        self._pending[slot] = self._record
+
+    def end_frame(self) -> None:
+        if not self.enabled:
+            return
+        self._record.update(counters.as_dict())
+        self.trace.append(self._record)
+        self.frame += 1
+
+    @contextmanager
+    def stage(self, name: str):
+        """Times the enclosed code as stage `name` of the current frame. Stages cannot be nested."""
+        if not self.enabled:
+            yield
+            return
+        slot = self.frame % self.latency
+        query = self._queries[slot, self.stages.index(name)]
+        glBeginQuery(GL_TIME_ELAPSED, query)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record["cpu_ms"][name] = (time.perf_counter() - start) * 1000
+            glEndQuery(GL_TIME_ELAPSED)
+            self._issued[slot].add(name)
+
+    def _collect(self, slot: int) -> None:
+        """Reads finished queries of given set into their frame record. Unfinished results are dropped."""
+        record = self._pending[slot]
+        for name in self._issued[slot]:
+            query = self._queries[slot, self.stages.index(name)]
+            if glGetQueryObjectiv(query, GL_QUERY_RESULT_AVAILABLE):
+                elapsed_ns = ctypes.c_uint64()
+                glGetQueryObjectui64v_raw(query, GL_QUERY_RESULT, ctypes.byref(elapsed_ns))
+                record["gpu_ms"][name] = elapsed_ns.value / 1e6
+        self._issued[slot].clear()
+        self._pending[slot] = None
+
+    def flush(self) -> None:
+        """Waits for all queries in flight, e.g. before dumping the trace."""
+        glFinish()
+        for slot in range(self.latency):
+            self._collect(slot)
+
+    def stats(self) -> dict:
+        """
+        Rolling averages over the last `history` frames.
+
+        :return: {stage: {"cpu_ms", "gpu_ms"}} plus "frame" with sums of all stages and average counters.
+        """
+        frames = list(self.trace)[-self.history:]
+        result = {}
+
+        def mean(values):
+            values = [v for v in values if v is not None]
+            return sum(values) / len(values) if values else math.nan
+
+        for name in self.stages:
+            result[name] = {"cpu_ms": mean(f["cpu_ms"].get(name) for f in frames),
+                            "gpu_ms": mean(f["gpu_ms"].get(name) for f in frames)}
+        result["frame"] = {
+            "cpu_ms": sum(s["cpu_ms"] for s in result.values()),
+            "gpu_ms": sum(s["gpu_ms"] for s in result.values()),
+            **{key: mean(f.get(key) for f in frames) for key in counters.as_dict()},
+        }
+        return result
+
+    def last_frame_ms(self, gpu_only: bool = False) -> float:
+        """
+        Cost of the newest frame whose GPU times arrived: the larger of its CPU and GPU totals.
+
+        :param gpu_only: Return the GPU total only, e.g. to adapt GPU bound settings like resolution.
+        :return: Milliseconds, NaN if no recent frame has GPU times (e.g. the profiler is disabled).
+        """
+        for i, record in enumerate(reversed(self.trace)):
+            if i > self.latency:
+                break
+            if record["gpu_ms"]:
+                gpu_ms = sum(record["gpu_ms"].values())
+                return gpu_ms if gpu_only else max(sum(record["cpu_ms"].values()), gpu_ms)
+        return math.nan
+
+    def summary_lines(self) -> list:
+        """Rolling stats formatted for the on-screen overlay."""
+        stats = self.stats()
+        lines = [f"{'stage':<18}{'cpu ms':>8}{'gpu ms':>8}"]
+        for name in [*self.stages, "frame"]:
+            lines.append(f"{name:<18}{stats[name]['cpu_ms']:>8.2f}{stats[name]['gpu_ms']:>8.2f}")
+        frame = stats["frame"]
+        lines.append(f"draws {frame['draw_calls']:.0f}  instances {frame['instances']:.0f}")
+        lines.append(f"state changes {frame['state_changes']:.0f}  uniforms {frame['uniform_uploads']:.0f}")
+        return lines
+
+    def dump(self, path: str) -> None:
+        """Writes the trace as JSON, or CSV (one row per frame) if the path ends with .csv."""
+        self.flush()
+        if not path.endswith(".csv"):
+            with open(path, "w") as f:
+                json.dump({"stages": self.stages, "frames": list(self.trace)}, f)
+            return
+
+        header = ["frame", *[f"{name}_cpu_ms" for name in self.stages], *[f"{name}_gpu_ms" for name in self.stages],
+                  *counters.as_dict()]
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for record in self.trace:
+                writer.writerow([record["frame"], *[record["cpu_ms"].get(name, "") for name in self.stages],
+                                 *[record["gpu_ms"].get(name, "") for name in self.stages],
+                                 *[record[key] for key in counters.as_dict()]])
+
+    def release(self) -> None:
+        glDeleteQueries(self._queries.size, self._queries.reshape(-1))
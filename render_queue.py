@@ -0,0 +1,51 @@
+from operator import itemgetter
+
+from OpenGL.GL import *
+
+from profiler import counters
+
+
+class RenderQueue:
+    def __init__(self):
+        """Collects draws of a pass, sorts them by render state and submits them with as few state changes as possible.
+
+        Every draw has a sort key (program, texture array, VAO, material). Sorted draws sharing a key
+        prefix run one after another, so the program is set once, a texture array is bound once, and
+        VAO binds and material uniforms are only issued when they change. Uniforms the material sets
+        to values they already have are skipped by `Shader` itself.
+        """
+        self._items = []
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, shader, texture: int, vao: int, material: tuple, setup, draw) -> None:
+        """
+        Queues one draw.
+
+        :param shader: Shader to draw with.
+        :param texture: Id of the texture array the material samples (0 for none).
+        :param vao: VAO to draw.
+        :param material: Hashable material identity, e.g. (id(mesh), material index).
+        :param setup: Called without arguments to apply the material when it differs from the previous draw's.
+        :param draw: Called without arguments to issue the draw call (set per-draw uniforms, draw).
+        """
+        self._items.append(((shader.program, texture, vao, material), shader, setup, draw))
+
+    def submit(self) -> None:
+        """Issues queued draws in sorted order and empties the queue."""
+        self._items.sort(key=itemgetter(0))  # Stable, draws with equal keys keep their order
+        shader, vao, material = None, None, None
+        for (_, _, item_vao, item_material), item_shader, setup, draw in self._items:
+            if item_shader is not shader:
+                item_shader.use()
+                shader, material = item_shader, None  # Material uniforms belong to the program
+            if item_vao != vao:
+                glBindVertexArray(item_vao)
+                counters.state_changes += 1
+                vao = item_vao
+            if item_material != material:
+                setup()
+                material = item_material
+            draw()
+        self._items.clear()
@@ -0,0 +1,58 @@
+import os
+
+
+class SharedResource:
+    """Reference counted resource, shared between all users asking for the same key.
+
+    Subclasses get their own registry. Use `acquire` instead of the constructor and
+    call `release` once the resource is no longer needed.
+    """
+
+    _registry: dict = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._registry = {}
+
+    def __init__(self, key):
+        self.key = key
+        self._refs: int = 0
+
+    @staticmethod
+    def make_key(path: str):
+        """Normalised registry key, so different spellings of one path share a resource."""
+        return os.path.normcase(os.path.abspath(path))
+
+    @classmethod
+    def acquire(cls, path: str, *args, **kwargs):
+        """Returns the resource for given path, creating it on first use.
+
+        :param path: Path of the source file.
+        :return: Shared resource with its reference count increased.
+        """
+        key = cls.make_key(path)
+        resource = cls._registry.get(key)
+        if resource is None:
+            resource = cls(key, *args, **kwargs)
+            cls._registry[key] = resource
+        resource._refs += 1
+        return resource
+
+    def release(self) -> None:
+        """Drops one reference. Frees the underlying resource when nobody uses it anymore."""
+        if self._refs <= 0:
+            return
+        self._refs -= 1
+        if self._refs == 0:
+            del type(self)._registry[self.key]
+            self._delete()
+
+    @classmethod
+    def release_all(cls) -> None:
+        """Frees every resource of this type, regardless of reference counts."""
+        for resource in list(cls._registry.values()):
+            resource._refs = 1
+            resource.release()
+
+    def _delete(self) -> None:
+        raise NotImplementedError
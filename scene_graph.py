@@ -0,0 +1,185 @@
+import numpy as np
+from pyrr import matrix44 as m44, quaternion
+
+
+class SceneGraph:
+    def __init__(self, capacity: int = 64):
+        """Transform hierarchy stored as contiguous arrays (struct of arrays), one entry per node.
+
+        Every node has a local matrix relative to its parent and a world matrix. World matrices are
+        propagated in `update`, one batched matmul per hierarchy level, and only for nodes whose local
+        matrix changed and their descendants. Matrices use pyrr's row vector layout, so a child's world
+        matrix is `local @ parent world`.
+
+        Nodes also have a uniform geometry scale, applied to the node's own drawn geometry but not
+        inherited by children (see `object_matrices`).
+
+        :param capacity: Number of nodes to allocate room for, grows as needed.
+        """
+        self._count = 0
+        self._local = np.zeros((capacity, 4, 4))
+        self._world = np.zeros((capacity, 4, 4))
+        self._scale = np.ones(capacity)
+        self._parent = np.full(capacity, -1, dtype=np.int64)
+        self._depth = np.zeros(capacity, dtype=np.int64)
+        self._dirty = np.zeros(capacity, dtype=bool)
+        self._version = np.zeros(capacity, dtype=np.int64)  # Incremented whenever the world matrix changes
+        self._levels = None  # Node indices grouped by depth, rebuilt after adding nodes
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _grow(self, count: int) -> None:
+        """Makes room for `count` more nodes, doubling the arrays."""
+        capacity = len(self._local)
+        if self._count + count <= capacity:
+            return
+        new_capacity = max(capacity * 2, self._count + count)
+        for name, fill in [("_local", 0.0), ("_world", 0.0), ("_scale", 1.0), ("_parent", -1), ("_depth", 0),
+                           ("_dirty", False), ("_version", 0)]:
+            old = getattr(self, name)
+            new = np.full((new_capacity, *old.shape[1:]), fill, dtype=old.dtype)
+            new[:capacity] = old
+            setattr(self, name, new)
+
+    def add(self, local: np.ndarray = None, parent: int = -1, scale: float = 1.0) -> int:
+        """
+        Adds a node.
+
+        :param local: Local matrix, identity by default.
+        :param parent: Parent node, -1 for a root. Parents must be added before their children.
+        :param scale: Geometry scale of the node.
+        :return: Index of the new node.
+        """
+        local = np.eye(4) if local is None else np.asarray(local)
+        return int(self.add_many(local[None], [parent], [scale])[0])
+
+    def add_many(self, local: np.ndarray, parents, scales=None) -> np.ndarray:
+        """
+        Adds nodes in one batch.
+
+        :param local: (n, 4, 4) local matrices.
+        :param parents: (n,) parent nodes (existing ones or earlier in this batch), -1 for roots.
+        :param scales: (n,) geometry scales, 1 by default.
+        :return: Indices of the new nodes.
+        """
+        count = len(local)
+        self._grow(count)
+        nodes = np.arange(self._count, self._count + count)
+        parents = np.asarray(parents, dtype=np.int64)
+        if np.any(parents >= nodes):
+            raise ValueError("Parent nodes must be added before their children")
+        self._local[nodes] = local
+        self._scale[nodes] = 1.0 if scales is None else scales
+        self._parent[nodes] = parents
+        self._dirty[nodes] = True
+        self._count += count
+        for node, parent in zip(nodes.tolist(), parents.tolist()):  # In order, parents within the batch come first
+            self._depth[node] = self._depth[parent] + 1 if parent != -1 else 0
+        self._levels = None
+        return nodes
+
+    def local(self, node: int) -> np.ndarray:
+        """Local matrix of a node."""
+        return self._local[node]
+
+    def world(self, node: int) -> np.ndarray:
+        """World matrix of a node, as of the last `update`."""
+        return self._world[node]
+
+    def version(self, node: int) -> int:
+        """Counter changing whenever the node's world matrix does, for caching values derived from it."""
+        return int(self._version[node])
+
+    def set_local(self, node, local: np.ndarray) -> None:
+        """
+        Sets local matrices, world matrices of the nodes and their descendants follow on `update`.
+
+        :param node: Node index or array of indices.
+        :param local: (4, 4) matrix or (n, 4, 4) matrices for an array of nodes.
+        """
+        self._local[node] = local
+        self._dirty[node] = True
+
+    def _level_nodes(self) -> list:
+        if self._levels is None:
+            depth = self._depth[:self._count]
+            order = np.argsort(depth, kind="stable")
+            bounds = np.searchsorted(depth[order], np.arange(depth.max() + 2 if self._count else 1))
+            self._levels = [order[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+        return self._levels
+
+    def update(self) -> np.ndarray:
+        """
+        Propagates world matrices from changed nodes down to their descendants.
+
+        :return: Indices of nodes whose world matrix changed.
+        """
+        dirty = self._dirty[:self._count]
+        if not dirty.any():
+            return np.zeros(0, dtype=np.int64)
+        changed = dirty.copy()
+        for depth, level in enumerate(self._level_nodes()):
+            if depth == 0:
+                nodes = level[changed[level]]
+                self._world[nodes] = self._local[nodes]
+                continue
+            parents = self._parent[level]
+            need = changed[level] | changed[parents]
+            nodes, parents = level[need], parents[need]
+            if len(nodes):
+                self._world[nodes] = self._local[nodes] @ self._world[parents]
+                changed[nodes] = True
+        dirty[:] = False
+        updated = np.flatnonzero(changed)
+        self._version[updated] += 1
+        return updated
+
+    def object_matrices(self, nodes) -> np.ndarray:
+        """World matrices of nodes with their geometry scale applied, (n, 4, 4) for an array of nodes."""
+        world = self._world[nodes].copy()
+        world[..., :3, :3] *= self._scale[nodes][..., None, None]
+        return world
+
+    def normal_matrices(self, nodes) -> np.ndarray:
+        """Normal matrices (inverse transpose of the upper 3x3 of `object_matrices`) of nodes, float32."""
+        rows = self.object_matrices(nodes)[..., :3, :3]
+        r0, r1, r2 = rows[..., 0, :], rows[..., 1, :], rows[..., 2, :]
+        # Inverse transpose is the cofactor matrix over the determinant, much faster than batched np.linalg.inv
+        cofactors = np.stack([np.cross(r1, r2), np.cross(r2, r0), np.cross(r0, r1)], axis=-2)
+        det = np.einsum("...i,...i->...", r0, cofactors[..., 0, :])
+        return (cofactors / det[..., None, None]).astype(np.float32)
+
+
+def graph_nodes(objects) -> tuple:
+    """
+    Finds the scene graph nodes of objects, so their matrices can be gathered in one batch.
+
+    :param objects: Objects with `graph` and `node` attributes (e.g. LoadedObjects).
+    :return: (SceneGraph, node index array) if all objects are nodes of one graph, (None, None) otherwise.
+    """
+    graphs = {id(o.graph) for o in objects}
+    if len(objects) == 0 or len(graphs) != 1 or objects[0].graph is None:
+        return None, None
+    return objects[0].graph, np.array([o.node for o in objects], dtype=np.int64)
+
+
+def interpolate_transform(a: np.ndarray, b: np.ndarray, t: float) -> np.ndarray:
+    """
+    Blends two rigid transforms (rotation and translation, pyrr layout), e.g. local matrices of two simulation steps.
+
+    Rotations are blended along the shorter arc as normalized quaternions, which is close to a slerp for the small
+    rotations between steps.
+
+    :param a: Transform at t = 0.
+    :param b: Transform at t = 1.
+    :param t: Blend factor in [0, 1].
+    :return: Blended 4x4 matrix.
+    """
+    qa, qb = quaternion.create_from_matrix(a), quaternion.create_from_matrix(b)
+    if np.dot(qa, qb) < 0:
+        qb = -qb  # q and -q are the same rotation, blend towards the closer one
+    q = (1 - t) * qa + t * qb
+    blended = m44.create_from_quaternion(q / np.linalg.norm(q))
+    blended[3, :3] = (1 - t) * np.asarray(a)[3, :3] + t * np.asarray(b)[3, :3]
+    return blended
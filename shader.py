@@ -1,46 +1,225 @@
+import os
+import re
+import sys
+import threading
+
+import numpy as np
 from OpenGL.GL import *
-from OpenGL.GL.shaders import compileShader, compileProgram, ShaderProgram
+from OpenGL.GL.shaders import compileShader
+# The wrapped version fails to query the binary size, the raw one fills a given buffer
+from OpenGL.raw.GL.VERSION.GL_4_1 import glGetProgramBinary as glGetProgramBinary_raw
 from pyrr import matrix44 as m44, Vector3 as v3
 
+import shader_cache
+from profiler import counters
+from uniform_buffer import UniformBuffer
+
 
 class Shader:
-    def __init__(self, vs: str, fs: str):
+    # Sampler uniform name -> texture unit, same for all programs
+    sampler_units = {
+        "s_texture": 0,
+        "pointLightData": 1,
+        "clusterGrid": 2,
+        "clusterLights": 3,
+        "gPosition": 4,
+        "gNormal": 5,
+        "gAmbient": 6,
+        "gDiffuse": 7,
+        "gSpecular": 8,
+        "gDepth": 9,
+        "dirShadowMap": 10,
+        "spotShadowMap": 11,
+        "postImage": 12,
+        "postDepth": 13,
+        "instanceMatrices": 14,
+    }
+
+    # Program in use, to skip redundant glUseProgram calls
+    _current: int = 0
+    # Store linked programs on disk and load them on the next start (see shader_cache.py)
+    use_cache: bool = True
+    # Driver identification for program cache keys, None if program binaries are not supported
+    _driver: str = None
+    _driver_checked: bool = False
+
+    def __init__(self, vs: str, fs: str, defines: dict = None, _variants: dict = None):
         """Shader program wrapper. Compiled and prepared for use.
 
+        Uniform values are cached, setting a uniform to the value it already has does nothing.
+        Linked programs are cached on disk, see `use_cache`. `reload` recompiles the program after its
+        sources changed (see `ShaderWatcher`). Features are switched by compiling variants of the
+        sources with preprocessor definitions (see `variant`) instead of branching on uniforms.
+
         :param vs: Vertex shader filepath.
         :param fs: Fragment shader filepath.
+        :param defines: Preprocessor definitions (name -> value) inserted after `#version`, see `variant`.
         """
         self._vs_path = vs
         self._fs_path = fs
+        self.defines = {name: value for name, value in (defines or {}).items()
+                        if value is not None and value is not False}
+        # Variants of the same sources by their definitions, shared by all of them
+        self._variants = _variants if _variants is not None else {}
+        self._variants.setdefault(tuple(sorted(self.defines.items())), self)
+        self._derived = {}  # Definitions requested from this shader -> variant
+        self._names = None  # Identifiers used in the sources, to drop definitions they do not use
         self._shader = self._compile_shader()
+        self._values = {}  # Uniform location -> last uploaded value
+        self._loc = {}
+        self._prepare()
+
+    @property
+    def source_paths(self) -> tuple:
+        """Paths of the vertex and fragment shader sources."""
+        return self._vs_path, self._fs_path
+
+    @property
+    def program(self) -> int:
+        """OpenGL program name."""
+        return int(self._shader)
+
+    def variant(self, **defines) -> "Shader":
+        """
+        Shader compiled from the same sources with changed preprocessor definitions. Compiled on first use.
+
+        True defines `NAME`, False or None leaves it undefined and other values define `NAME value`.
+        Definitions the sources never mention are dropped, so they do not compile duplicate programs.
+
+        :param defines: Definitions added to (or replacing) the ones of this shader.
+        :return: Shader with the definitions, this one if they do not change anything.
+        """
+        request = tuple(sorted(defines.items()))
+        shader = self._derived.get(request)
+        if shader is None:
+            merged = {name: value for name, value in {**self.defines, **defines}.items()
+                      if value is not None and value is not False and name.encode() in self._names}
+            key = tuple(sorted(merged.items()))
+            shader = self._variants.get(key)
+            if shader is None:
+                shader = Shader(self._vs_path, self._fs_path, merged, self._variants)
+            self._derived[request] = shader
+        return shader
 
+    def _prepare(self) -> None:
+        """Resolves uniform locations and connects uniform blocks and samplers of a newly linked program."""
+        self._values = {}
         # Assumption: all shaders will have these uniforms.
         self._loc = {
             "model": glGetUniformLocation(self._shader, "model"),
-            "projection": glGetUniformLocation(self._shader, "projection"),
-            "view": glGetUniformLocation(self._shader, "view"),
         }
+        self._bind_uniform_blocks()
+        self._bind_samplers()
+
+    def reload(self) -> bool:
+        """
+        Recompiles programs of this shader and all its variants from the source files and swaps them in.
+        A program failing to compile is kept.
+
+        :return: Whether all new programs are in use.
+        """
+        shaders = list(self._variants.values())
+        reloaded = all([shader._reload_program() for shader in shaders])
+        # Edited sources may mention definitions they did not before, requests are filtered against them again
+        for shader in shaders:
+            shader._derived = {}
+        return reloaded
+
+    def _reload_program(self) -> bool:
+        try:
+            program = self._compile_shader()
+        except (RuntimeError, OSError) as e:
+            message = e.args[0] if e.args else e  # Compilation errors also carry the whole source
+            defines = f" ({', '.join(self.defines)})" if self.defines else ""
+            print(f"Shader {self._vs_path}, {self._fs_path}{defines} not reloaded: {message}", file=sys.stderr)
+            return False
+        old, self._shader = self._shader, program
+        self._prepare()  # Locations may differ in the new program
+        glDeleteProgram(old)
+        return True
 
     def use(self) -> None:
+        """Makes the program current, unless it already is."""
+        if Shader._current == self._shader:
+            return
         glUseProgram(self._shader)
+        Shader._current = self._shader
+        counters.state_changes += 1
+
+    def _changed(self, loc: int, value) -> bool:
+        """Remembers value of uniform at given location, returns False if it already had it."""
+        if loc == -1 or self._values.get(loc) == value:
+            return False
+        self._values[loc] = value
+        return True
 
     def set_model(self, matrix: m44) -> None:
-        glUniformMatrix4fv(self._get_loc("model"), 1, GL_FALSE, matrix)
+        loc = self._get_loc("model")
+        if self._changed(loc, np.asarray(matrix, dtype=np.float32).tobytes()):
+            glUniformMatrix4fv(loc, 1, GL_FALSE, matrix)
+            counters.uniform_uploads += 1
 
-    def set_projection(self, matrix: m44) -> None:
-        glUniformMatrix4fv(self._get_loc("projection"), 1, GL_FALSE, matrix)
+    def set_m4(self, uniform_name: str, matrix) -> None:
+        loc = self._get_loc(uniform_name)
+        if self._changed(loc, np.asarray(matrix, dtype=np.float32).tobytes()):
+            glUniformMatrix4fv(loc, 1, GL_FALSE, matrix)
+            counters.uniform_uploads += 1
 
-    def set_view(self, matrix: m44) -> None:
-        glUniformMatrix4fv(self._get_loc("view"), 1, GL_FALSE, matrix)
+    def set_m3(self, uniform_name: str, matrix) -> None:
+        loc = self._get_loc(uniform_name)
+        if self._changed(loc, np.asarray(matrix, dtype=np.float32).tobytes()):
+            glUniformMatrix3fv(loc, 1, GL_FALSE, matrix)
+            counters.uniform_uploads += 1
 
     def set_bool(self, uniform_name: str, val: bool) -> None:
-        glUniform1i(self._get_loc(uniform_name), val)
+        self.set_int(uniform_name, int(val))
+
+    def set_int(self, uniform_name: str, val: int) -> None:
+        loc = self._get_loc(uniform_name)
+        if self._changed(loc, int(val)):
+            glUniform1i(loc, val)
+            counters.uniform_uploads += 1
 
     def set_float(self, uniform_name: str, val: float) -> None:
-        glUniform1f(self._get_loc(uniform_name), val)
+        loc = self._get_loc(uniform_name)
+        if self._changed(loc, float(val)):
+            glUniform1f(loc, val)
+            counters.uniform_uploads += 1
+
+    def set_v2(self, uniform_name: str, val) -> None:
+        loc = self._get_loc(uniform_name)
+        if self._changed(loc, np.asarray(val, dtype=np.float32).tobytes()):
+            glUniform2fv(loc, 1, val)
+            counters.uniform_uploads += 1
 
     def set_v3(self, uniform_name: str, val: v3) -> None:
-        glUniform3fv(self._get_loc(uniform_name), 1, val)
+        loc = self._get_loc(uniform_name)
+        if self._changed(loc, np.asarray(val, dtype=np.float32).tobytes()):
+            glUniform3fv(loc, 1, val)
+            counters.uniform_uploads += 1
+
+    def set_v4(self, uniform_name: str, val) -> None:
+        loc = self._get_loc(uniform_name)
+        if self._changed(loc, np.asarray(val, dtype=np.float32).tobytes()):
+            glUniform4fv(loc, 1, val)
+            counters.uniform_uploads += 1
+
+    def _bind_uniform_blocks(self) -> None:
+        """Connects uniform blocks used by the program to their shared binding points."""
+        for block_name, binding in UniformBuffer.bindings.items():
+            index = glGetUniformBlockIndex(self._shader, block_name)
+            if index != GL_INVALID_INDEX:
+                glUniformBlockBinding(self._shader, index, binding)
+
+    def _bind_samplers(self) -> None:
+        """Assigns texture units to samplers used by the program."""
+        glUseProgram(self._shader)
+        for sampler_name, unit in self.sampler_units.items():
+            loc = self._get_loc(sampler_name)
+            if loc != -1:
+                glUniform1i(loc, unit)
+        glUseProgram(0)
+        Shader._current = 0
 
     def _get_loc(self, uniform_name: str) -> None:
         """Lazy uniform location storage."""
@@ -48,21 +227,150 @@ class Shader:
             self._loc[uniform_name] = glGetUniformLocation(self._shader, uniform_name)
         return self._loc[uniform_name]
 
-    def _compile_shader(self) -> ShaderProgram:
+    def _compile_shader(self) -> int:
         """
-        Compile shaders from given source files.
+        Compile shaders from given source files, or load the linked program from the program cache.
 
         :return: Compiled shader program.
         """
         vert_shader = self._load_shader(self._vs_path)
         frag_shader = self._load_shader(self._fs_path)
+        self._names = set(re.findall(rb"\w+", vert_shader + frag_shader))
+        vert_shader, frag_shader = self._insert_defines(vert_shader), self._insert_defines(frag_shader)
 
-        shader = compileProgram(compileShader(vert_shader, GL_VERTEX_SHADER),
-                                compileShader(frag_shader, GL_FRAGMENT_SHADER))
-        return shader
+        driver = self._binary_driver() if self.use_cache else None
+        key = shader_cache.cache_key([vert_shader, frag_shader], driver) if driver is not None else None
+        if key is not None:
+            program = self._load_binary(key)
+            if program is not None:
+                return program
+
+        program = self._link([compileShader(vert_shader, GL_VERTEX_SHADER),
+                              compileShader(frag_shader, GL_FRAGMENT_SHADER)], key is not None)
+        if key is not None:
+            self._store_binary(key, program)
+        return program
+
+    @staticmethod
+    def _link(shaders: list, retrievable: bool) -> int:
+        """Links compiled shader stages into a program, raises RuntimeError with the info log on failure."""
+        program = glCreateProgram()
+        for shader in shaders:
+            glAttachShader(program, shader)
+        if retrievable:
+            glProgramParameteri(program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+        glLinkProgram(program)
+        for shader in shaders:
+            glDetachShader(program, shader)
+            glDeleteShader(shader)
+        # Not validated: validation checks current GL state, samplers are assigned texture units only after linking
+        if glGetProgramiv(program, GL_LINK_STATUS) != GL_TRUE:
+            log = glGetProgramInfoLog(program)
+            glDeleteProgram(program)
+            raise RuntimeError(f"Shader link failure: {log.decode(errors='replace') if log else ''}")
+        return program
+
+    @classmethod
+    def _binary_driver(cls):
+        """Driver identification for the program cache, None if the driver cannot save program binaries."""
+        if not cls._driver_checked:
+            cls._driver_checked = True
+            if bool(glGetProgramBinary) and bool(glProgramBinary) and glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS) > 0:
+                cls._driver = "|".join(glGetString(name).decode() for name in (GL_VENDOR, GL_RENDERER, GL_VERSION))
+        return cls._driver
+
+    @staticmethod
+    def _load_binary(key: str):
+        """Creates program from the program cache, None if it is not cached or the driver rejects the binary."""
+        cached = shader_cache.load(key)
+        if cached is None:
+            return None
+        binary_format, binary = cached
+        program = glCreateProgram()
+        glProgramBinary(program, binary_format, binary, len(binary))
+        if glGetProgramiv(program, GL_LINK_STATUS) != GL_TRUE:
+            glDeleteProgram(program)
+            return None
+        return program
+
+    @staticmethod
+    def _store_binary(key: str, program: int) -> None:
+        length = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+        if length <= 0:
+            return
+        binary = np.zeros(length, dtype=np.uint8)
+        written, binary_format = GLsizei(0), GLenum(0)
+        glGetProgramBinary_raw(program, length, written, binary_format, binary)
+        if written.value > 0:
+            shader_cache.store(key, binary_format.value, binary[:written.value])
+
+    def _insert_defines(self, source: bytes) -> bytes:
+        """Inserts definitions after the `#version` line, keeping line numbers of compile errors."""
+        if not self.defines:
+            return source
+        version, _, rest = source.partition(b"\n")
+        lines = [f"#define {name}" if value is True else f"#define {name} {value}"
+                 for name, value in self.defines.items()]
+        return b"\n".join([version, *(line.encode() for line in lines), b"#line 2", rest])
 
     @staticmethod
     def _load_shader(shader_file: str) -> bytes:
         with open(shader_file) as f:
             shader_source = f.read()
         return str.encode(shader_source)
+
+
+def _source_times(shader: Shader) -> tuple:
+    """Modification times of shader source files, None for files that cannot be read (e.g. being replaced)."""
+    times = []
+    for path in shader.source_paths:
+        try:
+            times.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            times.append(None)
+    return tuple(times)
+
+
+class ShaderWatcher:
+    def __init__(self, shaders, interval: float = 0.5):
+        """Reloads shaders whose source files change, to edit them while the application runs.
+
+        Source files are polled on a background thread. Programs belong to the OpenGL context, so
+        changed shaders are recompiled and swapped in by `process`, called on the context's thread.
+        A shader that fails to compile keeps its old program until its sources change again.
+
+        :param shaders: Shaders to watch.
+        :param interval: Seconds between checks of the source files.
+        """
+        self._shaders = list(shaders)
+        self._changed = set()  # Shaders with changed sources, waiting for `process`
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, args=(interval,), name="ShaderWatcher", daemon=True)
+        self._thread.start()
+
+    def _watch(self, interval: float) -> None:
+        times = {shader: _source_times(shader) for shader in self._shaders}
+        while not self._stop.wait(interval):
+            for shader in self._shaders:
+                current = _source_times(shader)
+                if current != times[shader] and None not in current:
+                    times[shader] = current
+                    with self._lock:
+                        self._changed.add(shader)
+
+    def process(self) -> int:
+        """
+        Recompiles shaders whose sources changed. Call on the thread owning the OpenGL context.
+
+        :return: Number of shaders swapped to new programs.
+        """
+        if not self._changed:
+            return 0
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        return sum(shader.reload() for shader in changed)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,81 @@
+"""On-disk cache of linked shader programs.
+
+Compiling and linking GLSL is a noticeable part of startup, so linked programs are read back with
+`glGetProgramBinary` and stored next to the mesh cache:
+
+    magic (8 bytes) | binary format (uint32 LE) | program binary
+
+Files are named by a hash of the shader sources and the driver (vendor, renderer and version), so
+editing a shader or updating the driver picks a new file. Drivers may still reject a binary, then the
+program is compiled from source and the file is replaced.
+"""
+import hashlib
+import os
+import struct
+
+import numpy as np
+
+CACHE_DIR = os.path.join(".cache", "shaders")
+MAGIC = b"GKPRG001"
+
+
+def cache_key(sources: list, driver: str) -> str:
+    """
+    Cache key of a program.
+
+    :param sources: Source code (bytes) of every stage, in a fixed order.
+    :param driver: Driver identification, programs are only valid for the driver that linked them.
+    :return: Hex digest.
+    """
+    digest = hashlib.sha1(driver.encode())
+    for source in sources:
+        digest.update(struct.pack("<Q", len(source)))
+        digest.update(source)
+    return digest.hexdigest()
+
+
+def cache_path(key: str) -> str:
+    """Cache file path for given key."""
+    return os.path.join(CACHE_DIR, f"{key}.bin")
+
+
+def load(key: str):
+    """
+    Loads cached program binary.
+
+    :param key: Cache key, see `cache_key`.
+    :return: (binary format, uint8 array) or None if there is no cached program.
+    """
+    try:
+        with open(cache_path(key), "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            (binary_format,) = struct.unpack("<I", f.read(4))
+            binary = np.frombuffer(f.read(), dtype=np.uint8)
+    except (OSError, struct.error):
+        return None
+    if len(binary) == 0:
+        return None
+    return binary_format, binary
+
+
+def store(key: str, binary_format: int, binary: np.ndarray) -> None:
+    """
+    Writes program binary to the cache. Failures are ignored, the cache is only an optimisation.
+
+    :param key: Cache key, see `cache_key`.
+    :param binary_format: Driver specific format returned with the binary.
+    :param binary: Program binary.
+    """
+    file = cache_path(key)
+    tmp = f"{file}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<I", binary_format))
+            f.write(bytes(binary))
+        os.replace(tmp, file)  # Atomic, readers never see a half written file
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
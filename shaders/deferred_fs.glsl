@@ -0,0 +1,284 @@
+#version 330 core
+out vec4 FragColor;
+
+struct Material {
+    vec3 ambient;
+    vec3 diffuse;
+    vec3 specular;
+    float shininess;
+};
+
+// Light structs are laid out for the std140 Lights block, floats fill vec3 padding.
+struct DirLight {
+    vec3 direction;
+
+    vec3 ambient;
+    vec3 diffuse;
+    vec3 specular;
+};
+
+struct PointLight {
+    vec3 position;
+    float constant;
+    vec3 ambient;
+    float linear;
+    vec3 diffuse;
+    float quadratic;
+    vec3 specular;
+};
+
+struct SpotLight {
+    vec3 position;
+    float constant;
+    vec3 direction;
+    float linear;
+    vec3 ambient;
+    float quadratic;
+    vec3 diffuse;
+    float cutOff;
+    vec3 specular;
+    float outerCutOff;
+};
+
+Material material;  // Read from G-buffer for current pixel
+
+layout(std140) uniform Matrices
+{
+    mat4 projection;
+    mat4 view;
+    vec3 viewPos;
+};
+
+layout(std140) uniform Lights
+{
+    DirLight dirLight;
+    SpotLight spotLight;
+};
+
+uniform sampler2D gPosition;
+uniform sampler2D gNormal;
+uniform sampler2D gAmbient;
+uniform sampler2D gDiffuse;
+uniform sampler2D gSpecular;
+uniform sampler2D gDepth;
+
+layout(std140) uniform Clusters
+{
+    uvec4 gridSize;    // x tiles, y tiles, depth slices, w = point light count
+    vec4 depthParams;  // slice = log(depth) * x + y
+    vec4 viewport;     // x, y, width, height
+};
+
+uniform samplerBuffer pointLightData;  // 4 texels per light, see PointLight.pack()
+uniform usamplerBuffer clusterGrid;    // (offset, count) into clusterLights
+uniform usamplerBuffer clusterLights;  // Light indices grouped by cluster
+
+layout(std140) uniform Shadows
+{
+    mat4 cascadeMatrices[SHADOW_CASCADES];  // World to shadow map texture space, see shadows.py
+    mat4 spotShadowMatrix;
+    vec4 cascadeSplits;   // View depth where every cascade ends
+    vec4 cascadeOffsets;  // Normal offset of every cascade in world units
+    vec4 shadowParams;    // x = spotlight normal offset per unit of distance
+};
+
+uniform sampler2DArrayShadow dirShadowMap;   // Directional light cascades
+uniform sampler2DArrayShadow spotShadowMap;  // Spotlight, single layer
+
+vec3 CalcDirLight(DirLight light, vec3 normal, vec3 viewDir, vec4 texel, float shadow);
+vec3 CalcPointLight(PointLight light, vec3 normal, vec3 fragPos, vec3 viewDir);
+vec3 CalcSpotLight(SpotLight light, vec3 normal, vec3 fragPos, vec3 viewDir, float shadow);
+float DirShadow(vec3 fragPos, vec3 normal, float viewDepth);
+float SpotShadow(vec3 fragPos, vec3 normal);
+PointLight fetchPointLight(int index);
+int clusterIndex(vec2 fragCoord, float viewDepth);
+
+void main()
+{
+    // Lighting pass of deferred shading: one evaluation per screen pixel
+    ivec2 pixel = ivec2(gl_FragCoord.xy);  // Same pixel in the G-buffer, also for views drawn into a viewport
+    float depth = texelFetch(gDepth, pixel, 0).r;
+    if (depth == 1.0)
+        discard;  // Nothing was drawn here, keep the background
+    gl_FragDepth = depth;
+
+    vec4 position = texelFetch(gPosition, pixel, 0);
+    vec3 fragPos = position.xyz;
+    float viewDepth = position.w;
+    vec3 norm = normalize(texelFetch(gNormal, pixel, 0).xyz);
+    vec4 diffuse = texelFetch(gDiffuse, pixel, 0);
+    vec4 specular = texelFetch(gSpecular, pixel, 0);
+    material = Material(texelFetch(gAmbient, pixel, 0).rgb, diffuse.rgb, specular.rgb, specular.a);
+    vec3 viewDir = normalize(viewPos - fragPos);
+
+    // Texel is already multiplied into G-buffer material colors
+    vec4 texel = vec4(1.0);
+
+    // Directional light
+    vec3 result = CalcDirLight(dirLight, norm, viewDir, texel, DirShadow(fragPos, norm, viewDepth));
+
+    // Point lights, only those assigned to pixel's cluster
+    uvec2 cluster = texelFetch(clusterGrid, clusterIndex(gl_FragCoord.xy, viewDepth)).xy;
+    for(uint i = 0u; i < cluster.y; i++)
+    {
+        int lightIndex = int(texelFetch(clusterLights, int(cluster.x + i)).r);
+        result += CalcPointLight(fetchPointLight(lightIndex), norm, fragPos, viewDir);
+    }
+
+    // Spot light
+    result += CalcSpotLight(spotLight, norm, fragPos, viewDir, SpotShadow(fragPos, norm));
+
+    FragColor = vec4(result, diffuse.a);
+}
+
+vec3 CalcDirLight(DirLight light, vec3 normal, vec3 viewDir, vec4 texel, float shadow)
+{
+    vec3 lightDir = normalize(-light.direction);
+    // diffuse shading
+    float diff = max(dot(normal, lightDir), 0.0);
+    // specular shading
+    vec3 reflectDir = reflect(-lightDir, normal);
+    float spec = pow(max(dot(viewDir, reflectDir), 0.0), material.shininess);
+    // combine results
+    vec3 ambient = light.ambient * material.ambient;
+    vec3 diffuse = light.diffuse * diff * material.diffuse;
+    vec3 specular = light.specular * spec * material.specular;
+
+    return (ambient + shadow * (diffuse + specular)) * texel.rgb;
+}
+
+vec3 CalcPointLight(PointLight light, vec3 normal, vec3 fragPos, vec3 viewDir)
+{
+    vec3 lightDir = normalize(light.position - fragPos);
+    // diffuse shading
+    float diff = max(dot(normal, lightDir), 0.0);
+    // specular shading
+    vec3 reflectDir = reflect(-lightDir, normal);
+    float spec = pow(max(dot(viewDir, reflectDir), 0.0), material.shininess);
+    // attenuation
+    float distance = length(light.position - fragPos);
+    float attenuation = 1.0 / (light.constant + light.linear * distance + light.quadratic * (distance * distance));
+    // combine results
+    vec3 ambient  = light.ambient  * material.ambient;
+    vec3 diffuse  = light.diffuse  * diff * material.diffuse;
+    vec3 specular = light.specular * spec * material.specular;
+    ambient  *= attenuation;
+    diffuse  *= attenuation;
+    specular *= attenuation;
+
+    return (ambient + diffuse + specular);
+}
+
+vec3 CalcSpotLight(SpotLight light, vec3 normal, vec3 fragPos, vec3 viewDir, float shadow)
+{
+    vec3 lightDir = normalize(light.position - fragPos);
+    // diffuse shading
+    float diff = max(dot(normal, lightDir), 0.0);
+    // specular shading
+    vec3 reflectDir = reflect(-lightDir, normal);
+    float spec = pow(max(dot(viewDir, reflectDir), 0.0), material.shininess);
+    // attenuation
+    float distance = length(light.position - fragPos);
+    float attenuation = 1.0 / (light.constant + light.linear * distance + light.quadratic * (distance * distance));
+    // combine results
+    vec3 ambient  = light.ambient  * material.ambient;
+    vec3 diffuse  = light.diffuse  * diff * material.diffuse;
+    vec3 specular = light.specular * spec * material.specular;
+    ambient  *= attenuation;
+    diffuse  *= attenuation;
+    specular *= attenuation;
+
+    // spotlight intensity
+    float theta = dot(lightDir, normalize(-light.direction));
+    float epsilon = light.cutOff - light.outerCutOff;
+    float intensity = clamp((theta - light.outerCutOff) / epsilon, 0.0, 1.0);
+    ambient  *= intensity;
+    diffuse  *= intensity;
+    specular *= intensity;
+    // shadow blocks direct light only
+    diffuse  *= shadow;
+    specular *= shadow;
+
+    return (ambient + diffuse + specular);
+}
+
+float SampleShadow(sampler2DArrayShadow map, int layer, vec3 coords)
+{
+    // PCF over 3x3 texels: 4 taps half a texel apart, each a bilinear filtered depth comparison of 2x2 texels
+    vec2 texelSize = 0.5 / vec2(textureSize(map, 0).xy);
+    float depth = min(coords.z, 1.0);
+    float lit = texture(map, vec4(coords.xy + vec2(-texelSize.x, -texelSize.y), layer, depth));
+    lit += texture(map, vec4(coords.xy + vec2(texelSize.x, -texelSize.y), layer, depth));
+    lit += texture(map, vec4(coords.xy + vec2(-texelSize.x, texelSize.y), layer, depth));
+    lit += texture(map, vec4(coords.xy + vec2(texelSize.x, texelSize.y), layer, depth));
+    return lit / 4.0;
+}
+
+float DirShadow(vec3 fragPos, vec3 normal, float viewDepth)
+{
+#ifndef SHADOWS
+    return 1.0;
+#else
+    // Surfaces facing away get no direct light anyway
+    if (viewDepth > cascadeSplits[SHADOW_CASCADES - 1] || dot(normal, dirLight.direction) >= 0.0)
+        return 1.0;
+    int cascade = 0;
+    while (cascade < SHADOW_CASCADES - 1 && viewDepth > cascadeSplits[cascade])
+        cascade++;
+    vec3 coords;
+    for (;; cascade++)
+    {
+        // Offset along the normal against self-shadowing, by about a texel of the cascade
+        vec4 shadowPos = cascadeMatrices[cascade] * vec4(fragPos + normal * cascadeOffsets[cascade], 1.0);
+        coords = shadowPos.xyz / shadowPos.w;
+        // Cascades are fitted to the main view, fragments of other views may lie outside, then wider ones are tried
+        if (cascade == SHADOW_CASCADES - 1 || all(equal(clamp(coords.xy, 0.0, 1.0), coords.xy)))
+            break;
+    }
+    return SampleShadow(dirShadowMap, cascade, coords);
+#endif
+}
+
+float SpotShadow(vec3 fragPos, vec3 normal)
+{
+#ifndef SHADOWS
+    return 1.0;
+#else
+    vec3 lightDir = normalize(spotLight.position - fragPos);
+    // Outside of the cone or facing away, there is no direct light to block
+    if (dot(lightDir, normalize(-spotLight.direction)) < spotLight.outerCutOff || dot(normal, lightDir) <= 0.0)
+        return 1.0;
+    // Texels grow with distance from the light, w is that distance along the light's axis
+    float distance = (spotShadowMatrix * vec4(fragPos, 1.0)).w;
+    if (distance <= 0.0)
+        return 1.0;
+    vec4 coords = spotShadowMatrix * vec4(fragPos + normal * shadowParams.x * distance, 1.0);
+    return SampleShadow(spotShadowMap, 0, coords.xyz / coords.w);
+#endif
+}
+
+PointLight fetchPointLight(int index)
+{
+    vec4 t0 = texelFetch(pointLightData, index * 4);
+    vec4 t1 = texelFetch(pointLightData, index * 4 + 1);
+    vec4 t2 = texelFetch(pointLightData, index * 4 + 2);
+    vec4 t3 = texelFetch(pointLightData, index * 4 + 3);
+
+    PointLight light;
+    light.position = t0.xyz;
+    light.constant = t0.w;
+    light.ambient = t1.xyz;
+    light.linear = t1.w;
+    light.diffuse = t2.xyz;
+    light.quadratic = t2.w;
+    light.specular = t3.xyz;
+    return light;
+}
+
+int clusterIndex(vec2 fragCoord, float viewDepth)
+{
+    vec2 screenPos = clamp((fragCoord - viewport.xy) / viewport.zw, 0.0, 0.9999);
+    uvec2 tile = uvec2(screenPos * vec2(gridSize.xy));
+    uint slice = uint(clamp(log(viewDepth) * depthParams.x + depthParams.y, 0.0, float(gridSize.z - 1u)));
+    return int(tile.x + gridSize.x * (tile.y + gridSize.y * slice));
+}
\ No newline at end of file
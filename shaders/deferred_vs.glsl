@@ -0,0 +1,8 @@
+#version 330 core
+
+void main()
+{
+    // Full screen triangle, no vertex buffers needed
+    vec2 pos = vec2((gl_VertexID << 1) & 2, gl_VertexID & 2);
+    gl_Position = vec4(pos * 2.0 - 1.0, 0.0, 1.0);
+}
@@ -0,0 +1,40 @@
+#version 330 core
+layout(location = 0) out vec4 gPosition;
+layout(location = 1) out vec4 gNormal;
+layout(location = 2) out vec4 gAmbient;
+layout(location = 3) out vec4 gDiffuse;
+layout(location = 4) out vec4 gSpecular;
+
+struct Material {
+    vec3 ambient;
+    vec3 diffuse;
+    vec3 specular;
+    float shininess;
+};
+
+in vec3 v_normal;
+in vec3 frag_pos;
+in vec2 v_texture;
+in vec4 eyeSpacePosition;
+
+uniform Material material;
+#ifdef TEXTURED
+uniform sampler2DArray s_texture;  // Layers of same-size textures, see texture.py
+uniform int textureLayer;          // Layer of the material's texture
+#endif
+
+void main()
+{
+    // Geometry pass of deferred shading: store everything the lighting pass needs
+#ifdef TEXTURED
+    vec4 texel = texture(s_texture, vec3(v_texture, textureLayer));
+#else
+    vec4 texel = vec4(1.0);  // Untextured material, or its texture is still loading
+#endif
+
+    gPosition = vec4(frag_pos, -eyeSpacePosition.z);
+    gNormal = vec4(normalize(v_normal), 0.0);
+    gAmbient = vec4(material.ambient * texel.rgb, 1.0);
+    gDiffuse = vec4(material.diffuse * texel.rgb, texel.a);
+    gSpecular = vec4(material.specular * texel.rgb, material.shininess);
+}
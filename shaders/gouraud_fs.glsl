@@ -1,41 +1,22 @@
 #version 330 core
 out vec4 FragColor;
 
-struct FogParams
-{
-	vec3 color;
-	float start;
-	float end;
-    bool on;
-};
-
 in vec2 v_texture;
 in vec3 LightingColor;
 
-uniform FogParams fogParams;
-uniform sampler2D s_texture;
-
-float getFogFactor(FogParams params, float fogCoordinate);
+#ifdef TEXTURED
+uniform sampler2DArray s_texture;  // Layers of same-size textures, see texture.py
+uniform int textureLayer;          // Layer of the material's texture
+#endif
 
 void main()
 {
-   vec4 texel = texture(s_texture, v_texture);
+#ifdef TEXTURED
+   vec4 texel = texture(s_texture, vec3(v_texture, textureLayer));
+#else
+   vec4 texel = vec4(1.0);  // Untextured material, or its texture is still loading
+#endif
    vec3 result = LightingColor * texel.rgb;
 
-       // Apply fog
-    if (fogParams.on)
-    {
-//        float fogCoordinate = abs(eyeSpacePosition.z / eyeSpacePosition.w);
-//        result = mix(result, fogParams.color, getFogFactor(fogParams, fogCoordinate));
-    }
-
    FragColor = vec4(result, 1.0);
-}
-
-float getFogFactor(FogParams params, float fogCoordinate)
-{
-    float fogLength = params.end - params.start;
-    float result = (params.end - fogCoordinate) / fogLength;
-
-	return 1.0 - clamp(result, 0.0, 1.0);;
 }
\ No newline at end of file
@@ -7,6 +7,7 @@ struct Material {
     float shininess;
 };
 
+// Light structs are laid out for the std140 Lights block, floats fill vec3 padding.
 struct DirLight {
     vec3 direction;
 
@@ -17,62 +18,90 @@ struct DirLight {
 
 struct PointLight {
     vec3 position;
-
     float constant;
-    float linear;
-    float quadratic;
-
     vec3 ambient;
+    float linear;
     vec3 diffuse;
+    float quadratic;
     vec3 specular;
 };
 
 struct SpotLight {
     vec3 position;
-    vec3 direction;
-    float cutOff;
-    float outerCutOff;
-
     float constant;
+    vec3 direction;
     float linear;
-    float quadratic;
-
     vec3 ambient;
+    float quadratic;
     vec3 diffuse;
+    float cutOff;
     vec3 specular;
+    float outerCutOff;
 };
 
-#define NR_POINT_LIGHTS 4
-
 layout(location = 0) in vec3 a_pos;
 layout(location = 1) in vec2 a_texture;
 layout(location = 2) in vec3 a_color;
 layout(location = 3) in vec3 a_normal;
+#ifdef INSTANCED
+layout(location = 4) in uint a_instance;  // Per-instance index into instanceMatrices
+uniform samplerBuffer instanceMatrices;  // 7 texels per instance: model matrix, then normal matrix (xyz)
+#endif
 
 out vec3 LightingColor;
 out vec2 v_texture;
+out vec4 eyeSpacePosition;
 
 uniform Material material;
-uniform vec3 viewPos;
-uniform DirLight dirLight;
-uniform PointLight pointLights[NR_POINT_LIGHTS];
-uniform SpotLight spotLight;
 
+layout(std140) uniform Lights
+{
+    DirLight dirLight;
+    SpotLight spotLight;
+};
+
+layout(std140) uniform Clusters
+{
+    uvec4 gridSize;    // x tiles, y tiles, depth slices, w = point light count
+    vec4 depthParams;  // slice = log(depth) * x + y
+    vec4 viewport;     // x, y, width, height
+};
+
+uniform samplerBuffer pointLightData;  // 4 texels per light, see PointLight.pack()
 
+#ifndef INSTANCED
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
+uniform mat3 normalMatrix;  // Inverse transpose of model, computed on the CPU once per object
+#endif
+
+layout(std140) uniform Matrices
+{
+    mat4 projection;
+    mat4 view;
+    vec3 viewPos;
+};
 
 vec3 CalcDirLight(DirLight light, vec3 normal, vec3 viewDir);
 vec3 CalcPointLight(PointLight light, vec3 normal, vec3 fragPos, vec3 viewDir);
 vec3 CalcSpotLight(SpotLight light, vec3 normal, vec3 fragPos, vec3 viewDir);
+PointLight fetchPointLight(int index);
 
 void main()
 {
     // gouraud shading
     // ------------------------
-    vec3 Position = vec3(model * vec4(a_pos, 1.0));
-    vec3 Normal = mat3(transpose(inverse(model))) * a_normal;
+#ifdef INSTANCED
+    int base = int(a_instance) * 7;
+    mat4 m = mat4(texelFetch(instanceMatrices, base), texelFetch(instanceMatrices, base + 1),
+                  texelFetch(instanceMatrices, base + 2), texelFetch(instanceMatrices, base + 3));
+    mat3 n = mat3(texelFetch(instanceMatrices, base + 4).xyz, texelFetch(instanceMatrices, base + 5).xyz,
+                  texelFetch(instanceMatrices, base + 6).xyz);
+#else
+    mat4 m = model;
+    mat3 n = normalMatrix;
+#endif
+    vec3 Position = vec3(m * vec4(a_pos, 1.0));
+    vec3 Normal = n * a_normal;
 
     // Ambient
 //    vec3 ambient = material.ambient * light.ambient;
@@ -98,9 +127,9 @@ void main()
     // Directional light
     vec3 result = CalcDirLight(dirLight, norm, viewDir);
 
-    // Point lights
-    for(int i = 0; i < NR_POINT_LIGHTS; i++)
-        result += CalcPointLight(pointLights[i], norm, Position, viewDir);
+    // Point lights (all of them, clusters are only used per fragment)
+    for(int i = 0; i < int(gridSize.w); i++)
+        result += CalcPointLight(fetchPointLight(i), norm, Position, viewDir);
 
     // Spot light
     result += CalcSpotLight(spotLight, norm, Position, viewDir);
@@ -112,7 +141,8 @@ void main()
     //
     LightingColor = result;
     v_texture = a_texture;
-    gl_Position = projection * view * model * vec4(a_pos, 1.0);
+    eyeSpacePosition = view * vec4(Position, 1.0);
+    gl_Position = projection * eyeSpacePosition;
 }
 
 vec3 CalcDirLight(DirLight light, vec3 normal, vec3 viewDir)
@@ -181,4 +211,22 @@ vec3 CalcSpotLight(SpotLight light, vec3 normal, vec3 fragPos, vec3 viewDir)
     specular *= intensity;
 
     return (ambient + diffuse + specular);
-}
\ No newline at end of file
+}
+
+PointLight fetchPointLight(int index)
+{
+    vec4 t0 = texelFetch(pointLightData, index * 4);
+    vec4 t1 = texelFetch(pointLightData, index * 4 + 1);
+    vec4 t2 = texelFetch(pointLightData, index * 4 + 2);
+    vec4 t3 = texelFetch(pointLightData, index * 4 + 3);
+
+    PointLight light;
+    light.position = t0.xyz;
+    light.constant = t0.w;
+    light.ambient = t1.xyz;
+    light.linear = t1.w;
+    light.diffuse = t2.xyz;
+    light.quadratic = t2.w;
+    light.specular = t3.xyz;
+    return light;
+}
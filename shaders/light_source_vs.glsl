@@ -6,13 +6,15 @@ layout(location = 2) in vec3 a_color;
 layout(location = 3) in vec3 a_normal;
 
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
 
-out vec4 eyeSpacePosition;
+layout(std140) uniform Matrices
+{
+    mat4 projection;
+    mat4 view;
+    vec3 viewPos;
+};
 
 void main()
 {
-    eyeSpacePosition = view * model * vec4(a_pos, 1.0);
     gl_Position = projection * view * model * vec4(a_pos, 1.0);
 }
\ No newline at end of file
@@ -0,0 +1,19 @@
+#version 330 core
+
+layout(std140) uniform Matrices
+{
+    mat4 projection;
+    mat4 view;
+    vec3 viewPos;
+};
+
+uniform vec3 boxMin;  // World AABB corners
+uniform vec3 boxMax;
+
+void main()
+{
+    // Cube as a 14 vertex triangle strip, no vertex buffers needed. Bit i of each mask is a coordinate of vertex i.
+    int bit = 1 << gl_VertexID;
+    vec3 corner = vec3((0x287a & bit) != 0, (0x02af & bit) != 0, (0x31e3 & bit) != 0);
+    gl_Position = projection * view * vec4(mix(boxMin, boxMax, corner), 1.0);
+}
@@ -0,0 +1,11 @@
+#version 330 core
+out vec4 FragColor;
+
+in vec2 v_texture;
+
+uniform sampler2D s_texture;
+
+void main()
+{
+    FragColor = texture(s_texture, v_texture);
+}
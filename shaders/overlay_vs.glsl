@@ -0,0 +1,13 @@
+#version 330 core
+
+out vec2 v_texture;
+
+uniform vec4 rect;  // Quad corners in NDC: x0, y0 (bottom left), x1, y1 (top right)
+
+void main()
+{
+    // Quad drawn as triangle strip, no vertex buffers needed
+    vec2 corner = vec2(gl_VertexID & 1, gl_VertexID >> 1);
+    v_texture = vec2(corner.x, 1.0 - corner.y);  // Text image rows are stored top first
+    gl_Position = vec4(mix(rect.xy, rect.zw, corner), 0.0, 1.0);
+}
@@ -8,6 +8,7 @@ struct Material {
     float shininess;
 };
 
+// Light structs are laid out for the std140 Lights block, floats fill vec3 padding.
 struct DirLight {
     vec3 direction;
 
@@ -18,88 +19,112 @@ struct DirLight {
 
 struct PointLight {
     vec3 position;
-
     float constant;
-    float linear;
-    float quadratic;
-
     vec3 ambient;
+    float linear;
     vec3 diffuse;
+    float quadratic;
     vec3 specular;
 };
 
 struct SpotLight {
     vec3 position;
-    vec3 direction;
-    float cutOff;
-    float outerCutOff;
-
     float constant;
+    vec3 direction;
     float linear;
-    float quadratic;
-
     vec3 ambient;
+    float quadratic;
     vec3 diffuse;
+    float cutOff;
     vec3 specular;
+    float outerCutOff;
 };
 
-struct FogParams
-{
-	vec3 color;
-	float start;
-	float end;
-    bool on;
-};
-
-#define NR_POINT_LIGHTS 4
-
 in vec3 v_normal;
 in vec3 frag_pos;
 in vec3 v_color;
 in vec2 v_texture;
 in vec4 eyeSpacePosition;
 
-uniform vec3 viewPos;
 uniform Material material;
-uniform DirLight dirLight;
-uniform PointLight pointLights[NR_POINT_LIGHTS];
-uniform SpotLight spotLight;
-uniform FogParams fogParams;
 
-uniform sampler2D s_texture;
+layout(std140) uniform Matrices
+{
+    mat4 projection;
+    mat4 view;
+    vec3 viewPos;
+};
+
+layout(std140) uniform Lights
+{
+    DirLight dirLight;
+    SpotLight spotLight;
+};
+
+#ifdef TEXTURED
+uniform sampler2DArray s_texture;  // Layers of same-size textures, see texture.py
+uniform int textureLayer;          // Layer of the material's texture
+#endif
 
-vec3 CalcDirLight(DirLight light, vec3 normal, vec3 viewDir, vec4 texel);
+layout(std140) uniform Clusters
+{
+    uvec4 gridSize;    // x tiles, y tiles, depth slices, w = point light count
+    vec4 depthParams;  // slice = log(depth) * x + y
+    vec4 viewport;     // x, y, width, height
+};
+
+uniform samplerBuffer pointLightData;  // 4 texels per light, see PointLight.pack()
+uniform usamplerBuffer clusterGrid;    // (offset, count) into clusterLights
+uniform usamplerBuffer clusterLights;  // Light indices grouped by cluster
+
+layout(std140) uniform Shadows
+{
+    mat4 cascadeMatrices[SHADOW_CASCADES];  // World to shadow map texture space, see shadows.py
+    mat4 spotShadowMatrix;
+    vec4 cascadeSplits;   // View depth where every cascade ends
+    vec4 cascadeOffsets;  // Normal offset of every cascade in world units
+    vec4 shadowParams;    // x = spotlight normal offset per unit of distance
+};
+
+uniform sampler2DArrayShadow dirShadowMap;   // Directional light cascades
+uniform sampler2DArrayShadow spotShadowMap;  // Spotlight, single layer
+
+vec3 CalcDirLight(DirLight light, vec3 normal, vec3 viewDir, vec4 texel, float shadow);
 vec3 CalcPointLight(PointLight light, vec3 normal, vec3 fragPos, vec3 viewDir);
-vec3 CalcSpotLight(SpotLight light, vec3 normal, vec3 fragPos, vec3 viewDir);
-float getFogFactor(FogParams params, float fogCoordinate);
+vec3 CalcSpotLight(SpotLight light, vec3 normal, vec3 fragPos, vec3 viewDir, float shadow);
+float DirShadow(vec3 fragPos, vec3 normal, float viewDepth);
+float SpotShadow(vec3 fragPos, vec3 normal);
+PointLight fetchPointLight(int index);
+int clusterIndex(vec2 fragCoord, float viewDepth);
 
 void main()
 {
     vec3 norm = normalize(v_normal);
     vec3 viewDir = normalize(viewPos - frag_pos);
-    vec4 texel = texture(s_texture, v_texture);
+#ifdef TEXTURED
+    vec4 texel = texture(s_texture, vec3(v_texture, textureLayer));
+#else
+    vec4 texel = vec4(1.0);  // Untextured material, or its texture is still loading
+#endif
 
     // Directional light
-    vec3 result = CalcDirLight(dirLight, norm, viewDir, texel);
+    vec3 result = CalcDirLight(dirLight, norm, viewDir, texel, DirShadow(frag_pos, norm, -eyeSpacePosition.z));
 
-    // Point lights
-    for(int i = 0; i < NR_POINT_LIGHTS; i++)
-        result += CalcPointLight(pointLights[i], norm, frag_pos, viewDir) * texel.rgb;
-
-    // Spot light
-    result += CalcSpotLight(spotLight, norm, frag_pos, viewDir) * texel.rgb;
-
-    // Apply fog
-    if (fogParams.on)
+    // Point lights, only those assigned to fragment's cluster
+    uvec2 cluster = texelFetch(clusterGrid, clusterIndex(gl_FragCoord.xy, -eyeSpacePosition.z)).xy;
+    for(uint i = 0u; i < cluster.y; i++)
     {
-        float fogCoordinate = abs(eyeSpacePosition.z / eyeSpacePosition.w);
-        result = mix(result, fogParams.color, getFogFactor(fogParams, fogCoordinate));
+        int lightIndex = int(texelFetch(clusterLights, int(cluster.x + i)).r);
+        result += CalcPointLight(fetchPointLight(lightIndex), norm, frag_pos, viewDir) * texel.rgb;
     }
 
+    // Spot light
+    result += CalcSpotLight(spotLight, norm, frag_pos, viewDir, SpotShadow(frag_pos, norm)) * texel.rgb;
+
     FragColor = vec4(result, texel.a);
 }
 
-vec3 CalcDirLight(DirLight light, vec3 normal, vec3 viewDir, vec4 texel)
+vec3 CalcDirLight(DirLight light, vec3 normal, vec3 viewDir, vec4 texel, float shadow)
 {
     vec3 lightDir = normalize(-light.direction);
     // diffuse shading
@@ -112,7 +137,7 @@ vec3 CalcDirLight(DirLight light, vec3 normal, vec3 viewDir, vec4 texel)
     vec3 diffuse = light.diffuse * diff * material.diffuse;
     vec3 specular = light.specular * spec * material.specular;
 
-    return (ambient + diffuse + specular) * texel.rgb;
+    return (ambient + shadow * (diffuse + specular)) * texel.rgb;
 }
 
 vec3 CalcPointLight(PointLight light, vec3 normal, vec3 fragPos, vec3 viewDir)
@@ -137,7 +162,7 @@ vec3 CalcPointLight(PointLight light, vec3 normal, vec3 fragPos, vec3 viewDir)
     return (ambient + diffuse + specular);
 }
 
-vec3 CalcSpotLight(SpotLight light, vec3 normal, vec3 fragPos, vec3 viewDir)
+vec3 CalcSpotLight(SpotLight light, vec3 normal, vec3 fragPos, vec3 viewDir, float shadow)
 {
     vec3 lightDir = normalize(light.position - fragPos);
     // diffuse shading
@@ -163,14 +188,90 @@ vec3 CalcSpotLight(SpotLight light, vec3 normal, vec3 fragPos, vec3 viewDir)
     ambient  *= intensity;
     diffuse  *= intensity;
     specular *= intensity;
+    // shadow blocks direct light only
+    diffuse  *= shadow;
+    specular *= shadow;
 
     return (ambient + diffuse + specular);
 }
 
-float getFogFactor(FogParams params, float fogCoordinate)
+float SampleShadow(sampler2DArrayShadow map, int layer, vec3 coords)
+{
+    // PCF over 3x3 texels: 4 taps half a texel apart, each a bilinear filtered depth comparison of 2x2 texels
+    vec2 texelSize = 0.5 / vec2(textureSize(map, 0).xy);
+    float depth = min(coords.z, 1.0);
+    float lit = texture(map, vec4(coords.xy + vec2(-texelSize.x, -texelSize.y), layer, depth));
+    lit += texture(map, vec4(coords.xy + vec2(texelSize.x, -texelSize.y), layer, depth));
+    lit += texture(map, vec4(coords.xy + vec2(-texelSize.x, texelSize.y), layer, depth));
+    lit += texture(map, vec4(coords.xy + vec2(texelSize.x, texelSize.y), layer, depth));
+    return lit / 4.0;
+}
+
+float DirShadow(vec3 fragPos, vec3 normal, float viewDepth)
 {
-    float fogLength = params.end - params.start;
-    float result = (params.end - fogCoordinate) / fogLength;
+#ifndef SHADOWS
+    return 1.0;
+#else
+    // Surfaces facing away get no direct light anyway
+    if (viewDepth > cascadeSplits[SHADOW_CASCADES - 1] || dot(normal, dirLight.direction) >= 0.0)
+        return 1.0;
+    int cascade = 0;
+    while (cascade < SHADOW_CASCADES - 1 && viewDepth > cascadeSplits[cascade])
+        cascade++;
+    vec3 coords;
+    for (;; cascade++)
+    {
+        // Offset along the normal against self-shadowing, by about a texel of the cascade
+        vec4 shadowPos = cascadeMatrices[cascade] * vec4(fragPos + normal * cascadeOffsets[cascade], 1.0);
+        coords = shadowPos.xyz / shadowPos.w;
+        // Cascades are fitted to the main view, fragments of other views may lie outside, then wider ones are tried
+        if (cascade == SHADOW_CASCADES - 1 || all(equal(clamp(coords.xy, 0.0, 1.0), coords.xy)))
+            break;
+    }
+    return SampleShadow(dirShadowMap, cascade, coords);
+#endif
+}
 
-	return 1.0 - clamp(result, 0.0, 1.0);;
+float SpotShadow(vec3 fragPos, vec3 normal)
+{
+#ifndef SHADOWS
+    return 1.0;
+#else
+    vec3 lightDir = normalize(spotLight.position - fragPos);
+    // Outside of the cone or facing away, there is no direct light to block
+    if (dot(lightDir, normalize(-spotLight.direction)) < spotLight.outerCutOff || dot(normal, lightDir) <= 0.0)
+        return 1.0;
+    // Texels grow with distance from the light, w is that distance along the light's axis
+    float distance = (spotShadowMatrix * vec4(fragPos, 1.0)).w;
+    if (distance <= 0.0)
+        return 1.0;
+    vec4 coords = spotShadowMatrix * vec4(fragPos + normal * shadowParams.x * distance, 1.0);
+    return SampleShadow(spotShadowMap, 0, coords.xyz / coords.w);
+#endif
+}
+
+PointLight fetchPointLight(int index)
+{
+    vec4 t0 = texelFetch(pointLightData, index * 4);
+    vec4 t1 = texelFetch(pointLightData, index * 4 + 1);
+    vec4 t2 = texelFetch(pointLightData, index * 4 + 2);
+    vec4 t3 = texelFetch(pointLightData, index * 4 + 3);
+
+    PointLight light;
+    light.position = t0.xyz;
+    light.constant = t0.w;
+    light.ambient = t1.xyz;
+    light.linear = t1.w;
+    light.diffuse = t2.xyz;
+    light.quadratic = t2.w;
+    light.specular = t3.xyz;
+    return light;
+}
+
+int clusterIndex(vec2 fragCoord, float viewDepth)
+{
+    vec2 screenPos = clamp((fragCoord - viewport.xy) / viewport.zw, 0.0, 0.9999);
+    uvec2 tile = uvec2(screenPos * vec2(gridSize.xy));
+    uint slice = uint(clamp(log(viewDepth) * depthParams.x + depthParams.y, 0.0, float(gridSize.z - 1u)));
+    return int(tile.x + gridSize.x * (tile.y + gridSize.y * slice));
 }
\ No newline at end of file
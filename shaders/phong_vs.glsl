@@ -4,6 +4,10 @@ layout(location = 0) in vec3 a_pos;
 layout(location = 1) in vec2 a_texture;
 layout(location = 2) in vec3 a_color;
 layout(location = 3) in vec3 a_normal;
+#ifdef INSTANCED
+layout(location = 4) in uint a_instance;  // Per-instance index into instanceMatrices
+uniform samplerBuffer instanceMatrices;  // 7 texels per instance: model matrix, then normal matrix (xyz)
+#endif
 
 out vec3 frag_pos;
 out vec3 v_normal;
@@ -11,17 +15,35 @@ out vec3 v_color;
 out vec2 v_texture;
 out vec4 eyeSpacePosition;
 
+#ifndef INSTANCED
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
+uniform mat3 normalMatrix;  // Inverse transpose of model, computed on the CPU once per object
+#endif
+
+layout(std140) uniform Matrices
+{
+    mat4 projection;
+    mat4 view;
+    vec3 viewPos;
+};
 
 void main()
 {
-    frag_pos = vec3(model * vec4(a_pos, 1.0));
-    v_normal = mat3(transpose(inverse(model))) * a_normal;
+#ifdef INSTANCED
+    int base = int(a_instance) * 7;
+    mat4 m = mat4(texelFetch(instanceMatrices, base), texelFetch(instanceMatrices, base + 1),
+                  texelFetch(instanceMatrices, base + 2), texelFetch(instanceMatrices, base + 3));
+    mat3 n = mat3(texelFetch(instanceMatrices, base + 4).xyz, texelFetch(instanceMatrices, base + 5).xyz,
+                  texelFetch(instanceMatrices, base + 6).xyz);
+#else
+    mat4 m = model;
+    mat3 n = normalMatrix;
+#endif
+    frag_pos = vec3(m * vec4(a_pos, 1.0));
+    v_normal = n * a_normal;
     v_texture = a_texture;
     v_color = a_color; // TODO: remove?
 
     eyeSpacePosition = view * vec4(frag_pos, 1.0);
-    gl_Position = projection * view * model * vec4(a_pos, 1.0);
+    gl_Position = projection * view * vec4(frag_pos, 1.0);
 }
\ No newline at end of file
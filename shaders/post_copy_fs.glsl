@@ -0,0 +1,12 @@
+#version 330 core
+out vec4 FragColor;
+
+in vec2 v_texture;
+
+uniform sampler2D postImage;
+uniform vec2 uvMax;  // Center of the last texel holding the image, bilinear taps stay inside it
+
+void main()
+{
+    FragColor = texture(postImage, min(v_texture, uvMax));
+}
@@ -0,0 +1,34 @@
+#version 330 core
+out vec4 FragColor;
+
+struct FogParams
+{
+	vec3 color;
+	float start;
+	float end;
+};
+
+in vec2 v_texture;
+
+layout(std140) uniform Fog
+{
+    FogParams fogParams;
+};
+
+uniform sampler2D postImage;
+uniform sampler2D postDepth;  // Depth buffer of the scene
+uniform vec2 uvMax;           // Center of the last texel holding the image, bilinear taps stay inside it
+uniform vec2 depthRange;      // Camera near and far plane distances
+
+void main()
+{
+    vec2 uv = min(v_texture, uvMax);
+    vec4 color = texture(postImage, uv);
+    // View depth from the depth buffer of a perspective projection, the background is at the far plane
+    float near = depthRange.x, far = depthRange.y;
+    float ndcDepth = texture(postDepth, uv).r * 2.0 - 1.0;
+    float viewDepth = 2.0 * near * far / (far + near - ndcDepth * (far - near));
+
+    float fog = 1.0 - clamp((fogParams.end - viewDepth) / (fogParams.end - fogParams.start), 0.0, 1.0);
+    FragColor = vec4(mix(color.rgb, fogParams.color, fog), color.a);
+}
@@ -0,0 +1,41 @@
+#version 330 core
+out vec4 FragColor;
+
+in vec2 v_texture;
+
+uniform sampler2D postImage;  // Tonemapped image
+uniform vec2 uvMax;           // Center of the last texel holding the image, bilinear taps stay inside it
+uniform vec2 texelSize;       // 1 / input texture size
+
+const float FXAA_REDUCE_MIN = 1.0 / 128.0;
+const float FXAA_REDUCE_MUL = 1.0 / 8.0;
+const float FXAA_SPAN_MAX = 8.0;
+const vec3 LUMA = vec3(0.299, 0.587, 0.114);
+
+vec3 Fetch(vec2 uv)
+{
+    return texture(postImage, min(uv, uvMax)).rgb;
+}
+
+void main()
+{
+    // FXAA (Lottes): blur along the edge direction estimated from the luma of diagonal neighbours
+    vec3 rgbM = Fetch(v_texture);
+    float lumaNW = dot(Fetch(v_texture + vec2(-1.0, -1.0) * texelSize), LUMA);
+    float lumaNE = dot(Fetch(v_texture + vec2(1.0, -1.0) * texelSize), LUMA);
+    float lumaSW = dot(Fetch(v_texture + vec2(-1.0, 1.0) * texelSize), LUMA);
+    float lumaSE = dot(Fetch(v_texture + vec2(1.0, 1.0) * texelSize), LUMA);
+    float lumaM = dot(rgbM, LUMA);
+    float lumaMin = min(lumaM, min(min(lumaNW, lumaNE), min(lumaSW, lumaSE)));
+    float lumaMax = max(lumaM, max(max(lumaNW, lumaNE), max(lumaSW, lumaSE)));
+
+    vec2 dir = vec2(-((lumaNW + lumaNE) - (lumaSW + lumaSE)), (lumaNW + lumaSW) - (lumaNE + lumaSE));
+    float dirReduce = max((lumaNW + lumaNE + lumaSW + lumaSE) * 0.25 * FXAA_REDUCE_MUL, FXAA_REDUCE_MIN);
+    float rcpDirMin = 1.0 / (min(abs(dir.x), abs(dir.y)) + dirReduce);
+    dir = clamp(dir * rcpDirMin, -FXAA_SPAN_MAX, FXAA_SPAN_MAX) * texelSize;
+
+    vec3 rgbA = 0.5 * (Fetch(v_texture + dir * (1.0 / 3.0 - 0.5)) + Fetch(v_texture + dir * (2.0 / 3.0 - 0.5)));
+    vec3 rgbB = rgbA * 0.5 + 0.25 * (Fetch(v_texture - dir * 0.5) + Fetch(v_texture + dir * 0.5));
+    float lumaB = dot(rgbB, LUMA);
+    FragColor = vec4(lumaB < lumaMin || lumaB > lumaMax ? rgbA : rgbB, 1.0);
+}
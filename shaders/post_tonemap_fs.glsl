@@ -0,0 +1,20 @@
+#version 330 core
+out vec4 FragColor;
+
+in vec2 v_texture;
+
+uniform sampler2D postImage;
+uniform vec2 uvMax;     // Center of the last texel holding the image, bilinear taps stay inside it
+uniform float exposure;
+
+// Fitted ACES filmic curve (Narkowicz), maps HDR color to [0, 1]
+vec3 ACESFilm(vec3 x)
+{
+    return clamp(x * (2.51 * x + 0.03) / (x * (2.43 * x + 0.59) + 0.14), 0.0, 1.0);
+}
+
+void main()
+{
+    vec3 color = texture(postImage, min(v_texture, uvMax)).rgb;
+    FragColor = vec4(ACESFilm(color * exposure), 1.0);
+}
@@ -0,0 +1,13 @@
+#version 330 core
+
+out vec2 v_texture;
+
+uniform vec2 uvScale;  // Part of the input textures holding the image, render size / texture size
+
+void main()
+{
+    // Full screen triangle, no vertex buffers needed
+    vec2 pos = vec2((gl_VertexID << 1) & 2, gl_VertexID & 2);
+    v_texture = pos * uvScale;
+    gl_Position = vec4(pos * 2.0 - 1.0, 0.0, 1.0);
+}
@@ -0,0 +1,6 @@
+#version 330 core
+
+void main()
+{
+    // Depth only, shadow maps have no color attachment
+}
@@ -0,0 +1,23 @@
+#version 330 core
+
+layout(location = 0) in vec3 a_pos;
+#ifdef INSTANCED
+layout(location = 4) in uint a_instance;  // Per-instance index into instanceMatrices
+uniform samplerBuffer instanceMatrices;  // 7 texels per instance, the model matrix comes first
+#else
+uniform mat4 model;
+#endif
+
+uniform mat4 lightMatrix;  // Light view projection
+
+void main()
+{
+#ifdef INSTANCED
+    int base = int(a_instance) * 7;
+    mat4 model = mat4(texelFetch(instanceMatrices, base), texelFetch(instanceMatrices, base + 1),
+                      texelFetch(instanceMatrices, base + 2), texelFetch(instanceMatrices, base + 3));
+    gl_Position = lightMatrix * model * vec4(a_pos, 1.0);
+#else
+    gl_Position = lightMatrix * model * vec4(a_pos, 1.0);
+#endif
+}
@@ -0,0 +1,260 @@
+import math
+
+import numpy as np
+from OpenGL.GL import *
+from pyrr import matrix44 as m44, Vector3 as v3
+
+from profiler import counters
+
+# Maps clip space [-1, 1] to shadow map texture coordinates and depth [0, 1]
+_TEXTURE_SPACE = np.array([[0.5, 0.0, 0.0, 0.0],
+                           [0.0, 0.5, 0.0, 0.0],
+                           [0.0, 0.0, 0.5, 0.0],
+                           [0.5, 0.5, 0.5, 1.0]])
+
+
+def frustum_slice_sphere(view: np.ndarray, projection: np.ndarray, near: float, far: float) -> tuple:
+    """
+    Sphere around the part of a perspective view frustum between two view depths.
+
+    :param view: View matrix (pyrr layout, row vectors).
+    :param projection: Perspective projection matrix (pyrr layout).
+    :param near: View depth where the slice starts.
+    :param far: View depth where the slice ends.
+    :return: World (center, radius).
+    """
+    # Half extents of the view rectangle at depth d are d / projection[0, 0] and d / projection[1, 1]
+    tx, ty = 1 / projection[0, 0], 1 / projection[1, 1]
+    corners = np.array([[x * tx * d, y * ty * d, -d, 1.0] for d in (near, far) for x in (-1, 1) for y in (-1, 1)])
+    corners = (corners @ np.linalg.inv(np.asarray(view, dtype=np.float64)))[:, :3]
+    center = corners.mean(axis=0)
+    return center, float(np.linalg.norm(corners - center, axis=1).max())
+
+
+def up_vector(direction) -> v3:
+    """Up vector for a look-at matrix, not parallel to given direction."""
+    vertical = abs(direction[1]) > 0.99 * np.linalg.norm(direction)
+    return v3([1.0, 0.0, 0.0]) if vertical else v3([0.0, 1.0, 0.0])
+
+
+class ShadowMap:
+    def __init__(self, size: int, layers: int, name: str):
+        """Layers of a depth texture array rendered from a light, sampled with hardware depth comparison.
+
+        Once a layer's light matrix stays the same for two frames, static casters are rendered into a
+        separate cached texture, again only after the matrix changes or the cache is invalidated. Every
+        frame the cached depth is copied into the sampled texture and dynamic casters are drawn on top of
+        it. Layers of a moving light are rendered in one pass with all casters.
+
+        :param size: Width and height of every layer in texels.
+        :param layers: Number of layers (e.g. cascades).
+        :param name: Map name, passed to caster drawing with the layer index.
+        """
+        self.size, self.layers, self.name = size, layers, name
+        self.texture: int = self._depth_texture(compare=True)  # All casters, sampled by shaders
+        self._static: int = self._depth_texture(compare=False)  # Static casters only
+        self._draw_fbo, self._read_fbo = glGenFramebuffers(2)
+        for fbo in (self._draw_fbo, self._read_fbo):
+            glBindFramebuffer(GL_FRAMEBUFFER, fbo)
+            glDrawBuffer(GL_NONE)  # Depth only
+            glReadBuffer(GL_NONE)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        self._keys = [None] * layers  # Light matrix of every layer in the last frame
+        self._static_keys = [None] * layers  # Light matrix the static casters of every layer were rendered with
+        self.matrices = np.zeros((layers, 4, 4), dtype=np.float32)  # World to texture space of every layer
+
+    def _depth_texture(self, compare: bool) -> int:
+        texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, texture)
+        glTexImage3D(GL_TEXTURE_2D_ARRAY, 0, GL_DEPTH_COMPONENT24, self.size, self.size, self.layers, 0,
+                     GL_DEPTH_COMPONENT, GL_FLOAT, None)
+        # Linear filtering of comparison results gives bilinear PCF for free
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_LINEAR if compare else GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_LINEAR if compare else GL_NEAREST)
+        # Outside of the map is lit
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_BORDER)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_BORDER)
+        glTexParameterfv(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_BORDER_COLOR, [1.0, 1.0, 1.0, 1.0])
+        if compare:
+            glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_COMPARE_MODE, GL_COMPARE_REF_TO_TEXTURE)
+            glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_COMPARE_FUNC, GL_LEQUAL)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, 0)
+        return texture
+
+    def invalidate(self) -> None:
+        """Schedules static casters of every layer to be rendered again."""
+        self._static_keys = [None] * self.layers
+
+    def render(self, layer: int, view: np.ndarray, projection: np.ndarray, draw_casters) -> None:
+        """
+        Renders one layer. The viewport must be set to the map size.
+
+        :param layer: Layer index.
+        :param view: Light view matrix.
+        :param projection: Light projection matrix.
+        :param draw_casters: Called with (view, projection, static, (name, layer)) to draw static (True),
+            dynamic (False) or all (None) shadow casters.
+        """
+        self.matrices[layer] = view @ projection @ _TEXTURE_SPACE
+        key = np.asarray(view @ projection, dtype=np.float32).tobytes()
+        if key != self._keys[layer]:
+            # The light moved since the last frame and may keep moving, caching static casters would not pay off
+            self._keys[layer], self._static_keys[layer] = key, None
+            self._attach(self._draw_fbo, self.texture, layer)
+            glClear(GL_DEPTH_BUFFER_BIT)
+            draw_casters(view, projection, None, (self.name, layer))
+            return
+
+        if key != self._static_keys[layer]:
+            self._attach(self._draw_fbo, self._static, layer)
+            glClear(GL_DEPTH_BUFFER_BIT)
+            draw_casters(view, projection, True, (self.name, layer))
+            self._static_keys[layer] = key
+        self._attach(self._read_fbo, self._static, layer)
+        self._attach(self._draw_fbo, self.texture, layer)
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self._read_fbo)
+        glBlitFramebuffer(0, 0, self.size, self.size, 0, 0, self.size, self.size, GL_DEPTH_BUFFER_BIT, GL_NEAREST)
+        counters.state_changes += 2  # Framebuffer binds
+        draw_casters(view, projection, False, (self.name, layer))
+
+    def _attach(self, fbo: int, texture: int, layer: int) -> None:
+        glBindFramebuffer(GL_FRAMEBUFFER, fbo)
+        glFramebufferTextureLayer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, texture, 0, layer)
+
+    def bind(self, unit: int) -> None:
+        glActiveTexture(GL_TEXTURE0 + unit)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self.texture)
+        glActiveTexture(GL_TEXTURE0)
+
+    def release(self) -> None:
+        glDeleteFramebuffers(2, [self._draw_fbo, self._read_fbo])
+        glDeleteTextures([self.texture, self._static])
+
+
+class Shadows:
+    # Number of directional light cascades, SHADOW_CASCADES in shaders
+    cascade_count: int = 3
+    # Blend between logarithmic (1) and uniform (0) cascade split distances
+    split_lambda: float = 0.75
+    # Cascades cover spheres this much larger than their frustum slice, so the camera can move a bit
+    # before a cascade has to be refit (and its static casters re-rendered)
+    padding: float = 1.25
+    # Normal offset of shadow lookups, in shadow map texels
+    normal_offset: float = 1.5
+
+    def __init__(self, size: int = 1024, spot_size: int = 1024, distance: float = 40.0):
+        """Shadow maps of the directional light (cascaded, fitted to the camera frustum) and the spotlight.
+
+        Cascades keep their light matrix while their part of the view frustum stays inside the sphere
+        they cover, and are snapped to texels when refit, so a still camera never re-renders static casters.
+
+        :param size: Size of every directional light cascade in texels.
+        :param spot_size: Size of the spotlight shadow map in texels.
+        :param distance: View depth up to which the directional light casts shadows.
+        """
+        self.enabled: bool = True
+        self.distance = distance
+        self.cascades = ShadowMap(size, self.cascade_count, "cascades")
+        self.spot = ShadowMap(spot_size, 1, "spot")
+        self._spheres = [None] * self.cascade_count  # World (center, radius) covered by every cascade
+        self._depth_range = None  # Light space depth range of casters, (near, far)
+        self._splits = np.zeros(self.cascade_count)  # View depth where every cascade ends
+        self._spot_offset = 0.0
+
+    def invalidate_static(self) -> None:
+        """Schedules static casters to be rendered again, e.g. after objects were loaded or started moving."""
+        self.cascades.invalidate()
+        self.spot.invalidate()
+
+    def _split_depths(self, near: float, far: float) -> np.ndarray:
+        """Practical split scheme: blend of logarithmic and uniform split distances."""
+        i = np.arange(1, self.cascade_count + 1) / self.cascade_count
+        return self.split_lambda * near * (far / near) ** i + (1 - self.split_lambda) * (near + (far - near) * i)
+
+    def _fit_cascades(self, view, projection, near: float, far: float, direction: v3, scene_bounds) -> list:
+        """Light (view, projection) of every cascade, refitting cascades whose frustum slice left their sphere."""
+        far = min(far, self.distance)
+        self._splits = self._split_depths(near, far)
+        rotation = m44.create_look_at(v3([0.0, 0.0, 0.0]), direction, up_vector(direction))
+
+        # Depth range covers all casters, rounded outwards so small movements keep the matrices
+        corners = np.array([[x, y, z, 1.0] for x in scene_bounds[:, 0] for y in scene_bounds[:, 1]
+                            for z in scene_bounds[:, 2]]) @ rotation
+        depth = math.floor(-corners[:, 2].max()) - 1, math.ceil(-corners[:, 2].min()) + 1
+        if self._depth_range is None or depth[0] < self._depth_range[0] or depth[1] > self._depth_range[1]:
+            self._depth_range = depth
+
+        matrices = []
+        start = near
+        for cascade, end in enumerate(self._splits):
+            center, radius = frustum_slice_sphere(view, projection, start, end)
+            sphere = self._spheres[cascade]
+            if (sphere is None or np.linalg.norm(center - sphere[0]) + radius > sphere[1]
+                    or radius * self.padding ** 2 < sphere[1]):
+                radius *= self.padding
+                # Snap the center to whole texels, so shadow edges do not shimmer when a cascade is refit
+                texel = 2 * radius / self.cascades.size
+                light_center = np.append(center, 1.0) @ rotation
+                light_center[:2] = np.floor(light_center[:2] / texel) * texel
+                self._spheres[cascade] = sphere = ((light_center @ np.linalg.inv(rotation))[:3], radius)
+            center, radius = sphere
+            light_center = (np.append(center, 1.0) @ rotation)[:3]
+            light_view = m44.multiply(rotation, m44.create_from_translation([-light_center[0], -light_center[1], 0]))
+            light_projection = m44.create_orthogonal_projection(-radius, radius, -radius, radius, *self._depth_range)
+            matrices.append((light_view, light_projection))
+            start = end
+        return matrices
+
+    def update(self, view, projection, near: float, far: float, direction: v3, spot_frustum: tuple,
+               scene_bounds: np.ndarray, draw_casters) -> None:
+        """
+        Renders shadow maps, re-rendering static casters only where the light matrix changed.
+
+        :param view: Camera view matrix.
+        :param projection: Camera projection matrix.
+        :param near: Camera near plane distance.
+        :param far: Camera far plane distance.
+        :param direction: Directional light direction.
+        :param spot_frustum: Spotlight (view, projection), see `SpotLight.frustum`.
+        :param scene_bounds: World AABB of all casters as [min corner, max corner].
+        :param draw_casters: Called with (view, projection, static, layer) to draw static, dynamic or all casters
+            intersecting given light frustum (see `ShadowMap.render`).
+        """
+        if not self.enabled:
+            return
+        glViewport(0, 0, self.cascades.size, self.cascades.size)
+        for cascade, (light_view, light_projection) in enumerate(
+                self._fit_cascades(view, projection, near, far, direction, scene_bounds)):
+            self.cascades.render(cascade, light_view, light_projection, draw_casters)
+        glViewport(0, 0, self.spot.size, self.spot.size)
+        self.spot.render(0, *spot_frustum, draw_casters)
+        # A spotlight texel covers 2 * tan(fov / 2) / size world units per unit of distance
+        self._spot_offset = self.normal_offset * 2 / (spot_frustum[1][1, 1] * self.spot.size)
+
+    def pack(self) -> np.ndarray:
+        """
+        std140 `Shadows` block: mat4 cascadeMatrices[3], mat4 spotShadowMatrix, vec4 cascadeSplits,
+        vec4 cascadeOffsets (normal offset of every cascade), vec4 shadowParams (spotlight normal offset).
+        """
+        texels = np.array([sphere[1] if sphere is not None else 0.0 for sphere in self._spheres])
+        texels *= 2 / self.cascades.size
+        data = np.zeros(76, dtype=np.float32)
+        data[0:48] = np.ravel(self.cascades.matrices)
+        data[48:64] = np.ravel(self.spot.matrices[0])
+        data[64:64 + self.cascade_count] = self._splits
+        data[68:68 + self.cascade_count] = texels * self.normal_offset
+        data[72] = self._spot_offset
+        return data
+
+    def bind(self, units: dict) -> None:
+        """
+        Binds shadow maps for sampling.
+
+        :param units: Sampler name -> texture unit.
+        """
+        self.cascades.bind(units["dirShadowMap"])
+        self.spot.bind(units["spotShadowMap"])
+
+    def release(self) -> None:
+        self.cascades.release()
+        self.spot.release()
@@ -0,0 +1,210 @@
+import math
+
+import numpy as np
+from PIL import Image
+from OpenGL.GL import *
+from OpenGL.GL.EXT.texture_compression_s3tc import GL_COMPRESSED_RGB_S3TC_DXT1_EXT, GL_COMPRESSED_RGBA_S3TC_DXT5_EXT
+# The wrapped version fails to query the image size, the raw one fills a given buffer
+from OpenGL.raw.GL.VERSION.GL_1_3 import glGetCompressedTexImage as glGetCompressedTexImage_raw
+
+import texture_cache
+from profiler import counters
+from resources import SharedResource
+
+# Longest texture side, larger images are scaled down
+MAX_SIZE = 2048
+
+_extensions = None
+
+
+def has_extension(name: str) -> bool:
+    """Checks if the current OpenGL context supports given extension."""
+    global _extensions
+    if _extensions is None:
+        _extensions = {glGetStringi(GL_EXTENSIONS, i).decode() for i in range(glGetIntegerv(GL_NUM_EXTENSIONS))}
+    return name in _extensions
+
+
+def _power_of_two(size: int) -> int:
+    """Nearest power of two, so every mip level halves exactly and sizes are multiples of compression blocks."""
+    return min(1 << max(round(math.log2(size)), 0), MAX_SIZE)
+
+
+class TextureArray:
+    # Layers allocated at once, another array is started when one is full
+    capacity: int = 16
+    # Arrays by (width, height, internal format, mip levels)
+    _arrays: dict = {}
+    # Array bound to the current texture unit, to skip redundant binds
+    _bound: int = 0
+
+    def __init__(self, width: int, height: int, internal_format: int, levels: int, anisotropy: float):
+        """`GL_TEXTURE_2D_ARRAY` holding same-size textures as layers. Use `TextureArray.allocate` to get a layer.
+
+        Materials pick their layer with a uniform, so meshes whose textures share an array draw without
+        texture binds in between.
+
+        :param width: Layer width.
+        :param height: Layer height.
+        :param internal_format: GL internal format of all layers.
+        :param levels: Number of mip levels.
+        :param anisotropy: Maximum anisotropic filtering, clamped to what the driver supports (1 disables it).
+        """
+        self.width, self.height = width, height
+        self.internal_format = internal_format
+        self.levels = levels
+        self._free = list(range(self.capacity))
+        self.id: int = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self.id)
+        TextureArray._bound = self.id
+        for level in range(levels):
+            glTexImage3D(GL_TEXTURE_2D_ARRAY, level, internal_format, max(width >> level, 1),
+                         max(height >> level, 1), self.capacity, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAX_LEVEL, levels - 1)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        if anisotropy > 1 and has_extension("GL_ARB_texture_filter_anisotropic"):
+            anisotropy = min(anisotropy, glGetFloatv(GL_MAX_TEXTURE_MAX_ANISOTROPY))
+            glTexParameterf(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAX_ANISOTROPY, anisotropy)
+
+    @classmethod
+    def allocate(cls, width: int, height: int, internal_format: int, levels: int, anisotropy: float = 1.0):
+        """
+        Finds a free layer in an array of given layout, creating the array if needed.
+
+        :return: (TextureArray, layer index).
+        """
+        arrays = cls._arrays.setdefault((width, height, internal_format, levels), [])
+        for array in arrays:
+            if array._free:
+                return array, array._free.pop(0)
+        array = cls(width, height, internal_format, levels, anisotropy)
+        arrays.append(array)
+        return array, array._free.pop(0)
+
+    def upload(self, layer: int, levels: list, compressed: bool) -> None:
+        """
+        Uploads mip levels of one texture into given layer.
+
+        :param layer: Layer index.
+        :param levels: Pixels of every mip level, largest first. Compressed blocks or RGBA bytes.
+        :param compressed: Whether levels hold compressed blocks in the array's internal format.
+        """
+        self.bind()
+        for level, data in enumerate(levels):
+            width, height = max(self.width >> level, 1), max(self.height >> level, 1)
+            if compressed:
+                glCompressedTexSubImage3D(GL_TEXTURE_2D_ARRAY, level, 0, 0, layer, width, height, 1,
+                                          self.internal_format, np.asarray(data))
+            else:
+                glTexSubImage3D(GL_TEXTURE_2D_ARRAY, level, 0, 0, layer, width, height, 1, GL_RGBA,
+                                GL_UNSIGNED_BYTE, bytes(data))
+
+    def bind(self) -> None:
+        """Binds the array, unless it is bound already."""
+        if TextureArray._bound != self.id:
+            glBindTexture(GL_TEXTURE_2D_ARRAY, self.id)
+            TextureArray._bound = self.id
+            counters.state_changes += 1
+
+    def free(self, layer: int) -> None:
+        """Returns a layer. Deletes the array once no layer is used."""
+        self._free.append(layer)
+        if len(self._free) < self.capacity:
+            return
+        self._arrays[(self.width, self.height, self.internal_format, self.levels)].remove(self)
+        glDeleteTextures([self.id])
+        if TextureArray._bound == self.id:
+            TextureArray._bound = 0
+        self.id = 0
+
+
+class Texture(SharedResource):
+    # Store textures block compressed (BC1 opaque, BC3 with alpha) if the driver supports it
+    compress: bool = True
+    # Maximum anisotropic filtering, for floors seen at grazing angles
+    anisotropy: float = 8.0
+
+    def __init__(self, key: str, loader=None):
+        """Mipmapped texture loaded from an image file. Use `Texture.acquire(path)` to share it between meshes.
+
+        The texture is a layer of a `TextureArray`, bind it with `array.bind()` and pass `layer` to the shader.
+        Images are scaled to power of two sizes. Compressed mip chains are cached on disk (see texture_cache.py).
+
+        :param key: Registry key (normalised path).
+        :param loader: AssetLoader to decode the image in the background. Until it is uploaded,
+            `array` is None and the texture should be drawn white.
+        """
+        super().__init__(key)
+        self.array: TextureArray = None
+        self.layer: int = -1
+        self._released: bool = False
+        if loader is None:
+            self._upload(self.decode(key))
+        else:
+            loader.submit(self.decode, self._upload, key)
+
+    @staticmethod
+    def decode(path: str) -> tuple:
+        """
+        Loads image by given path from texture cache or decodes it and builds its mip chain. Does not use OpenGL.
+
+        :param path: Texture path.
+        :return: (internal format, width, height, mip levels, compressed). Levels are compressed blocks if
+            `compressed`, otherwise RGBA bytes with the bottom row first to be compressed into the format.
+        """
+        cached = texture_cache.load(path)
+        if cached is not None:
+            return (*cached, True)
+
+        image = Image.open(path).convert("RGBA").transpose(Image.FLIP_TOP_BOTTOM)
+        size = tuple(_power_of_two(s) for s in image.size)
+        if size != image.size:
+            image = image.resize(size, Image.LANCZOS)
+        opaque = image.getextrema()[3][0] == 255
+        levels = [image.tobytes()]
+        while image.width > 1 or image.height > 1:
+            image = image.resize((max(image.width // 2, 1), max(image.height // 2, 1)), Image.BOX)
+            levels.append(image.tobytes())
+        internal_format = GL_COMPRESSED_RGB_S3TC_DXT1_EXT if opaque else GL_COMPRESSED_RGBA_S3TC_DXT5_EXT
+        return internal_format, size[0], size[1], levels, False
+
+    @staticmethod
+    def _compress(internal_format: int, width: int, height: int, levels: list) -> list:
+        """Compresses RGBA mip levels with the driver's encoder and reads the blocks back."""
+        texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, texture)
+        compressed = []
+        for level, data in enumerate(levels):
+            glTexImage2D(GL_TEXTURE_2D, level, internal_format, max(width >> level, 1), max(height >> level, 1), 0,
+                         GL_RGBA, GL_UNSIGNED_BYTE, data)
+            blocks = np.zeros(glGetTexLevelParameteriv(GL_TEXTURE_2D, level, GL_TEXTURE_COMPRESSED_IMAGE_SIZE),
+                              dtype=np.uint8)
+            glGetCompressedTexImage_raw(GL_TEXTURE_2D, level, blocks)
+            compressed.append(blocks)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glDeleteTextures([texture])
+        return compressed
+
+    def _upload(self, image: tuple) -> None:
+        """Uploads decoded image into a texture array layer, compressing (and caching) it first if needed."""
+        if self._released:
+            return  # Released before decoding finished
+        internal_format, width, height, levels, compressed = image
+        if not compressed:
+            if self.compress and has_extension("GL_EXT_texture_compression_s3tc"):
+                levels = self._compress(internal_format, width, height, levels)
+                texture_cache.store(self.key, internal_format, width, height, levels)
+                compressed = True
+            else:
+                internal_format = GL_RGBA8
+        self.array, self.layer = TextureArray.allocate(width, height, internal_format, len(levels), self.anisotropy)
+        self.array.upload(self.layer, levels, compressed)
+
+    def _delete(self) -> None:
+        self._released = True
+        if self.array is not None:
+            self.array.free(self.layer)
+        self.array, self.layer = None, -1
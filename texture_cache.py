@@ -0,0 +1,99 @@
+"""On-disk cache of block compressed textures.
+
+Compressing a texture (done by the driver, see `texture.py`) is slow, so the compressed mip chain
+is stored next to the mesh cache:
+
+    magic (8 bytes) | header length (uint32 LE) | JSON header | padding | mip level blobs
+
+The header lists the source image (invalidated like mesh cache sources), the GL internal format,
+the size of the top level and the offset and length of every mip level's blob. Blobs are aligned to
+`ALIGNMENT` bytes and loaded with `np.memmap`.
+"""
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from mesh_cache import source_info, is_fresh, rewrite_header
+
+CACHE_DIR = os.path.join(".cache", "textures")
+MAGIC = b"GKTEX001"
+ALIGNMENT = 64
+
+
+def cache_path(path: str) -> str:
+    """Cache file path for given source image."""
+    abs_path = os.path.abspath(path)
+    digest = hashlib.sha1(abs_path.encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"{os.path.basename(path)}-{digest}.tex")
+
+
+def load(path: str):
+    """
+    Loads cached compressed texture for given source image.
+
+    :param path: Source image path.
+    :return: (internal format, width, height, memory-mapped mip levels) or None if there is no valid cache.
+    """
+    file = cache_path(path)
+    try:
+        with open(file, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            (header_len,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_len).decode())
+        mtime = header["source"]["mtime_ns"]
+        if not is_fresh(header["source"]):
+            return None
+        if header["levels"] and mtime != header["source"]["mtime_ns"]:
+            rewrite_header(file, MAGIC, header, min(offset for offset, _ in header["levels"]))
+        levels = [np.memmap(file, dtype=np.uint8, mode="r", offset=offset, shape=(length,))
+                  for offset, length in header["levels"]]
+        return header["format"], header["width"], header["height"], levels
+    except (OSError, ValueError, KeyError, TypeError, struct.error):
+        return None
+
+
+def store(path: str, internal_format: int, width: int, height: int, levels: list) -> None:
+    """
+    Writes texture cache for given source image. Failures are ignored, the cache is only an optimisation.
+
+    :param path: Source image path.
+    :param internal_format: GL compressed internal format of the blobs.
+    :param width: Width of the top mip level.
+    :param height: Height of the top mip level.
+    :param levels: Compressed blob of every mip level, largest first.
+    """
+    try:
+        header = {"source": source_info(path), "format": int(internal_format), "width": width, "height": height}
+    except OSError:
+        return
+
+    # Offsets only grow the header by a few digits each, so reserve room for them up front.
+    offsets, offset = [], 0
+    for level in levels:
+        offsets.append(offset)
+        offset += -(-len(level) // ALIGNMENT) * ALIGNMENT
+    probe = json.dumps(dict(header, levels=[[o, len(level)] for o, level in zip(offsets, levels)]))
+    data_start = -(-(len(MAGIC) + 4 + len(probe) + 16 * len(levels)) // ALIGNMENT) * ALIGNMENT
+    header["levels"] = [[data_start + o, len(level)] for o, level in zip(offsets, levels)]
+    header_bytes = json.dumps(header).encode()
+    assert len(MAGIC) + 4 + len(header_bytes) <= data_start
+
+    file = cache_path(path)
+    tmp = f"{file}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<I", len(header_bytes)))
+            f.write(header_bytes)
+            for (level_offset, _), level in zip(header["levels"], levels):
+                f.write(b"\0" * (level_offset - f.tell()))
+                f.write(bytes(level))
+        os.replace(tmp, file)  # Atomic, readers never see a half written file
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
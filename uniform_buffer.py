@@ -0,0 +1,39 @@
+import numpy as np
+from OpenGL.GL import *
+
+
+class UniformBuffer:
+    # Uniform block name -> binding point, shared by all shader programs
+    bindings = {
+        "Matrices": 0,
+        "Lights": 1,
+        "Fog": 2,
+        "Clusters": 3,
+        "Shadows": 4,
+    }
+
+    def __init__(self, block_name: str, size: int):
+        """Uniform buffer object backing a std140 uniform block shared by all shaders.
+
+        :param block_name: Name of the uniform block in GLSL, see `UniformBuffer.bindings`.
+        :param size: Buffer size in bytes.
+        """
+        self.block_name = block_name
+        self.binding: int = self.bindings[block_name]
+        self.size: int = size
+        self._ubo = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self._ubo)
+        glBufferData(GL_UNIFORM_BUFFER, size, None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        glBindBufferBase(GL_UNIFORM_BUFFER, self.binding, self._ubo)
+
+    def update(self, data: np.ndarray, offset: int = 0) -> None:
+        """Uploads packed std140 data (one glBufferSubData call)."""
+        data = np.ascontiguousarray(data)
+        glBindBuffer(GL_UNIFORM_BUFFER, self._ubo)
+        glBufferSubData(GL_UNIFORM_BUFFER, offset, data.nbytes, data)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+    def release(self) -> None:
+        glDeleteBuffers(1, [self._ubo])
+        self._ubo = None
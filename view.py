@@ -0,0 +1,110 @@
+from OpenGL.GL import *
+from pyrr import matrix44 as m44, Vector3 as v3
+
+from clustered_lights import LightClusters
+from lod import LodSelector
+
+
+class RenderTarget:
+    def __init__(self, width: int, height: int):
+        """Framebuffer with a color texture and a depth buffer, for views rendered into a texture.
+
+        :param width: Width in pixels.
+        :param height: Height in pixels.
+        """
+        self.width, self.height = width, height
+        self.fbo = glGenFramebuffers(1)
+        self.texture = glGenTextures(1)
+        self._depth = glGenRenderbuffers(1)
+
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA16F, width, height, 0, GL_RGBA, GL_FLOAT, None)  # HDR, see PostProcess
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glBindRenderbuffer(GL_RENDERBUFFER, self._depth)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, width, height)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.texture, 0)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, self._depth)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise Exception("Render target is incomplete!")
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def release(self) -> None:
+        glDeleteFramebuffers(1, [self.fbo])
+        glDeleteTextures([self.texture])
+        glDeleteRenderbuffers(1, [self._depth])
+
+
+class View:
+    def __init__(self, camera: str, viewport: tuple = (0.0, 0.0, 1.0, 1.0), target: RenderTarget = None,
+                 interval: int = 1, fov: float = 45, near: float = 0.1, far: float = 100):
+        """One camera drawing the scene, into a viewport of the window or into its own render target.
+
+        Views of a frame share everything that does not depend on the camera (animation, light and fog uniforms,
+        shadow maps), and keep what does: matrices, light clusters, visible objects and levels of detail.
+
+        :param camera: Camera name, "static", "following" or "moving".
+        :param viewport: (x, y, width, height) of the window the view covers, as fractions of the window size.
+            Views with a render target fill the whole target, which is shown in the window here (None to not
+            show it, e.g. when the texture is used otherwise).
+        :param target: Render target the view is drawn into, None draws it into the window.
+        :param interval: The view is rendered every this many frames, e.g. for monitors that can lag behind.
+        :param fov: Vertical field of view in degrees.
+        :param near: Near plane distance.
+        :param far: Far plane distance.
+        """
+        self.camera: str = camera
+        self.viewport: tuple = viewport
+        self.target: RenderTarget = target
+        self.interval: int = interval
+        self.fov, self.near, self.far = fov, near, far
+        self.update_camera: bool = True  # Camera needs to be placed before the next frame
+        self.eye: v3 = None
+        self.center: v3 = None  # Point the camera looks at
+        self.up: v3 = v3([0, 1, 0])
+        self.view_matrix, self.projection_matrix = None, None
+        self.visible = None  # Visibility mask of scene objects, None draws everything
+        self.lods = None  # Level of detail of every scene object, None draws full detail
+        self.object_lods: LodSelector = None  # Set up when the view is added to a Window
+        self.light_lods: LodSelector = None
+        self.light_clusters: LightClusters = None
+        self._frames: int = 0
+
+    def rect(self, width: int, height: int) -> tuple:
+        """(x, y, width, height) in pixels of the framebuffer the view is drawn into, given the window size."""
+        if self.target is not None:
+            return 0, 0, self.target.width, self.target.height
+        return self.window_rect(width, height)
+
+    def window_rect(self, width: int, height: int) -> tuple:
+        """`viewport` in pixels of a window of given size, as (x, y, width, height)."""
+        x, y, w, h = self.viewport
+        x0, y0 = round(x * width), round(y * height)
+        return x0, y0, max(round((x + w) * width) - x0, 1), max(round((y + h) * height) - y0, 1)
+
+    def look_at(self, eye: v3, center: v3) -> None:
+        """Places the camera. The view matrix is uploaded with other per-view uniforms."""
+        self.eye, self.center = eye, center
+        self.view_matrix = m44.create_look_at(self.eye, self.center, self.up)
+
+    def update_projection(self, width: int, height: int) -> None:
+        """Recalculates the projection matrix for the aspect ratio of the view's rect, given the window size."""
+        _, _, w, h = self.rect(width, height)
+        self.projection_matrix = m44.create_perspective_projection(self.fov, w / h, self.near, self.far)
+
+    def due(self) -> bool:
+        """Whether the view is rendered this frame (see `interval`), counts frames."""
+        self._frames += 1
+        return (self._frames - 1) % self.interval == 0
+
+    def release(self) -> None:
+        if self.light_clusters is not None:
+            self.light_clusters.release()
+        if self.target is not None:
+            self.target.release()
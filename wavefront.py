@@ -0,0 +1,286 @@
+"""Reader of wavefront .obj and .mtl files.
+
+Geometry is parsed in bulk instead of line by line: lines are classified by their first bytes with NumPy,
+lines of a kind (`v`, `vt`, `vn`, `f`) are sliced out of the file in blocks, and all their numbers are
+converted by a single `np.fromstring` call. Faces are triangulated as fans and every material gets a
+float32 triangle soup interleaved in its vertex format (e.g. "T2F_N3F_V3F", see `Material.attr_format`).
+Only the few `mtllib` and `usemtl` lines are handled one by one.
+"""
+import os
+import re
+
+import numpy as np
+
+from material import Material
+
+_SPACE, _TAB, _NEWLINE, _SLASH = (ord(c) for c in " \t\n/")
+_SLASH_TO_SPACE = bytes.maketrans(b"/", b" ")
+
+
+def _material_params(name: str) -> dict:
+    """Parameters of a material missing from .mtl files (same defaults as the .mtl format)."""
+    return {"name": name, "ambient": [0.2] * 3, "diffuse": [0.8] * 3, "specular": [0.0] * 3, "shininess": 0.0,
+            "texture": None}
+
+
+def _color(values: list) -> list:
+    return [float(v) for v in values[:3]] + [0.0] * (3 - len(values[:3]))
+
+
+def parse_mtl(path: str) -> dict:
+    """
+    Parses material library. Statements other than colors, shininess and diffuse map are ignored.
+
+    :param path: Path of .mtl file.
+    :return: Material name -> parameters of `Material` (without vertex format), in order of definition.
+    """
+    base_dir = os.path.dirname(path)
+    materials, current = {}, None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            values = line.split()
+            if len(values) < 2 or values[0].startswith("#"):
+                continue
+            key = values[0]
+            if key == "newmtl":
+                current = materials[values[1]] = _material_params(values[1])
+            elif current is None:
+                continue
+            elif key in ("Ka", "Kd", "Ks"):
+                current[{"Ka": "ambient", "Kd": "diffuse", "Ks": "specular"}[key]] = _color(values[1:])
+            elif key == "Ns":
+                current["shininess"] = float(values[1])
+            elif key == "map_Kd":
+                current["texture"] = os.path.join(base_dir, line.strip()[len(key):].strip())
+    return materials
+
+
+def _first_indices(counts: np.ndarray) -> np.ndarray:
+    """Index of the first element of every group, for consecutive groups of `counts` elements."""
+    first = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=first[1:])
+    return first
+
+
+def _kind_lines(buf: np.ndarray, starts: np.ndarray, heads: np.ndarray, keyword: bytes) -> np.ndarray:
+    """
+    Indices of lines starting with a keyword followed by a space or tab.
+
+    :param heads: (number of lines, 3) array of the first bytes of every line, compared at once for all lines.
+    """
+    last = len(buf) - 1  # Newline ending the last line, so short lines never match
+    word = np.frombuffer(keyword, dtype=np.uint8)
+    lines = np.flatnonzero(np.all(heads[:, :len(word)] == word[:heads.shape[1]], axis=1))
+    # Rest of longer keywords and the blank after the keyword, only for the remaining lines
+    for i in range(heads.shape[1], len(word)):
+        lines = lines[buf[np.minimum(starts[lines] + i, last)] == word[i]]
+    after = buf[np.minimum(starts[lines] + len(word), last)]
+    return lines[(after == _SPACE) | (after == _TAB)]
+
+
+def _kind_text(data: bytes, starts: np.ndarray, ends: np.ndarray, lines: np.ndarray, keyword: bytes) -> bytes:
+    """Text of given lines, newlines included, with trailing comments and bytes of their `keyword` deleted."""
+    if len(lines) == 0:
+        return b""
+    # Lines of a kind mostly come in blocks, so slice whole blocks instead of lines
+    breaks = np.flatnonzero(np.diff(lines) != 1) + 1
+    first, last = lines[np.concatenate([[0], breaks])], lines[np.concatenate([breaks, [len(lines)]]) - 1]
+    text = b"".join([data[s:e + 1] for s, e in zip(starts[first].tolist(), ends[last].tolist())])
+    if b"#" in text:
+        text = re.sub(rb"#[^\n]*", b"", text)
+    # Numbers never contain keyword letters, delete them everywhere instead of at every line start
+    return text.translate(None, keyword)
+
+
+def _line_counts(text: bytes, byte: int = None) -> np.ndarray:
+    """Number of values (or occurrences of `byte`) on every line of text with deleted keywords."""
+    buf = np.frombuffer(text, dtype=np.uint8)
+    ends = np.flatnonzero(buf == _NEWLINE)
+    if byte is None:
+        blank = buf <= _SPACE  # Lines start with the blank after their keyword, values start after a blank
+        positions = np.flatnonzero(blank[:-1] & ~blank[1:])
+    else:
+        positions = np.flatnonzero(buf == byte)
+    return np.diff(np.searchsorted(positions, ends), prepend=0)
+
+
+def _numbers(text: bytes, dtype, count: int, path: str, keyword: bytes) -> np.ndarray:
+    """All numbers in text, which must be `count` of them, else the lines of `keyword` in `path` are malformed."""
+    try:
+        values = np.fromstring(text, dtype=dtype, sep=" ")
+    except ValueError:
+        values = None
+    if values is None or len(values) != count:
+        raise ValueError(f"Malformed '{keyword.decode()}' lines in {path}")
+    return values
+
+
+def _rows(text: bytes, width: int, path: str, keyword: bytes) -> tuple:
+    """
+    Parses lines of numbers.
+
+    :return: ((number of lines, width) float32 array of the first `width` numbers of every line, zero padded
+        if shorter, number of values on every line).
+    """
+    counts = _line_counts(text)
+    values = _numbers(text, np.float64, int(counts.sum()), path, keyword)
+    columns = np.arange(width)
+    valid = columns < counts[:, None]
+    rows = np.zeros((len(counts), width), dtype=np.float32)
+    rows[valid] = values[(_first_indices(counts)[:, None] + columns)[valid]]
+    return rows, counts
+
+
+def _resolve(indices: np.ndarray, defined: np.ndarray, name: str) -> np.ndarray:
+    """Converts 1-based and negative indices to 0-based ones, `defined` elements precede each reference."""
+    resolved = np.where(indices < 0, indices + defined, indices - 1)
+    if np.any((resolved < 0) | (resolved >= defined)):
+        raise ValueError(f"Face references a missing {name}")
+    return resolved
+
+
+def _read_statements(path: str) -> tuple:
+    """
+    Reads obj file and sorts its lines by statement.
+
+    :return: (keyword -> text of its lines for `v`, `vt`, `vn` and `f` (see `_kind_text`),
+        keyword -> line indices for those and `usemtl` and `mtllib`, line index -> argument of `usemtl` and
+        `mtllib` lines).
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if b"\r" in data:
+        data = data.replace(b"\r", b" ")
+    if not data.endswith(b"\n"):
+        data += b"\n"
+    buf = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(buf == _NEWLINE)  # Newline ending every line
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    if np.any((buf[starts] == _SPACE) | (buf[starts] == _TAB)):  # Indented statements, rare
+        data = re.sub(rb"(?m)^[ \t]+", b"", data)
+        buf = np.frombuffer(data, dtype=np.uint8)
+        ends = np.flatnonzero(buf == _NEWLINE)
+        starts = np.concatenate([[0], ends[:-1] + 1])
+
+    heads = buf[np.minimum(starts[:, None] + np.arange(3), len(buf) - 1)]
+    lines = {k: _kind_lines(buf, starts, heads, k) for k in (b"v", b"vt", b"vn", b"f", b"usemtl", b"mtllib")}
+    texts = {k: _kind_text(data, starts, ends, lines[k], k) for k in (b"v", b"vt", b"vn", b"f")}
+    arguments = {line: data[starts[line]:ends[line]].decode("utf-8").split(None, 1)[1].strip()
+                 for line in np.concatenate([lines[b"usemtl"], lines[b"mtllib"]]).tolist()}
+    return texts, lines, arguments
+
+
+def _materials(path: str, lines: dict, arguments: dict) -> tuple:
+    """
+    Loads material libraries and collects materials in order of appearance: libraries, `usemtl` of unknown
+    ones and a default for faces without any.
+
+    :return: (name -> `Material` parameters, material used after every `usemtl` line with the material of
+        faces before any first, paths of loaded libraries).
+    """
+    base_dir, params, used, libraries = os.path.dirname(path), {}, [None], []
+    statements = [(i, "mtllib") for i in lines[b"mtllib"]] + [(i, "usemtl") for i in lines[b"usemtl"]]
+    if len(lines[b"f"]) and (len(lines[b"usemtl"]) == 0 or lines[b"f"][0] < lines[b"usemtl"][0]):
+        statements.append((lines[b"f"][0], "default"))
+    for line, kind in sorted(statements):
+        if kind == "default":
+            used[0] = f"default{len(params)}"
+            params[used[0]] = _material_params(used[0])
+        elif kind == "usemtl":
+            params.setdefault(arguments[line], _material_params(arguments[line]))
+            used.append(arguments[line])
+        else:
+            library = os.path.join(base_dir, arguments[line])
+            try:
+                params.update(parse_mtl(library))
+                libraries.append(library)
+            except OSError:
+                pass  # Missing library, its materials get default parameters
+    return params, used, libraries
+
+
+def parse_obj(path: str) -> tuple:
+    """
+    Parses wavefront obj file and its material libraries.
+
+    Faces with more than three vertices are split into triangles (v1, v2, v3), (v4, v1, v3), (v5, v1, v4)...
+    Faces without material use a default one, and materials missing from libraries get default parameters.
+
+    :param path: Path of .obj file.
+    :return: ([(Material, float32 triangle soup)] for every material with faces, [paths of .mtl libraries]).
+    """
+    texts, lines, arguments = _read_statements(path)
+    params, used, libraries = _materials(path, lines, arguments)
+
+    # Vertices: positions, optionally followed by a color (or a w coordinate, which is ignored)
+    v_values, v_counts = _rows(texts.pop(b"v"), 6, path, b"v")
+    positions, colors, has_color = v_values[:, :3], v_values[:, 3:], v_counts >= 6
+    tex_coords = _rows(texts.pop(b"vt"), 2, path, b"vt")[0]
+    normals = _rows(texts.pop(b"vn"), 3, path, b"vn")[0]
+
+    # Faces: "v", "v/vt", "v//vn" or "v/vt/vn" references, the empty vt of "v//vn" is read as 0
+    f_text, f_lines = texts.pop(b"f"), lines[b"f"]
+    corner_counts = _line_counts(f_text)
+    slashes = _line_counts(f_text, _SLASH)
+    fields = slashes // np.maximum(corner_counts, 1) + 1
+    if slashes.sum() != np.sum(corner_counts * (fields - 1)):
+        raise ValueError(f"Faces of {path} mix vertex references of different formats")
+    refs = _numbers(f_text.replace(b"//", b"/0/").translate(_SLASH_TO_SPACE), np.int64,
+                    int(np.sum(corner_counts * fields)), path, b"f")
+    del f_text
+
+    # Every face corner: its line and the index of its vertex reference in `refs`
+    corner_face = np.repeat(np.arange(len(f_lines)), corner_counts)
+    face_first = _first_indices(corner_counts)
+    corner_fields = fields[corner_face]
+    corner_ref = _first_indices(corner_counts * fields)[corner_face] + \
+        (np.arange(len(corner_face)) - face_first[corner_face]) * corner_fields
+    corner_line = f_lines[corner_face]
+    corner_v = _resolve(refs[corner_ref], np.searchsorted(lines[b"v"], corner_line), "vertex")
+    del corner_face
+
+    # Fan triangulation, matching the corner order other wavefront readers emit
+    tri_counts = np.maximum(corner_counts - 2, 0)
+    tri_face = np.repeat(np.arange(len(f_lines)), tri_counts)
+    k = np.arange(len(tri_face)) - _first_indices(tri_counts)[tri_face]
+    base = face_first[tri_face]
+    triangles = np.where((k == 0)[:, None], base[:, None] + np.arange(3),
+                         np.stack([base + k + 2, base, base + k + 1], axis=1))
+    tri_use = np.searchsorted(lines[b"usemtl"], f_lines[tri_face])  # Number of `usemtl` lines before each one
+    del tri_face, k, base
+
+    parts = []
+    used = np.array(used, dtype=object)
+    for name, p in params.items():
+        corners = triangles[np.isin(tri_use, np.flatnonzero(used == name))].ravel()
+        if len(corners) == 0:
+            continue
+        # Format of the material comes from its first corner, like in other wavefront readers
+        first = corners[0]
+        if np.any(corner_fields[corners] != corner_fields[first]):
+            raise ValueError(f"Material {name} of {path} has faces with different vertex formats")
+        v = corner_v[corners]
+        attributes = []  # (format, values, index of every corner's values)
+        if corner_fields[first] >= 2 and refs[corner_ref[first] + 1] != 0:
+            t = _resolve(refs[corner_ref[corners] + 1], np.searchsorted(lines[b"vt"], corner_line[corners]),
+                         "texture coordinate")
+            attributes.append(("T2F", tex_coords, t))
+        if has_color[v[0]]:
+            attributes.append(("C3F", colors, v))
+        if corner_fields[first] == 3:
+            n = _resolve(refs[corner_ref[corners] + 2], np.searchsorted(lines[b"vn"], corner_line[corners]),
+                         "normal")
+            attributes.append(("N3F", normals, n))
+        attributes.append(("V3F", positions, v))
+
+        # Interleave one attribute at a time, so only one of them is ever gathered into a temporary array
+        vertices = np.empty((len(corners), sum(values.shape[1] for _, values, _ in attributes)), dtype=np.float32)
+        column = 0
+        for _, values, index in attributes:
+            vertices[:, column:column + values.shape[1]] = values[index]
+            column += values.shape[1]
+        vertex_format = "_".join(attr for attr, _, _ in attributes)
+        material = Material(name, vertex_format, p["ambient"], p["diffuse"], p["specular"], p["shininess"],
+                            p["texture"])
+        parts.append((material, vertices.ravel()))
+    return parts, libraries